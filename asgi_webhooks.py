@@ -0,0 +1,102 @@
+"""ASGI-точка входа для webhook-ботов на Flask (flask_app.py, flask2.py, bot/flask_app.py).
+
+Под обычным Flask каждый async-маршрут выполняется в новом цикле событий,
+поэтому соединения с Telegram и пул потоков для БД не переиспользуются.
+Здесь все webhook-запросы обрабатываются в одном долгоживущем цикле ASGI-сервера:
+общий httpx-клиент открывается при старте, а запросы к БД через sync_to_async
+идут в один поток-исполнитель asgiref. Остальные маршруты (set_webhook и т.п.)
+по-прежнему обслуживает Flask через WsgiToAsgi.
+
+Запуск:
+    WEBHOOK_APP=flask_app uvicorn asgi_webhooks:application --host 0.0.0.0 --port 8000
+
+Несколько ботов в одном процессе - BOT_TOKENS="школа1=токен1,школа2=токен2"
+(см. bot/multibot.py): у каждого свой webhook-путь и свой HTTP-клиент.
+"""
+import importlib
+import json
+import logging
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.exceptions import ImproperlyConfigured
+
+from bot import telegram_api
+from bot.recording import record_update
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookApplication:
+    def __init__(self, module_name, max_connections=100):
+        # Модуль бота при импорте настраивает Django и создает Flask-приложение
+        self.module = importlib.import_module(module_name)
+        # Модуль с несколькими ботами (BOT_TOKENS, bot/multibot.py): путь -> бот
+        bots = getattr(self.module, 'BOTS', None)
+        if not bots and not self.module.TOKEN:
+            # Иначе webhook ждал бы запросов на путь "/None"
+            raise ImproperlyConfigured(f"{module_name}: не задан ни BOT_TOKENS, ни TELEGRAM_TOKEN")
+        self.webhook_path = f"/{self.module.TOKEN}"
+        self.webhook_paths = {bot.webhook_path: bot for bot in bots} if bots else {self.webhook_path: None}
+        self.max_connections = max_connections
+        self.wsgi = WsgiToAsgi(self.module.app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] in self.webhook_paths:
+            await self.webhook(self.webhook_paths[scope['path']], receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await telegram_api.open_async_client(self.max_connections)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await telegram_api.close_async_client()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def webhook(self, bot, receive, send):
+        try:
+            update = json.loads(await _read_body(receive))
+            logger.debug(f"Получен update: {update.get('update_id')}")
+            awaiting_password = getattr(self.module, 'awaiting_password', None)
+            # Пароль родителя не пишется в журнал (bot/recording.py)
+            secret = awaiting_password is not None and awaiting_password(update, bot)
+            record_update(update, bot.name if bot else None, secret=secret)
+            if bot is None:
+                await self.module.process_update(update)
+            else:
+                await self.module.process_update(update, bot)
+            result = {'status': 'ok'}
+        except Exception as e:
+            logger.error(f"Ошибка при обработке webhook: {e}")
+            result = {'status': 'error', 'message': str(e)}
+
+        # Как и маршрут Flask, всегда отвечаем 200: иначе Telegram будет повторять update
+        body = json.dumps(result).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+
+async def _read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+application = WebhookApplication(
+    os.environ.get('WEBHOOK_APP', 'flask_app'),
+    max_connections=int(os.environ.get('TELEGRAM_MAX_CONNECTIONS', 100)),
+)
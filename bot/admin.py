@@ -1,27 +1,73 @@
 from django.contrib import admin
-from .models import Child, KindDeed, Reward, Parent
+from .admin_paging import LargeTableAdmin
+from .ledger import correct_points
+from .models import Child, DeedRollup, DigestRun, KindDeed, PointsTransaction, Reward, Parent
 
 @admin.register(Child)
-class ChildAdmin(admin.ModelAdmin):
+class ChildAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('name', 'telegram_id', 'total_points', 'created_at')
     search_fields = ('name', 'telegram_id')
     list_filter = ('created_at',)
 
 @admin.register(Parent)
-class ParentAdmin(admin.ModelAdmin):
+class ParentAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('name', 'telegram_id', 'created_at')
     search_fields = ('name', 'telegram_id')
     list_filter = ('created_at',)
     filter_horizontal = ('children',)
 
 @admin.register(KindDeed)
-class KindDeedAdmin(admin.ModelAdmin):
+class KindDeedAdmin(LargeTableAdmin, admin.ModelAdmin):
     list_display = ('description', 'points', 'child', 'added_by', 'created_at')
+    # Ребенок и родитель подгружаются в том же запросе, а не по запросу на строку
+    list_select_related = ('child', 'added_by')
     list_filter = ('created_at', 'added_by')
+    date_hierarchy = 'created_at'
     search_fields = ('description',)
     autocomplete_fields = ('child', 'added_by')
 
 @admin.register(Reward)
 class RewardAdmin(admin.ModelAdmin):
     list_display = ('name', 'points_required')
-    search_fields = ('name',)
\ No newline at end of file
+    search_fields = ('name',)
+
+@admin.register(DigestRun)
+class DigestRunAdmin(admin.ModelAdmin):
+    list_display = ('week_start', 'sent', 'failed', 'last_parent_id', 'started_at', 'finished_at')
+    readonly_fields = ('last_parent_id', 'sent', 'failed', 'started_at', 'finished_at')
+
+@admin.register(PointsTransaction)
+class PointsTransactionAdmin(LargeTableAdmin, admin.ModelAdmin):
+    """Журнал только пополняется: из админки можно добавить исправление, но не изменить запись"""
+    list_display = ('child', 'kind', 'amount', 'reward', 'description', 'created_at')
+    list_select_related = ('child', 'reward')
+    list_filter = ('kind', 'created_at')
+    date_hierarchy = 'created_at'
+    search_fields = ('description',)
+    autocomplete_fields = ('child',)
+    fields = ('child', 'amount', 'description')
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def save_model(self, request, obj, form, change):
+        entry = correct_points(obj.child_id, obj.amount, obj.description or "Исправление из админки")
+        obj.pk, obj.kind, obj.created_at = entry.pk, entry.kind, entry.created_at
+        obj._state.adding = False
+
+@admin.register(DeedRollup)
+class DeedRollupAdmin(admin.ModelAdmin):
+    """Итоги архивных дел; меняются только командой archive_deeds"""
+    list_display = ('child', 'month', 'deeds', 'points')
+    list_select_related = ('child',)
+    date_hierarchy = 'month'
+    autocomplete_fields = ('child',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
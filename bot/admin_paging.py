@@ -0,0 +1,99 @@
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Параметр адреса с последним показанным pk
+CURSOR_VAR = 'after'
+
+# Ниже этого порога оценка заменяется точным COUNT(*): он и так быстрый
+EXACT_COUNT_THRESHOLD = 10000
+
+
+def estimated_table_count(model, using='default'):
+    """Примерное число строк таблицы без COUNT(*) или None, если база не умеет оценивать"""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [table])
+        elif connection.vendor == 'sqlite':
+            # rowid растет с каждой вставкой: после удалений оценка завышена
+            cursor.execute(f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}")
+        else:
+            return None
+        row = cursor.fetchone()
+    return max(row[0] or 0, 0) if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор админки, который не считает большие таблицы целиком.
+
+    Для списка без фильтров берет оценку из статистики базы; с фильтрами или
+    на маленькой таблице считает точно, как обычный Paginator.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_table_count(queryset.model, queryset.db)
+            if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class KeysetChangeList(ChangeList):
+    """Список админки с переходом по ключу вместо OFFSET.
+
+    При сортировке по умолчанию (по убыванию pk) следующая страница - это
+    записи с pk меньше последнего показанного, так что глубокие страницы
+    открываются так же быстро, как первая. При сортировке по колонке или
+    "Показать все" работает обычная нумерация страниц.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = None
+        if CURSOR_VAR in request.GET:
+            # Убираем параметр до разбора фильтров: иначе админка сочтет его полем модели
+            request.GET = request.GET.copy()
+            try:
+                self.cursor = int(request.GET.pop(CURSOR_VAR)[0])
+            except ValueError:
+                pass
+        self.next_cursor = None
+        super().__init__(request, *args, **kwargs)
+
+    @property
+    def keyset(self):
+        return ORDER_VAR not in self.params and not self.show_all
+
+    def get_results(self, request):
+        super().get_results(request)
+        if not self.keyset:
+            return
+        if self.cursor is not None:
+            self.result_list = self.queryset.filter(pk__lt=self.cursor)[:self.list_per_page]
+        # Заполняет кэш queryset: шаблон повторно в базу не пойдет
+        page = list(self.result_list)
+        if len(page) == self.list_per_page:
+            self.next_cursor = page[-1].pk
+
+    @property
+    def next_page_url(self):
+        return self.get_query_string({CURSOR_VAR: self.next_cursor}, [PAGE_VAR])
+
+    @property
+    def first_page_url(self):
+        return self.get_query_string(remove=[PAGE_VAR, CURSOR_VAR])
+
+
+class LargeTableAdmin:
+    """Примесь к ModelAdmin для больших таблиц: без COUNT(*) и с переходом по ключу"""
+    ordering = ('-pk',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
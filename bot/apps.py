@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class BotConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bot'
+
+    def ready(self):
+        # Серии, значки и журнал баллов обновляются сигналами при любом варианте бота и в админке
+        from bot import ledger, progress  # noqa: F401
+        from bot.db_router import connect_signals
+
+        connect_signals()
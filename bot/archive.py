@@ -0,0 +1,155 @@
+"""Перенос старых добрых дел из KindDeed в сжатый архив.
+
+Перед удалением из KindDeed дела складываются в месячные итоги (DeedRollup)
+и в сжатые годовые пачки (DeedArchive), так что история не теряется, а
+горячая таблица остается маленькой. Баллы ребенка не меняются: они хранятся
+в Child.total_points и журнале баллов, которые от KindDeed не зависят.
+У каждого ребенка в KindDeed всегда остаются последние ``keep_recent`` дел,
+чтобы "последние добрые дела" показывались как раньше.
+"""
+import datetime
+import json
+import logging
+import zlib
+from collections import defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.utils import timezone
+
+from bot.ledger import without_deed_corrections
+from bot.models import DeedArchive, DeedRollup, KindDeed
+
+logger = logging.getLogger(__name__)
+
+DEED_FIELDS = ('id', 'child_id', 'description', 'points', 'added_by_id', 'created_at')
+
+
+def archivable_deeds(cutoff, keep_recent=5):
+    """Дела старше ``cutoff``, кроме последних ``keep_recent`` дел каждого ребенка"""
+    deeds = KindDeed.objects.filter(created_at__lt=cutoff)
+    if keep_recent > 0:
+        newest_kept = (
+            KindDeed.objects.filter(child_id=OuterRef('child_id'))
+            .order_by('-created_at')
+            .values('created_at')[keep_recent - 1:keep_recent]
+        )
+        # Если у ребенка меньше keep_recent дел, подзапрос пуст и дело остается
+        deeds = deeds.filter(created_at__lt=Subquery(newest_kept))
+    return deeds
+
+
+def _fold_rollups(rows):
+    totals = defaultdict(lambda: [0, 0])
+    for row in rows:
+        month = timezone.localdate(row['created_at']).replace(day=1)
+        item = totals[(row['child_id'], month)]
+        item[0] += 1
+        item[1] += row['points']
+
+    existing = {
+        (rollup.child_id, rollup.month): rollup
+        for rollup in DeedRollup.objects.filter(
+            child_id__in={child_id for child_id, _ in totals},
+            month__in={month for _, month in totals},
+        )
+    }
+    created, updated = [], []
+    for (child_id, month), (deeds, points) in totals.items():
+        rollup = existing.get((child_id, month))
+        if rollup is None:
+            created.append(DeedRollup(child_id=child_id, month=month, deeds=deeds, points=points))
+        else:
+            rollup.deeds += deeds
+            rollup.points += points
+            updated.append(rollup)
+    DeedRollup.objects.bulk_create(created)
+    DeedRollup.objects.bulk_update(updated, ['deeds', 'points'])
+
+
+def _pack(rows):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[(row['child_id'], timezone.localdate(row['created_at']).year)].append(row)
+    archives = []
+    for (child_id, year), deeds in groups.items():
+        payload = [
+            [row['id'], row['description'], row['points'], row['added_by_id'], row['created_at'].isoformat()]
+            for row in deeds
+        ]
+        archives.append(DeedArchive(
+            child_id=child_id,
+            year=year,
+            deeds=len(deeds),
+            points=sum(row['points'] for row in deeds),
+            first_created_at=min(row['created_at'] for row in deeds),
+            last_created_at=max(row['created_at'] for row in deeds),
+            payload=zlib.compress(json.dumps(payload, ensure_ascii=False).encode(), 9),
+        ))
+    DeedArchive.objects.bulk_create(archives)
+    return len(archives)
+
+
+def load_archived_deeds(archive):
+    """Дела из архивной пачки: список словарей с полями KindDeed"""
+    return [
+        {
+            'id': deed_id,
+            'child_id': archive.child_id,
+            'description': description,
+            'points': points,
+            'added_by_id': added_by_id,
+            'created_at': datetime.datetime.fromisoformat(created_at),
+        }
+        for deed_id, description, points, added_by_id, created_at in json.loads(zlib.decompress(archive.payload))
+    ]
+
+
+def archived_points(child_id):
+    """Сумма баллов за дела ребенка, уже перенесенные в архив"""
+    return DeedRollup.objects.filter(child_id=child_id).aggregate(total=Sum('points'))['total'] or 0
+
+
+def archive_deeds(older_than_days=365, keep_recent=5, batch_size=1000, dry_run=False):
+    """Переносит старые дела в архив пачками по ``batch_size``; возвращает статистику.
+
+    Каждая пачка - отдельная транзакция: итоги, архив и удаление из KindDeed
+    либо сохраняются вместе, либо не сохраняются вовсе, и прерванный запуск
+    можно просто повторить.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=older_than_days)
+    candidates = archivable_deeds(cutoff, keep_recent).order_by('pk')
+    stats = {'deeds': 0, 'points': 0, 'archives': 0, 'batches': 0}
+    if dry_run:
+        totals = candidates.order_by().aggregate(deeds=Count('pk'), points=Sum('points'))
+        stats.update(deeds=totals['deeds'], points=totals['points'] or 0)
+        return stats
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            rows = list(candidates.filter(pk__gt=last_id).values(*DEED_FIELDS)[:batch_size])
+            if not rows:
+                break
+            _fold_rollups(rows)
+            stats['archives'] += _pack(rows)
+            ids = [row['id'] for row in rows]
+            # Ссылки журнала баллов на дело обнуляются (SET_NULL), сами записи остаются;
+            # баллы за перенесенные дела не списываются
+            with without_deed_corrections():
+                KindDeed.objects.filter(pk__in=ids).delete()
+        last_id = ids[-1]
+        stats['deeds'] += len(rows)
+        stats['points'] += sum(row['points'] for row in rows)
+        stats['batches'] += 1
+        logger.info(f"Архив: перенесено {stats['deeds']} дел (до id {last_id})")
+    return stats
+
+
+def compact_database():
+    """Возвращает освободившееся после архивации место, чтобы таблица дел помещалась в кэш страниц"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("VACUUM")
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f"VACUUM ANALYZE {connection.ops.quote_name(KindDeed._meta.db_table)}")
@@ -0,0 +1,81 @@
+"""Запуск Django для отдельных точек входа (Flask, TeleBot) и ленивый режим старта.
+
+При BOT_LAZY_STARTUP=1 точки входа не настраивают Django и не импортируют
+модули бота при импорте, а делают это при первом запросе: WSGI-воркер
+поднимается быстрее, а платит за загрузку только тот запрос, которому она
+действительно нужна. Без переменной все загружается сразу, как раньше.
+"""
+import importlib.util
+import os
+import sys
+import threading
+
+_lock = threading.RLock()
+_done = set()
+
+
+def load_env():
+    """Переменные окружения из .env (дешево: нужно и ленивому режиму, например для TELEGRAM_TOKEN)"""
+    run_once('env', _load_dotenv)
+
+
+def _load_dotenv():
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+def _setup_django():
+    import django
+
+    load_env()
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
+    django.setup()
+
+
+def setup_django():
+    """.env и django.setup(); повторные вызовы ничего не делают"""
+    run_once('django', _setup_django)
+
+
+def lazy_startup():
+    """Включен ли ленивый режим (переменную можно задать и в .env)"""
+    load_env()
+    return os.environ.get('BOT_LAZY_STARTUP', '') == '1'
+
+
+def diagnostics_enabled():
+    """Открыты ли служебные маршруты со статистикой (/pool_status и т.п.).
+
+    Они на том же публичном адресе, что и webhook, и без авторизации, поэтому
+    выключены, пока не задано BOT_DIAGNOSTIC_ROUTES=1.
+    """
+    load_env()
+    return os.environ.get('BOT_DIAGNOSTIC_ROUTES', '') == '1'
+
+
+def run_once(key, func):
+    """Вызывает func() один раз на процесс (например, импорт модулей бота точкой входа)"""
+    if key in _done:
+        return
+    with _lock:
+        if key not in _done:
+            func()
+            _done.add(key)
+
+
+def lazy_import(name):
+    """Модуль, который выполняется при первом обращении к его атрибуту.
+
+    Для тяжелых зависимостей, нужных редким маршрутам (requests в служебных
+    адресах webhook): импорт точки входа их не загружает.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
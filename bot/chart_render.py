@@ -0,0 +1,29 @@
+"""Рисование графика баллов. Модуль выполняется в процессах пула bot/charts.py,
+поэтому не импортирует Django."""
+import io
+
+
+def render_png(title, labels, per_bucket, cumulative):
+    """PNG-график: столбцы - баллы за период, линия - накопленная сумма"""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    from matplotlib import pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 4), dpi=100)
+    try:
+        positions = range(len(labels))
+        ax.bar(positions, per_bucket, color="#8cc084", label="Баллы за период")
+        ax.set_title(title)
+        ax.set_xticks(list(positions)[::max(1, len(labels) // 12)])
+        ax.set_xticklabels(labels[::max(1, len(labels) // 12)], rotation=45, ha="right")
+        total_ax = ax.twinx()
+        total_ax.plot(positions, cumulative, color="#3d6fb6", marker="o", markersize=3, label="Всего")
+        handles = ax.get_legend_handles_labels()[0] + total_ax.get_legend_handles_labels()[0]
+        ax.legend(handles, [handle.get_label() for handle in handles], loc="upper left")
+        fig.tight_layout()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png")
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
@@ -0,0 +1,158 @@
+"""График баллов ребенка по дням или неделям (PNG).
+
+numpy и matplotlib - необязательные зависимости: без них ``charts_available()``
+возвращает False, и боты отвечают, что графики недоступны.
+Данные агрегируются numpy по плоским массивам из ``values_list``, а рисование
+(bot/chart_render.py) идет в отдельном процессе, чтобы не держать GIL и цикл
+событий бота.
+"""
+import asyncio
+import datetime
+import importlib.util
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from bot.archive import archived_points
+from bot.chart_render import render_png
+from bot.db_router import read_replica
+from bot.models import KindDeed, PointsTransaction
+
+PERIODS = {
+    'day': "по дням",
+    'week': "по неделям",
+}
+
+# Сколько последних дней/недель показывать
+MAX_BUCKETS = 60
+CHART_WORKERS = int(os.environ.get('CHART_WORKERS', 1))
+CACHE_LIMIT = 256
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# (child_id, period, версия данных - см. _chart_version) -> {"png": bytes, "file_id": str | None}
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+chart_stats = {'rendered': 0, 'cached': 0}
+
+
+def charts_available():
+    return all(importlib.util.find_spec(name) for name in ("numpy", "matplotlib"))
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, а не fork: процесс бота многопоточный, а рисованию Django не нужен
+            _executor = ProcessPoolExecutor(CHART_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def aggregate(timestamps, points, period, utc_offset, base=0):
+    """Баллы за каждый день/неделю и накопленная сумма.
+
+    ``timestamps`` - секунды Unix (UTC), ``utc_offset`` - смещение местного
+    времени в секундах, ``base`` - баллы до первого дела (перенесенные в архив).
+    Возвращает (номер первого периода, баллы, сумма).
+    Номер периода - дни от 1970-01-01 или недели от понедельника 1969-12-29.
+    """
+    import numpy as np
+
+    days = np.floor_divide(timestamps.astype(np.int64) + utc_offset, 86400)
+    # 1970-01-01 - четверг: сдвиг на 3 дня делает началом недели понедельник
+    buckets = np.floor_divide(days + 3, 7) if period == 'week' else days
+    first = int(buckets.min())
+    per_bucket = np.bincount(buckets - first, weights=points)
+    cumulative = np.cumsum(per_bucket) + base
+    if len(per_bucket) > MAX_BUCKETS:
+        first += len(per_bucket) - MAX_BUCKETS
+        per_bucket = per_bucket[-MAX_BUCKETS:]
+        cumulative = cumulative[-MAX_BUCKETS:]
+    return first, per_bucket, cumulative
+
+
+def _bucket_labels(first, count, period):
+    epoch = datetime.date(1970, 1, 1)
+    if period == 'week':
+        start = epoch + datetime.timedelta(weeks=first, days=-3)
+        return [f"{start + datetime.timedelta(weeks=i):%d.%m}" for i in range(count)]
+    return [f"{epoch + datetime.timedelta(days=first + i):%d.%m}" for i in range(count)]
+
+
+def _load_series(child_id):
+    import numpy as np
+
+    with read_replica(child_id):
+        rows = list(KindDeed.objects.filter(child_id=child_id).values_list('created_at', 'points'))
+    created, points = zip(*rows) if rows else ((), ())
+    timestamps = np.fromiter((moment.timestamp() for moment in created), dtype=np.float64, count=len(created))
+    return timestamps, np.asarray(points, dtype=np.float64)
+
+
+def _chart_version(child_id):
+    """Версия данных графика ребенка или None, если дел нет.
+
+    Последняя запись журнала баллов меняется при новом деле, изменении баллов
+    и удалении дела, а число дел - при переносе в архив (он журнал не пишет).
+    """
+    deeds = KindDeed.objects.filter(child_id=child_id).aggregate(last=Max('id'), count=Count('id'))
+    if deeds['last'] is None:
+        return None
+    last_entry = PointsTransaction.objects.filter(child_id=child_id).aggregate(last=Max('id'))['last']
+    return deeds['last'], deeds['count'], last_entry
+
+
+def _prepare(child_id, child_name, period):
+    """Данные для рисования (в потоке ORM) или None, если дел еще нет"""
+    timestamps, points = _load_series(child_id)
+    if not len(timestamps):
+        return None
+    utc_offset = int(timezone.localtime().utcoffset().total_seconds())
+    # Архивные дела всегда старше оставшихся в KindDeed: их баллы - начало накопленной суммы
+    first, per_bucket, cumulative = aggregate(timestamps, points, period, utc_offset, archived_points(child_id))
+    title = f"Баллы {child_name} {PERIODS[period]}"
+    return title, _bucket_labels(first, len(per_bucket), period), per_bucket.tolist(), cumulative.tolist()
+
+
+async def points_chart(child_id, child_name, period='day'):
+    """(ключ кэша, PNG или file_id уже отправленного графика); (None, None), если дел еще нет.
+
+    График пересчитывается, только когда дела или баллы ребенка изменились.
+    """
+    version = await sync_to_async(_chart_version)(child_id)
+    if version is None:
+        return None, None
+    key = (child_id, period, version)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            chart_stats['cached'] += 1
+            return key, cached['file_id'] or cached['png']
+
+    prepared = await sync_to_async(_prepare)(child_id, child_name, period)
+    if prepared is None:
+        return None, None
+    png = await asyncio.get_running_loop().run_in_executor(_get_executor(), render_png, *prepared)
+    chart_stats['rendered'] += 1
+    with _cache_lock:
+        _cache[key] = {'png': png, 'file_id': None}
+        while len(_cache) > CACHE_LIMIT:
+            _cache.popitem(last=False)
+    return key, png
+
+
+def remember_file_id(key, file_id):
+    """После первой отправки Telegram хранит файл сам: дальше шлем только file_id"""
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            cached['file_id'] = file_id
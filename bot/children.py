@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.db.models import Exists, OuterRef
+from django.db.models.signals import m2m_changed
+from django.dispatch import receiver
+
+from bot.models import Child, Parent, normalize_name
+
+# Сколько секунд доверять запомненному списку детей родителя: изменения,
+# сделанные в другом процессе (например, в админке), видны не позже
+PARENT_MAP_TTL = 300
+PARENT_MAP_LIMIT = 10000
+
+# parent_id -> (истекает, {name_key: telegram_id ребенка})
+_parent_maps = OrderedDict()
+_lock = threading.Lock()
+
+
+def remember_parent_children(parent_id, children):
+    """Запоминает имена детей родителя; вызывается там, где список детей и так загружен"""
+    names = {}
+    for child in sorted(children, key=lambda child: child.pk):
+        names.setdefault(child.name_key, child.pk)
+    with _lock:
+        _parent_maps[parent_id] = (time.monotonic() + PARENT_MAP_TTL, names)
+        _parent_maps.move_to_end(parent_id)
+        while len(_parent_maps) > PARENT_MAP_LIMIT:
+            _parent_maps.popitem(last=False)
+
+
+def forget_parent_children(parent_id):
+    with _lock:
+        _parent_maps.pop(parent_id, None)
+
+
+def _known_children(parent_id):
+    with _lock:
+        item = _parent_maps.get(parent_id)
+        if item is None or item[0] < time.monotonic():
+            return None
+        return item[1]
+
+
+@receiver(m2m_changed, sender=Parent.children.through)
+def _parent_children_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        forget_parent_children(instance.pk)
+    elif pk_set:
+        for parent_id in pk_set:
+            forget_parent_children(parent_id)
+    else:
+        # child.parents.clear(): затронутые родители неизвестны
+        with _lock:
+            _parent_maps.clear()
+
+
+def _name_query(key, parent):
+    """Запрос по индексу name_key. Если родитель известен, его дети идут первыми;
+    среди одинаковых имен выбирается ребенок с меньшим telegram_id.
+    Возвращает (запрос, None) или (None, telegram_id), если ответ уже известен из памяти.
+    """
+    queryset = Child.objects.filter(name_key=key)
+    if parent is None:
+        return queryset.order_by('pk'), None
+    known = _known_children(parent.pk)
+    if known is not None:
+        if key in known:
+            return None, known[key]
+        return queryset.order_by('pk'), None
+    own = Parent.children.through.objects.filter(parent_id=parent.pk, child_id=OuterRef('pk'))
+    return queryset.annotate(own=Exists(own)).order_by('-own', 'pk'), None
+
+
+def find_child_by_name(name, parent=None):
+    """Ребенок по имени без учета регистра и ё/е - один запрос по индексу"""
+    key = normalize_name(name)
+    if not key:
+        return None
+    queryset, child_id = _name_query(key, parent)
+    if queryset is None:
+        child = Child.objects.filter(pk=child_id).first()
+        if child is not None and child.name_key == key:
+            return child
+        # Ребенка уже удалили или переименовали: память родителя устарела
+        forget_parent_children(parent.pk)
+        queryset, _ = _name_query(key, parent)
+    return queryset.first()
+
+
+async def afind_child_by_name(name, parent=None):
+    """То же для async ORM"""
+    key = normalize_name(name)
+    if not key:
+        return None
+    queryset, child_id = _name_query(key, parent)
+    if queryset is None:
+        child = await Child.objects.filter(pk=child_id).afirst()
+        if child is not None and child.name_key == key:
+            return child
+        forget_parent_children(parent.pk)
+        queryset, _ = _name_query(key, parent)
+    return await queryset.afirst()
@@ -0,0 +1,106 @@
+"""Чтение статистики через отдельное соединение только для чтения.
+
+Экраны баллов, наград, статистика детей и сводки читают много, а запись
+дел - короткие частые транзакции. Запросы внутри ``read_replica()`` уходят
+в соединение 'replica' (settings.DATABASES): для SQLite это тот же файл,
+открытый только на чтение, в режиме WAL читатели не мешают писателю; для
+PostgreSQL - реплика. Все остальное, в том числе любая запись, идет в 'default'.
+
+Реплика может отставать, поэтому после записи или удаления ребенка, его
+дела или записи журнала баллов чтения по этому ребенку еще STICKY_SECONDS
+идут в 'default' (пользователь видит свои изменения). Отметки хранятся в
+памяти процесса: запись, сделанная другим воркером, их не ставит, и там
+чтение из реплики может отставать. Сигналы не срабатывают и на
+QuerySet.update(), поэтому такие записи отмечаются явно mark_written()
+(как в ledger.add_points).
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connections
+from django.db.models.signals import post_delete, post_save
+
+READ_ALIAS = 'replica'
+WRITE_ALIAS = 'default'
+STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+STICKY_LIMIT = 10000
+
+# Ключи (telegram_id детей) текущего read_replica(); None - вне read_replica()
+_read_keys = contextvars.ContextVar('db_read_keys', default=None)
+
+# telegram_id ребенка -> до какого момента читать его данные из 'default'
+_sticky = {}
+_sticky_lock = threading.Lock()
+
+
+@contextmanager
+def read_replica(*keys):
+    """Чтения внутри блока - из реплики; ``keys`` - дети, чьи свежие записи надо видеть"""
+    token = _read_keys.set(keys)
+    try:
+        yield
+    finally:
+        _read_keys.reset(token)
+
+
+def mark_written(key):
+    """Ближайшие STICKY_SECONDS данные ``key`` читаются из 'default'"""
+    until = time.monotonic() + STICKY_SECONDS
+    with _sticky_lock:
+        _sticky[key] = until
+        if len(_sticky) > STICKY_LIMIT:
+            now = time.monotonic()
+            for stale in [k for k, expires in _sticky.items() if expires < now]:
+                del _sticky[stale]
+
+
+def _is_sticky(keys):
+    now = time.monotonic()
+    return any(_sticky.get(key, 0) > now for key in keys)
+
+
+def _replica_usable():
+    if READ_ALIAS not in connections.settings:
+        return False
+    replica = connections.settings[READ_ALIAS]
+    default = connections.settings[WRITE_ALIAS]
+    if default['ENGINE'].endswith('sqlite3'):
+        # Временная тестовая база (bench_handlers и т.п.) - уже не тот файл, что открывает реплика
+        return str(default['NAME']) in str(replica['NAME'])
+    return True
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        keys = _read_keys.get()
+        if keys is None or model._meta.app_label != 'bot':
+            return None
+        if _is_sticky(keys) or not _replica_usable():
+            return WRITE_ALIAS
+        return READ_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return WRITE_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплика - копия 'default': объекты из обоих соединений можно связывать
+        return {obj1._state.db, obj2._state.db} <= {WRITE_ALIAS, READ_ALIAS, None}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == WRITE_ALIAS
+
+
+def _mark_child_written(sender, instance, **kwargs):
+    mark_written(instance.child_id if hasattr(instance, 'child_id') else instance.pk)
+
+
+def connect_signals():
+    from bot.models import Child, KindDeed, PointsTransaction
+
+    for model in (Child, KindDeed, PointsTransaction):
+        post_save.connect(_mark_child_written, sender=model, dispatch_uid=f'db_router_{model.__name__}')
+        # Удаление дела (в том числе перенос в архив) тоже меняет экраны ребенка
+        post_delete.connect(_mark_child_written, sender=model, dispatch_uid=f'db_router_delete_{model.__name__}')
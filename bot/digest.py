@@ -0,0 +1,224 @@
+import asyncio
+import datetime
+import logging
+import time
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+
+from bot.db_router import read_replica
+from bot.models import DigestDelivery, DigestRun, Parent
+from bot.telegram_api import call_api
+
+logger = logging.getLogger(__name__)
+
+# Сколько раз повторять отправку при сетевых ошибках и ошибках Telegram
+SEND_ATTEMPTS = 3
+
+
+def week_bounds(week_start=None):
+    """Начало и конец недели (aware datetime); по умолчанию - прошлая полная неделя"""
+    if week_start is None:
+        today = timezone.localdate()
+        week_start = today - datetime.timedelta(days=today.weekday() + 7)
+    start = timezone.make_aware(datetime.datetime.combine(week_start, datetime.time.min))
+    return week_start, start, start + datetime.timedelta(days=7)
+
+
+def collect_summaries(parent_ids, start, end):
+    """Сводка по детям для пачки родителей одним агрегирующим запросом.
+
+    Возвращает {parent_id: [(имя, дел за неделю, баллов за неделю, всего баллов), ...]}.
+    """
+    week = Q(child__deeds__created_at__gte=start, child__deeds__created_at__lt=end)
+    rows = (
+        Parent.children.through.objects
+        .filter(parent_id__in=parent_ids)
+        .values('parent_id', 'child_id', 'child__name', 'child__total_points')
+        .annotate(
+            week_deeds=Count('child__deeds', filter=week),
+            week_points=Sum('child__deeds__points', filter=week),
+        )
+        .order_by('parent_id', 'child__name')
+    )
+    summaries = {}
+    # Сводке не важны записи последних секунд: читаем из реплики
+    with read_replica():
+        for row in rows:
+            summaries.setdefault(row['parent_id'], []).append(
+                (row['child__name'], row['week_deeds'], row['week_points'] or 0, row['child__total_points'])
+            )
+    return summaries
+
+
+def format_digest(week_start, children):
+    lines = [f"📬 Итоги недели с {week_start:%d.%m}:", ""]
+    for name, deeds, points, total in children:
+        if deeds:
+            lines.append(f"• {name}: добрых дел - {deeds}, +{points} баллов (всего {total})")
+        else:
+            lines.append(f"• {name}: на этой неделе добрых дел не было (всего {total} баллов)")
+    return "\n".join(lines)
+
+
+class TokenBucket:
+    """Общий для всех отправок лимит: не больше ``rate`` запросов в секунду"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # Telegram ответил 429: останавливаем всю рассылку, а не один запрос
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class DigestSender:
+    """Рассылка сводки за неделю с ограничением скорости и продолжением после сбоя.
+
+    Родители перебираются по возрастанию telegram_id пачками по ``batch_size``.
+    Результат каждой отправки сразу записывается в DigestDelivery, поэтому
+    после перезапуска уже получившие сводку родители пропускаются, а после
+    каждой пачки DigestRun.last_parent_id сдвигается, чтобы не перебирать
+    обработанных родителей заново.
+    """
+
+    def __init__(self, token, week_start=None, rate=25, concurrency=20, batch_size=500, dry_run=False):
+        self.token = token
+        self.week_start, self.start, self.end = week_bounds(week_start)
+        self.bucket = TokenBucket(rate)
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.run = None
+        # Итоги этого запуска (в DigestRun - итоги всей рассылки за неделю)
+        self.sent = 0
+        self.failed = 0
+
+    async def send_all(self):
+        if self.dry_run:
+            # Пробный прогон ничего не пишет в базу
+            self.run = await DigestRun.objects.filter(week_start=self.week_start).afirst()
+            self.run = self.run or DigestRun(week_start=self.week_start)
+        else:
+            self.run, _ = await DigestRun.objects.aget_or_create(week_start=self.week_start)
+        if self.run.finished_at:
+            logger.info(f"Сводка за неделю с {self.week_start} уже разослана")
+            return self.run
+        if self.run.last_parent_id:
+            logger.info(f"Продолжаем рассылку после родителя {self.run.last_parent_id}")
+
+        parents = (
+            Parent.objects.filter(telegram_id__gt=self.run.last_parent_id)
+            .order_by('telegram_id')
+            .values_list('telegram_id', flat=True)
+            .iterator(chunk_size=self.batch_size)
+        )
+        # Итератор держит курсор, поэтому читаем его всегда в одном потоке (thread_sensitive)
+        next_batch = sync_to_async(lambda: list(islice(parents, self.batch_size)))
+        while parent_ids := await next_batch():
+            sent, failed = await self._send_batch(parent_ids)
+            if self.dry_run:
+                continue
+            await DigestRun.objects.filter(pk=self.run.pk).aupdate(last_parent_id=parent_ids[-1])
+            logger.info(f"Сводка: обработаны родители до {parent_ids[-1]}, отправлено {sent}, ошибок {failed}")
+
+        if not self.dry_run:
+            await self._save_totals(finished_at=timezone.now())
+        return self.run
+
+    async def retry_failed(self):
+        """Повторная отправка родителям, которым не удалось доставить сводку"""
+        self.run = await DigestRun.objects.aget(week_start=self.week_start)
+        parent_ids = [
+            parent_id async for parent_id in self.run.deliveries
+            .filter(status=DigestDelivery.FAILED).values_list('parent_id', flat=True)
+        ]
+        for i in range(0, len(parent_ids), self.batch_size):
+            await self._send_batch(parent_ids[i:i + self.batch_size])
+        if not self.dry_run:
+            await self._save_totals()
+        return self.run
+
+    async def _save_totals(self, **fields):
+        # Итоги считаются по DigestDelivery: так в них попадают и отправки прерванных запусков
+        deliveries = self.run.deliveries.all()
+        await DigestRun.objects.filter(pk=self.run.pk).aupdate(
+            sent=await deliveries.filter(status=DigestDelivery.SENT).acount(),
+            failed=await deliveries.filter(status=DigestDelivery.FAILED).acount(),
+            **fields,
+        )
+        await self.run.arefresh_from_db()
+
+    async def _send_batch(self, parent_ids):
+        done = await sync_to_async(set)(
+            DigestDelivery.objects.filter(run_id=self.run.pk, parent_id__in=parent_ids)
+            .exclude(status=DigestDelivery.FAILED)
+            .values_list('parent_id', flat=True)
+        )
+        pending = [parent_id for parent_id in parent_ids if parent_id not in done]
+        summaries = await sync_to_async(collect_summaries)(pending, self.start, self.end)
+        statuses = await asyncio.gather(*(
+            self._deliver(parent_id, format_digest(self.week_start, children))
+            for parent_id, children in summaries.items()
+        ))
+        sent, failed = statuses.count(DigestDelivery.SENT), statuses.count(DigestDelivery.FAILED)
+        self.sent += sent
+        self.failed += failed
+        return sent, failed
+
+    async def _deliver(self, parent_id, text):
+        if self.dry_run:
+            return DigestDelivery.SENT
+        async with self.semaphore:
+            status = await self._send(parent_id, text)
+        await DigestDelivery.objects.aupdate_or_create(
+            run=self.run, parent_id=parent_id, defaults={'status': status}
+        )
+        return status
+
+    async def _send(self, chat_id, text):
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            await self.bucket.acquire()
+            try:
+                response_json = await call_api(self.token, 'sendMessage', {'chat_id': chat_id, 'text': text})
+            except Exception as e:
+                logger.warning(f"Сводка для {chat_id}: ошибка сети (попытка {attempt}): {e}")
+                await asyncio.sleep(attempt)
+                continue
+            if response_json.get('ok'):
+                return DigestDelivery.SENT
+            error_code = response_json.get('error_code')
+            if error_code == 429:
+                retry_after = response_json.get('parameters', {}).get('retry_after', 1)
+                logger.warning(f"Telegram ограничил частоту отправки, пауза {retry_after} с")
+                self.bucket.pause(retry_after)
+                continue
+            if error_code in (400, 403):
+                # Бот заблокирован или чат недоступен: повтор не поможет
+                logger.info(f"Сводка для {chat_id} не доставлена: {response_json.get('description')}")
+                return DigestDelivery.BLOCKED
+            logger.warning(f"Сводка для {chat_id}: ошибка Telegram (попытка {attempt}): {response_json}")
+            await asyncio.sleep(attempt)
+        return DigestDelivery.FAILED
@@ -1,11 +1,13 @@
 from flask import Flask, request, jsonify
 import os
-import django
 import logging
 import json
-from dotenv import load_dotenv
 from asgiref.sync import sync_to_async
-import requests
+
+from bot.bootstrap import lazy_import, setup_django
+
+# requests нужен только служебным маршрутам webhook
+requests = lazy_import('requests')
 
 # Настройка логгирования
 logging.basicConfig(
@@ -18,15 +20,18 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения
-load_dotenv()
-
-# Настройка Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
-django.setup()
+# Переменные окружения из .env и настройка Django
+setup_django()
 
 # Импорт необходимых модулей из вашего проекта
 from bot.models import Child, KindDeed, Reward, Parent
+from bot.children import find_child_by_name, remember_parent_children
+from bot.db_router import read_replica
+from bot.passwords import ahash_password, averify_parent_password, mark_verified
+from bot.ledger import add_points
+from bot.progress import atake_progress, format_progress
+from bot.recording import record_update
+from bot.telegram_api import call_api
 
 # Создаем Flask-приложение
 app = Flask(__name__)
@@ -66,11 +71,13 @@ def get_child(telegram_id):
 
 @sync_to_async
 def get_recent_deeds(child, limit=5):
-    return list(child.deeds.order_by('-created_at')[:limit])
+    with read_replica(child.pk):
+        return list(child.deeds.order_by('-created_at')[:limit])
 
 @sync_to_async
 def get_rewards():
-    return list(Reward.objects.all().order_by('points_required'))
+    with read_replica():
+        return list(Reward.objects.all().order_by('points_required'))
 
 @sync_to_async
 def create_deed(child, description, points, parent=None):
@@ -83,9 +90,7 @@ def create_deed(child, description, points, parent=None):
 
 @sync_to_async
 def update_child_points(child, points):
-    child.total_points += points
-    child.save()
-    return child.total_points
+    return add_points(child, points)
 
 @sync_to_async
 def get_or_create_parent(telegram_id, name):
@@ -106,39 +111,31 @@ def verify_parent(telegram_id):
         return None, False
 
 @sync_to_async
-def get_child_by_name(name):
-    try:
-        return Child.objects.get(name=name)
-    except Child.DoesNotExist:
-        return None
-    except Child.MultipleObjectsReturned:
-        return Child.objects.filter(name=name).first()
+def get_child_by_name(name, parent=None):
+    # Без учета регистра и ё/е; при совпадении имен дети родителя идут первыми
+    return find_child_by_name(name, parent)
 
 @sync_to_async
 def is_parent_of_child(parent, child):
     return parent.children.filter(telegram_id=child.telegram_id).exists()
 
-@sync_to_async
-def set_parent_password(parent, password):
+async def set_parent_password(parent, password):
     """Установка пароля родителя"""
-    import hashlib
-    # Простое хеширование пароля (в реальном проекте используйте более надежные методы)
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    parent.password = hashed_password
-    parent.save()
+    parent.password = await ahash_password(password)
+    await sync_to_async(parent.save)()
+    mark_verified(parent)
     return parent
 
-@sync_to_async
-def verify_parent_password(parent, password):
+async def verify_parent_password(parent, password):
     """Проверка пароля родителя"""
-    import hashlib
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    return parent.password == hashed_password
+    return await averify_parent_password(parent, password)
 
 @sync_to_async
 def get_parent_children(parent):
     """Получение списка детей родителя"""
-    return list(parent.children.all())
+    children = list(parent.children.all())
+    remember_parent_children(parent.pk, children)
+    return children
 
 @sync_to_async
 def add_child_to_parent(parent, child):
@@ -146,26 +143,46 @@ def add_child_to_parent(parent, child):
     parent.children.add(child)
     return True
 
+def awaiting_password(update, bot=None):
+    """Ждет ли бот от автора сообщения пароль родителя: такой текст не пишется в журнал update.
+
+    ``bot`` не используется: бот здесь один (параметр - как у flask_app.py для asgi_webhooks.py).
+    """
+    message = update.get('message') or update.get('edited_message')
+    if not message or 'from' not in message:
+        return False
+    user_id, chat_id = message['from']['id'], message['chat']['id']
+    if chat_id < 0:
+        state = group_states.get(chat_id, {}).get(user_id)
+    else:
+        state = user_states.get(user_id)
+    return state == States.PARENT_PASSWORD
+
 # Обработка webhook-запросов от Telegram
 @app.route(f'/{TOKEN}', methods=['POST'])
 async def webhook():
     try:
         update = request.get_json()
         logger.info(f"Получен update: {json.dumps(update, indent=2)}")
+        record_update(update, secret=awaiting_password(update))
 
-        # Обработка сообщений
-        if 'message' in update:
-            await process_message(update['message'])
-
-        # Обработка callback-запросов (нажатия на кнопки)
-        if 'callback_query' in update:
-            await process_callback_query(update['callback_query'])
+        await process_update(update)
 
         return jsonify({'status': 'ok'})
     except Exception as e:
         logger.error(f"Ошибка при обработке webhook: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
+# Обработка одного update (вызывается маршрутом Flask и ASGI-приложением asgi_webhooks.py)
+async def process_update(update):
+    # Обработка сообщений
+    if 'message' in update:
+        await process_message(update['message'])
+
+    # Обработка callback-запросов (нажатия на кнопки)
+    if 'callback_query' in update:
+        await process_callback_query(update['callback_query'])
+
 # Функция обработки сообщений
 
 # Функция обработки сообщений
@@ -377,7 +394,7 @@ async def process_message(message):
                 parent = await get_parent(user_id)
                 
                 # Проверяем, существует ли ребенок с таким именем
-                child = await get_child_by_name(child_name)
+                child = await get_child_by_name(child_name, parent)
                 
                 if child:
                     # Если ребенок найден, привязываем его к родителю
@@ -654,6 +671,7 @@ async def process_callback_query(callback_query):
             recent_deeds = await get_recent_deeds(child)
             
             text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+            text += format_progress(*await atake_progress(child.pk))
             if recent_deeds:
                 text += "📋 *Твои последние добрые дела:*\n"
                 for deed in recent_deeds:
@@ -950,6 +968,7 @@ async def process_points_command(chat_id, user_id):
         recent_deeds = await get_recent_deeds(child)
 
         text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+        text += format_progress(*await atake_progress(child.pk))
         if recent_deeds:
             text += "📋 *Твои последние добрые дела:*\n"
             for deed in recent_deeds:
@@ -1056,7 +1075,6 @@ async def process_back_to_menu(chat_id, user_id):
 # Функции для работы с Telegram API
 async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
    """Функция для отправки сообщений"""
-   url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
 
    payload = {
        'chat_id': chat_id,
@@ -1070,13 +1088,7 @@ async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
        payload['reply_markup'] = reply_markup
 
    try:
-       # Используем sync_to_async для выполнения синхронного запроса в асинхронной функции
-       @sync_to_async
-       def do_request():
-           return requests.post(url, json=payload)
-
-       response = await do_request()
-       response_json = response.json()
+       response_json = await call_api(TOKEN, 'sendMessage', payload)
 
        if not response_json.get('ok'):
            logger.error(f"Ошибка при отправке сообщения: {response_json}")
@@ -1088,7 +1100,6 @@ async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
 
 async def edit_message(chat_id, message_id, text, parse_mode=None, reply_markup=None):
    """Функция для редактирования сообщений"""
-   url = f"https://api.telegram.org/bot{TOKEN}/editMessageText"
 
    payload = {
        'chat_id': chat_id,
@@ -1103,19 +1114,13 @@ async def edit_message(chat_id, message_id, text, parse_mode=None, reply_markup=
        payload['reply_markup'] = reply_markup
 
    try:
-       @sync_to_async
-       def do_request():
-           return requests.post(url, json=payload)
-
-       response = await do_request()
-       return response.json()
+       return await call_api(TOKEN, 'editMessageText', payload)
    except Exception as e:
        logger.error(f"Ошибка при редактировании сообщения: {e}")
        return None
 
 async def answer_callback_query(callback_query_id, text=None):
    """Функция для ответа на callback_query"""
-   url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
 
    payload = {
        'callback_query_id': callback_query_id
@@ -1125,12 +1130,7 @@ async def answer_callback_query(callback_query_id, text=None):
        payload['text'] = text
 
    try:
-       @sync_to_async
-       def do_request():
-           return requests.post(url, json=payload)
-
-       response = await do_request()
-       return response.json()
+       return await call_api(TOKEN, 'answerCallbackQuery', payload)
    except Exception as e:
        logger.error(f"Ошибка при ответе на callback_query: {e}")
        return None
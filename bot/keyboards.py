@@ -0,0 +1,100 @@
+"""Статичные клавиатуры и тексты, общие для всех вариантов бота.
+
+Клавиатура описывается кортежем рядов кнопок ``(текст, callback_data)``.
+Готовая разметка строится один раз на клавиатуру и дальше переиспользуется:
+- ``ptb_markup()`` - неизменяемый InlineKeyboardMarkup для python-telegram-bot;
+- ``markup_json()`` - готовая JSON-строка reply_markup. Ее принимают и TeleBot
+  (строка уходит в API как есть), и прямые вызовы Bot API из Flask-ботов.
+"""
+import json
+from functools import lru_cache
+
+MAIN_MENU_KEYBOARD = (
+    (("📝 Добавить доброе дело", "add_deed"),),
+    (("🌟 Мои баллы", "check_points"),),
+    (("🎁 Посмотреть награды", "view_rewards"),),
+    (("❓ Помощь", "help"),),
+    (("👨‍👩‍👧‍👦 Я родитель", "register_parent"),),
+)
+
+# Главное меню без кнопки регистрации родителя
+CHILD_MENU_KEYBOARD = MAIN_MENU_KEYBOARD[:-1]
+
+LOGIN_CHOICE_KEYBOARD = (
+    (("👨‍👧‍👦 Войти как родитель", "parent_login"),),
+    (("👶 Войти как ребенок", "child_login"),),
+)
+
+BACK_TO_MENU_KEYBOARD = (
+    (("◀️ Назад в меню", "back_to_menu"),),
+)
+
+CHART_KEYBOARD = (
+    (("📈 График по дням", "chart_day"), ("📈 По неделям", "chart_week")),
+)
+
+# Экран баллов, открытый кнопкой из меню
+POINTS_KEYBOARD = CHART_KEYBOARD + BACK_TO_MENU_KEYBOARD
+
+DEED_ADDED_KEYBOARD = (
+    (("📝 Добавить еще доброе дело", "add_deed"),),
+    (("🏠 Вернуться в меню", "back_to_menu"),),
+)
+
+PARENT_MENU_KEYBOARD = (
+    (("➕ Добавить ребенка", "add_child"),),
+    (("📊 Просмотр статистики детей", "view_children"),),
+    (("🏠 В главное меню", "exit_parent_mode"),),
+)
+
+PARENT_MENU_WITH_CHILDREN_KEYBOARD = (
+    (("➕ Добавить доброе дело ребенку", "add_deed_to_child"),),
+    (("📊 Просмотр статистики детей", "view_children"),),
+    (("➕ Добавить ребенка", "add_child"),),
+    (("🏠 В главное меню", "exit_parent_mode"),),
+)
+
+PARENT_MENU_NO_CHILDREN_KEYBOARD = (
+    (("➕ Добавить ребенка", "add_child"),),
+    (("🏠 В главное меню", "exit_parent_mode"),),
+)
+
+CHILD_ACTIONS_KEYBOARD = (
+    (("➕ Добавить доброе дело", "add_deed_to_child"),),
+    (("◀️ Назад", "back_to_parent_menu"),),
+)
+
+# Список наград, который показываем, пока в базе нет ни одной
+FALLBACK_REWARDS_TEXT = (
+    "• *Обычная игрушка*: 1000 баллов\n"
+    "• *Приставка на выходные*: 3000 баллов\n"
+    "• *Крутая игрушка*: 5000 баллов\n"
+    "• *Nintendo Switch*: 35000 баллов\n"
+)
+
+# Кнопка меню родителя, когда пароль давно не вводили (bot/sessions.py)
+PARENT_SESSION_EXPIRED_TEXT = "🔒 Режим родителя закрыт: пароль давно не вводили. Введите /parent, чтобы войти снова."
+
+
+def _keyboard_dict(keyboard):
+    return {
+        "inline_keyboard": [
+            [{"text": text, "callback_data": data} for text, data in row]
+            for row in keyboard
+        ]
+    }
+
+
+@lru_cache(maxsize=None)
+def markup_json(keyboard):
+    return json.dumps(_keyboard_dict(keyboard), ensure_ascii=False)
+
+
+@lru_cache(maxsize=None)
+def ptb_markup(keyboard):
+    # Импорт здесь: Flask- и TeleBot-версии работают без python-telegram-bot
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(text, callback_data=data) for text, data in row] for row in keyboard]
+    )
@@ -0,0 +1,202 @@
+"""Журнал баллов: каждое начисление, обмен на награду и исправление - отдельная запись.
+
+Записи только добавляются; изменение баллов дела и удаление дела тоже
+попадают в журнал - исправлением на разницу. Каждые SNAPSHOT_EVERY записей
+ребенка сохраняется снимок баланса, поэтому баланс - это последний снимок плюс не больше
+SNAPSHOT_EVERY записей после него, сколько бы ни было истории.
+Child.total_points остается быстрой копией баланса для экранов бота;
+reconcile_points сверяет ее с журналом.
+"""
+import contextvars
+import logging
+import os
+from contextlib import contextmanager
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, QuerySet, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from bot.db_router import mark_written
+from bot.models import Child, KindDeed, PointsSnapshot, PointsTransaction, Reward
+from bot.progress import award_point_badges
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_EVERY = int(os.environ.get('POINTS_SNAPSHOT_EVERY', 50))
+
+# Выключается на время переноса дел в архив (bot/archive.py): баллы за них остаются
+_deed_corrections = contextvars.ContextVar('deed_corrections', default=True)
+
+
+class InsufficientPoints(Exception):
+    """Баллов не хватает на награду"""
+
+    def __init__(self, balance, required):
+        super().__init__(f"нужно {required} баллов, есть {balance}")
+        self.balance = balance
+        self.required = required
+
+
+def ledger_balance():
+    """Выражение для запросов по Child: баланс по журналу (последний снимок + записи после него)"""
+    latest = PointsSnapshot.objects.filter(child_id=OuterRef('pk')).order_by('-last_transaction_id')
+    tail_start = (
+        PointsSnapshot.objects.filter(child_id=OuterRef(OuterRef('pk')))
+        .order_by('-last_transaction_id')
+        .values('last_transaction_id')[:1]
+    )
+    tail = (
+        PointsTransaction.objects
+        .filter(child_id=OuterRef('pk'), id__gt=Coalesce(Subquery(tail_start), Value(0)))
+        .values('child_id')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+    return (
+        Coalesce(Subquery(latest.values('balance')[:1]), Value(0), output_field=IntegerField())
+        + Coalesce(Subquery(tail), Value(0), output_field=IntegerField())
+    )
+
+
+def get_balance(child_id):
+    """Баланс ребенка по журналу одним запросом"""
+    return (
+        Child.objects.filter(pk=child_id)
+        .annotate(balance=ledger_balance())
+        .values_list('balance', flat=True)
+        .first()
+    )
+
+
+def _append(child_id, kind, amount, **fields):
+    """Добавляет запись и при необходимости снимок; вызывается внутри transaction.atomic()"""
+    # Записи одного ребенка добавляются по очереди: иначе снимок мог бы не учесть
+    # запись параллельной транзакции с меньшим id
+    list(Child.objects.select_for_update().filter(pk=child_id).values_list('pk'))
+    entry = PointsTransaction.objects.create(child_id=child_id, kind=kind, amount=amount, **fields)
+
+    last_id, balance = (
+        PointsSnapshot.objects.filter(child_id=child_id)
+        .order_by('-last_transaction_id')
+        .values_list('last_transaction_id', 'balance')
+        .first()
+    ) or (0, 0)
+    tail = PointsTransaction.objects.filter(child_id=child_id, id__gt=last_id, id__lte=entry.pk).aggregate(
+        count=Count('id'), total=Sum('amount'),
+    )
+    entry.balance = balance + tail['total']
+    if tail['count'] >= SNAPSHOT_EVERY:
+        PointsSnapshot.objects.create(child_id=child_id, last_transaction=entry, balance=entry.balance)
+    return entry
+
+
+@contextmanager
+def without_deed_corrections():
+    """Удаление дел внутри блока не меняет баланс (перенос в архив)"""
+    token = _deed_corrections.set(False)
+    try:
+        yield
+    finally:
+        _deed_corrections.reset(token)
+
+
+@receiver(pre_save, sender=KindDeed)
+def _deed_saving(sender, instance, raw=False, **kwargs):
+    if raw or instance._state.adding:
+        return
+    instance._saved_points = KindDeed.objects.filter(pk=instance.pk).values_list('points', flat=True).first()
+
+
+@receiver(post_save, sender=KindDeed)
+def _deed_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        with transaction.atomic():
+            _append(
+                instance.child_id, PointsTransaction.AWARD, instance.points,
+                deed=instance, description=instance.description[:255],
+            )
+        return
+    # Баллы дела изменили (например, в админке): разница идет в журнал исправлением,
+    # а расхождение с total_points найдет reconcile_points
+    previous = getattr(instance, '_saved_points', None)
+    if previous is not None and previous != instance.points:
+        with transaction.atomic():
+            _append(
+                instance.child_id, PointsTransaction.CORRECTION, instance.points - previous,
+                deed=instance, description=f"Изменены баллы дела: {instance.description}"[:255],
+            )
+    instance._saved_points = instance.points
+
+
+def _deleting_child(origin):
+    if isinstance(origin, QuerySet):
+        return origin.model is Child
+    return isinstance(origin, Child)
+
+
+@receiver(post_delete, sender=KindDeed)
+def _deed_deleted(sender, instance, origin=None, **kwargs):
+    # При удалении ребенка его журнал удаляется вместе с делами
+    if not _deed_corrections.get() or _deleting_child(origin) or not instance.points:
+        return
+    with transaction.atomic():
+        _append(
+            instance.child_id, PointsTransaction.CORRECTION, -instance.points,
+            description=f"Удалено дело: {instance.description}"[:255],
+        )
+
+
+def add_points(child, points):
+    """Начисляет баллы за дело, возвращает новый total_points.
+
+    Одним UPDATE, а не child.save(): сохранение загруженного ранее объекта
+    затерло бы списание обмена на награду, прошедшего между чтением и записью.
+    """
+    Child.objects.filter(pk=child.pk).update(total_points=F('total_points') + points)
+    # UPDATE не вызывает post_save: отмечаем запись для bot/db_router.py сами
+    mark_written(child.pk)
+    child.refresh_from_db(fields=['total_points'])
+    award_point_badges(child.pk, child.total_points)
+    return child.total_points
+
+
+aadd_points = sync_to_async(add_points)
+
+
+def redeem_reward(child_id, reward_id):
+    """Обменивает баллы на награду, возвращает запись журнала (с атрибутом balance).
+
+    InsufficientPoints, если баллов не хватает; Reward.DoesNotExist, если награды нет.
+    """
+    reward = Reward.objects.get(pk=reward_id)
+    cost = reward.points_required
+    with transaction.atomic():
+        # Условное списание блокирует строку ребенка: из одновременных обменов
+        # пройдут только те, на которые хватает баллов
+        updated = Child.objects.filter(pk=child_id, total_points__gte=cost).update(
+            total_points=F('total_points') - cost
+        )
+        if not updated:
+            raise InsufficientPoints(get_balance(child_id) or 0, cost)
+        entry = _append(child_id, PointsTransaction.REDEMPTION, -cost, reward=reward, description=reward.name)
+        if entry.balance < 0:
+            # total_points разошелся с журналом в большую сторону: верим журналу
+            raise InsufficientPoints(entry.balance + cost, cost)
+    logger.info(f"Ребенок {child_id} обменял {cost} баллов на награду {reward.name}")
+    return entry
+
+
+aredeem_reward = sync_to_async(redeem_reward)
+
+
+def correct_points(child_id, amount, description):
+    """Исправление баланса: запись в журнал и та же поправка в total_points"""
+    with transaction.atomic():
+        entry = _append(child_id, PointsTransaction.CORRECTION, amount, description=description[:255])
+        Child.objects.filter(pk=child_id).update(total_points=F('total_points') + amount)
+    return entry
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bot.archive import archive_deeds, compact_database
+
+
+class Command(BaseCommand):
+    help = 'Перенос старых добрых дел в сжатый архив с месячными итогами (запускать по расписанию)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=365, help='Переносить дела старше стольких дней')
+        parser.add_argument('--keep-recent', type=int, default=5, help='Сколько последних дел каждого ребенка не трогать')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Дел в одной транзакции')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, сколько дел будет перенесено')
+        parser.add_argument('--vacuum', action='store_true', help='После переноса сжать базу (VACUUM)')
+
+    def handle(self, *args, **options):
+        if options['older_than_days'] < 1:
+            raise CommandError('--older-than-days должен быть положительным')
+        stats = archive_deeds(
+            older_than_days=options['older_than_days'],
+            keep_recent=max(options['keep_recent'], 0),
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f"К переносу {stats['deeds']} дел на {stats['points']} баллов")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Перенесено {stats['deeds']} дел на {stats['points']} баллов "
+            f"в {stats['archives']} архивных пачек ({stats['batches']} транзакций)"
+        ))
+        if options['vacuum'] and stats['deeds']:
+            compact_database()
+            self.stdout.write("База сжата")
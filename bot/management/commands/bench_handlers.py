@@ -0,0 +1,110 @@
+import asyncio
+import logging
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from bot.models import Child, KindDeed, Parent
+from bot.passwords import mark_verified
+
+PARENT_ID = 1000
+CHILDREN = {2001: "Маша", 2002: "Петя", 2003: "Коля"}
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def _fake_update(user_id, text="", chat_type="private", callback_data=None):
+    """Минимальная замена telegram.Update для вызова обработчиков без сети"""
+    update = SimpleNamespace(
+        effective_user=SimpleNamespace(id=user_id, first_name="Bench"),
+        effective_chat=SimpleNamespace(id=user_id, type=chat_type),
+        message=SimpleNamespace(text=text, reply_text=_noop),
+        callback_query=None,
+    )
+    if callback_data:
+        update.callback_query = SimpleNamespace(
+            data=callback_data, answer=_noop, edit_message_text=_noop
+        )
+    return update
+
+
+def _fake_context(**user_data):
+    return SimpleNamespace(
+        user_data=dict(user_data),
+        application=SimpleNamespace(create_task=lambda coroutine, **kwargs: asyncio.ensure_future(coroutine)),
+    )
+
+
+class Command(BaseCommand):
+    help = 'Замер задержки обработчиков python-telegram-bot на временной тестовой базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Количество вызовов каждого обработчика')
+
+    def handle(self, *args, **options):
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self._seed()
+            results = asyncio.run(self._run(options['iterations']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"{'обработчик':<28}{'mean, мс':>10}{'p50, мс':>10}{'p95, мс':>10}")
+        for name, samples in results.items():
+            samples.sort()
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            self.stdout.write(
+                f"{name:<28}{statistics.mean(samples):>10.3f}{statistics.median(samples):>10.3f}{p95:>10.3f}"
+            )
+
+    def _seed(self):
+        parent = Parent.objects.create(telegram_id=PARENT_ID, name="Bench")
+        # Меню родителя открывается только после ввода пароля
+        mark_verified(parent)
+        for telegram_id, name in CHILDREN.items():
+            child = Child.objects.create(telegram_id=telegram_id, name=name)
+            parent.children.add(child)
+            KindDeed.objects.bulk_create(
+                KindDeed(child=child, description=f"Дело {i}", points=10) for i in range(10)
+            )
+
+    async def _run(self, iterations):
+        # Импорт здесь: модуль бота при импорте настраивает логирование и Django
+        from bot import telegram_bot
+
+        logging.getLogger(telegram_bot.__name__).setLevel(logging.WARNING)
+        child_id = next(iter(CHILDREN))
+
+        cases = {
+            "start": lambda: telegram_bot.start(
+                _fake_update(child_id, "/start"), _fake_context()
+            ),
+            "process_points": lambda: telegram_bot.process_points(
+                _fake_update(child_id, "5"), _fake_context(deed_description="Бенчмарк")
+            ),
+            "handle_parent_menu": lambda: telegram_bot.handle_parent_menu(
+                _fake_update(PARENT_ID, callback_data="view_children"), _fake_context()
+            ),
+            "group_message_handler": lambda: telegram_bot.group_message_handler(
+                _fake_update(PARENT_ID, "Доброе дело: Маша помогла 5", chat_type="group"),
+                _fake_context(),
+            ),
+        }
+
+        results = {}
+        for name, make_call in cases.items():
+            # Прогрев: первые вызовы открывают соединения и пул потоков
+            for _ in range(5):
+                await make_call()
+            samples = []
+            for _ in range(iterations):
+                started = time.perf_counter()
+                await make_call()
+                samples.append((time.perf_counter() - started) * 1000)
+            results[name] = samples
+        return results
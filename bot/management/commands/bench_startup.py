@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_MODULES = ('flask_app', 'flask_integration', 'telebot_app', 'telegrambot')
+
+
+def measure_import(module, lazy, env=None):
+    """Импорт модуля в чистом процессе с -X importtime: (всего мкс, {прямой импорт: мкс})"""
+    env = {**os.environ, **(env or {}), 'BOT_LAZY_STARTUP': '1' if lazy else '0'}
+    # Токен нужен боту при создании; сеть при импорте не используется
+    env.setdefault('TELEGRAM_TOKEN', '0:startup-benchmark')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode:
+        raise CommandError(f"Не удалось импортировать {module}:\n{result.stderr[-2000:]}")
+    # Строки вида "import time: self | cumulative |  имя", вложенность - отступом имени
+    # (два пробела на уровень); вложенные импорты печатаются раньше родителя
+    children = {}
+    for line in result.stderr.splitlines():
+        parts = line.removeprefix('import time:').split('|')
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 0:
+            if name.strip() == module:
+                return int(parts[1]), children
+            children = {}
+        elif depth == 1:
+            children[name.strip()] = int(parts[1])
+    return 0, children
+
+
+class Command(BaseCommand):
+    help = 'Замер времени импорта точек входа (python -X importtime) с порогом для проверки регрессий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help='Модули точек входа')
+        parser.add_argument('--runs', type=int, default=5, help='Запусков на модуль; берется лучший')
+        parser.add_argument('--eager', action='store_true', help='Без ленивого режима (BOT_LAZY_STARTUP=0)')
+        parser.add_argument('--top', type=int, default=5, help='Сколько самых долгих импортов показать')
+        parser.add_argument('--budget-ms', type=float, help='Ошибка, если импорт модуля дольше стольких мс')
+        parser.add_argument('--baseline', type=Path, help='JSON с прошлыми результатами для сравнения')
+        parser.add_argument('--tolerance', type=float, default=20, help='Допустимое замедление к baseline, %%')
+        parser.add_argument('--save-baseline', action='store_true', help='Записать результаты в --baseline')
+
+    def handle(self, *args, **options):
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline требует --baseline')
+        mode = 'eager' if options['eager'] else 'lazy'
+        baseline = {}
+        if options['baseline'] and options['baseline'].exists() and not options['save_baseline']:
+            baseline = json.loads(options['baseline'].read_text()).get(mode, {})
+
+        results = {}
+        failures = []
+        for module in options['modules']:
+            runs = [measure_import(module, lazy=not options['eager']) for _ in range(max(options['runs'], 1))]
+            total, imports = min(runs, key=lambda run: run[0])
+            results[module] = round(total / 1000, 1)
+
+            line = f"{module:<20}{results[module]:>9.1f} мс"
+            previous = baseline.get(module)
+            if previous:
+                change = (results[module] - previous) / previous * 100
+                line += f"  (baseline {previous:.1f} мс, {change:+.0f}%)"
+                if change > options['tolerance']:
+                    failures.append(f"{module}: {results[module]:.1f} мс против {previous:.1f} мс ({change:+.0f}%)")
+            if options['budget_ms'] is not None and results[module] > options['budget_ms']:
+                failures.append(f"{module}: {results[module]:.1f} мс при бюджете {options['budget_ms']:.0f} мс")
+            self.stdout.write(line)
+
+            heaviest = sorted(imports.items(), key=lambda item: -item[1])[:options['top']]
+            for name, us in heaviest:
+                self.stdout.write(f"    {name:<32}{us / 1000:>9.1f} мс")
+
+        if options['save_baseline']:
+            path = options['baseline']
+            saved = json.loads(path.read_text()) if path.exists() else {}
+            saved[mode] = results
+            path.write_text(json.dumps(saved, indent=2, ensure_ascii=False) + "\n")
+            self.stdout.write(f"Результаты ({mode}) записаны в {path}")
+
+        if failures:
+            raise CommandError("Импорт стал медленнее допустимого:\n" + "\n".join(failures))
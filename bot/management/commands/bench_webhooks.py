@@ -0,0 +1,176 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from bot import telegram_api
+
+COMMANDS = ["/start", "/points", "/rewards"]
+
+
+def _fake_api_handler(latency):
+    class Handler(BaseHTTPRequestHandler):
+        """Заглушка Bot API: отвечает успехом на любой метод с заданной задержкой"""
+        protocol_version = "HTTP/1.1"
+        # Заголовки и тело уходят разными пакетами: без TCP_NODELAY каждый ответ ждал бы отложенного ACK
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(latency)
+            body = b'{"ok": true, "result": {"message_id": 1}}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class _FakeApiServer(ThreadingHTTPServer):
+    # Очередь по умолчанию (5) переполняется при одновременном открытии соединений
+    request_queue_size = 1024
+
+
+def _serve_fake_api(latency, ports):
+    server = _FakeApiServer(('127.0.0.1', 0), _fake_api_handler(latency))
+    ports.put(server.server_port)
+    server.serve_forever()
+
+
+def _make_update(i, user_id, text):
+    return {
+        "update_id": i,
+        "message": {
+            "message_id": i,
+            "from": {"id": user_id, "first_name": f"User{user_id}"},
+            "chat": {"id": user_id, "type": "private"},
+            "text": text,
+        },
+    }
+
+
+def _summary(samples, elapsed):
+    samples.sort()
+    return {
+        "rps": len(samples) / elapsed,
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+    }
+
+
+class Command(BaseCommand):
+    help = 'Сравнение webhook-приложения Flask под WSGI и под ASGI (asgi_webhooks.py) на временной базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', default='flask_app', help='Модуль Flask-бота: flask_app, flask2 или bot.flask_app')
+        parser.add_argument('--updates', type=int, default=300, help='Количество webhook-запросов в каждом режиме')
+        parser.add_argument('--users', type=int, default=30, help='Количество разных пользователей')
+        parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов')
+        parser.add_argument('--api-latency', type=float, default=50, help='Задержка заглушки Bot API, мс')
+
+    def handle(self, *args, **options):
+        # Заглушка Bot API в отдельном процессе, чтобы не делить с ботом GIL
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(
+            target=_serve_fake_api, args=(options['api_latency'] / 1000, ports), daemon=True
+        )
+        server.start()
+        telegram_api.API_URL = f"http://127.0.0.1:{ports.get()}"
+
+        # Файловая база: в WSGI-режиме к ней обращаются из нескольких потоков сразу
+        db_dir = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(db_dir, 'bench.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            os.environ['WEBHOOK_APP'] = options['app']
+            # Замеряется сервер, а не лимиты частоты Bot API (bot/multibot.py): отключаем их
+            os.environ['TELEGRAM_RATE_PER_SECOND'] = os.environ['TELEGRAM_CHAT_RATE_PER_SECOND'] = '0'
+            # Импорт здесь: модули ботов при импорте настраивают логирование и Django
+            import asgi_webhooks
+
+            logging.getLogger().setLevel(logging.WARNING)
+            app = asgi_webhooks.application
+            users = range(5000, 5000 + options['users'])
+            # Прогрев: /start регистрирует пользователей, чтобы оба режима работали с одинаковыми данными
+            warmup = [_make_update(0, user_id, "/start") for user_id in users]
+            updates = [
+                _make_update(i, users[i % len(users)], COMMANDS[i % len(COMMANDS)])
+                for i in range(options['updates'])
+            ]
+
+            results = {
+                "WSGI (Flask)": self._run_wsgi(app.module.app, app.webhook_path, warmup, updates, options['concurrency']),
+                "ASGI": asyncio.run(self._run_asgi(app, warmup, updates, options['concurrency'])),
+            }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            server.terminate()
+
+        self.stdout.write(f"{'режим':<16}{'update/с':>10}{'p50, мс':>10}{'p95, мс':>10}")
+        for name, stats in results.items():
+            self.stdout.write(f"{name:<16}{stats['rps']:>10.1f}{stats['p50']:>10.1f}{stats['p95']:>10.1f}")
+
+    def _run_wsgi(self, flask_app, path, warmup, updates, concurrency):
+        client = flask_app.test_client()
+
+        def post(update):
+            started = time.perf_counter()
+            client.post(path, json=update)
+            return (time.perf_counter() - started) * 1000
+
+        for update in warmup:
+            post(update)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            samples = list(executor.map(post, updates))
+        return _summary(samples, time.perf_counter() - started)
+
+    async def _run_asgi(self, app, warmup, updates, concurrency):
+        lifespan = asyncio.Queue()
+        await lifespan.put({'type': 'lifespan.startup'})
+        sent = asyncio.Queue()
+        lifespan_task = asyncio.create_task(app({'type': 'lifespan'}, lifespan.get, sent.put))
+        await sent.get()
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(update):
+            body = json.dumps(update).encode()
+            scope = {'type': 'http', 'method': 'POST', 'path': app.webhook_path, 'headers': []}
+
+            async def receive():
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+
+            async def send(message):
+                pass
+
+            async with semaphore:
+                started = time.perf_counter()
+                await app(scope, receive, send)
+                return (time.perf_counter() - started) * 1000
+
+        for update in warmup:
+            await post(update)
+
+        started = time.perf_counter()
+        samples = await asyncio.gather(*(post(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+        await lifespan.put({'type': 'lifespan.shutdown'})
+        await lifespan_task
+        return _summary(list(samples), elapsed)
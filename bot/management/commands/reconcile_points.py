@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from bot.reconcile import reconcile_points
+
+
+class Command(BaseCommand):
+    help = 'Пересчет Child.total_points по журналу баллов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Детей в одном UPDATE')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения, ничего не меняя')
+        parser.add_argument('--every', type=float, help='Повторять сверку каждые N секунд, пока команду не остановят')
+
+    def handle(self, *args, **options):
+        while True:
+            stats = reconcile_points(chunk_size=options['chunk_size'], dry_run=options['dry_run'])
+            self.stdout.write(
+                f"проверено {stats['checked']}, расхождений {stats['mismatched']}, исправлено {stats['updated']}, "
+                f"дрейф {stats['net_drift']:+d} (по модулю {stats['abs_drift']}, максимум {stats['max_drift']})"
+            )
+            if not options['every']:
+                break
+            close_old_connections()
+            time.sleep(options['every'])
@@ -0,0 +1,189 @@
+import asyncio
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bot import telegram_api
+from bot.management.commands.bench_webhooks import _serve_fake_api
+from bot.recording import read_updates
+
+
+def update_kind(update):
+    """Тип update для сводки: команда, текст или данные кнопки без чисел"""
+    message = update.get('message') or update.get('edited_message')
+    if message is not None:
+        text = message.get('text', '')
+        if text.startswith('/'):
+            return text.split()[0].split('@')[0]
+        return 'текст' if text else 'другое'
+    if 'callback_query' in update:
+        return 'кнопка ' + re.sub(r'\d+', '#', update['callback_query'].get('data', ''))
+    return 'другое'
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    return {
+        'count': len(samples),
+        'mean': statistics.fmean(samples),
+        'p50': statistics.median(samples),
+        'p95': samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Воспроизведение записанных update (BOT_RECORD_UPDATES, bot/recording.py) на временной базе '
+        'с замером задержки каждого update и сравнением с отчетом прошлой версии кода'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('log', help='Журнал update: .ndjson, .ndjson.gz или .ndjson.zst')
+        parser.add_argument('--app', default='flask_app', help='Модуль точки входа с process_update: flask_app, bot.flask_app, telebot_app')
+        parser.add_argument('--speed', type=float, default=0, help='Ускорение относительно записи (1 - как было); 0 - подряд без пауз')
+        parser.add_argument('--limit', type=int, help='Воспроизвести только первые N update')
+        parser.add_argument('--api-latency', type=float, default=0, help='Задержка заглушки Bot API, мс')
+        parser.add_argument('--save-report', type=Path, help='Записать задержки update в JSON')
+        parser.add_argument('--compare', type=Path, help='Отчет прошлой версии (--save-report) для сравнения')
+        parser.add_argument('--top', type=int, default=10, help='Сколько самых замедлившихся update показать')
+        parser.add_argument('--tolerance', type=float, help='Ошибка, если p95 медленнее отчета --compare больше чем на столько %%')
+
+    def handle(self, *args, **options):
+        records = list(read_updates(options['log']))[:options['limit']]
+        if not records:
+            raise CommandError(f"В журнале {options['log']} нет update")
+        previous = json.loads(options['compare'].read_text()) if options['compare'] else None
+        if previous and previous['log'] != os.path.basename(options['log']):
+            self.stderr.write(f"Отчет {options['compare']} снят с журнала {previous['log']}: сравнение может быть неточным")
+
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(
+            target=_serve_fake_api, args=(options['api_latency'] / 1000, ports), daemon=True
+        )
+        server.start()
+        telegram_api.API_URL = f"http://127.0.0.1:{ports.get()}"
+
+        # Каждый запуск - с пустой временной базы, чтобы версии кода сравнивались на одинаковых данных
+        db_dir = tempfile.mkdtemp()
+        connection.settings_dict['TEST']['NAME'] = os.path.join(db_dir, 'replay.sqlite3')
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            # Воспроизведение не пишет журнал само и не ждет лимитов частоты Bot API
+            os.environ.pop('BOT_RECORD_UPDATES', None)
+            os.environ['TELEGRAM_RATE_PER_SECOND'] = os.environ['TELEGRAM_CHAT_RATE_PER_SECOND'] = '0'
+            os.environ.setdefault('TELEGRAM_TOKEN', '0:replay')
+            # telebot_app в режиме pool выполняет обработчики в вызывающем потоке (threaded=False):
+            # иначе process_update возвращался бы сразу и задержку было бы не измерить
+            os.environ['TELEBOT_EXECUTION_MODE'] = 'pool'
+            # Импорт здесь: модули ботов при импорте настраивают логирование и Django
+            module = importlib.import_module(options['app'])
+            if hasattr(module, 'telebot'):
+                module.telebot.apihelper.API_URL = f"{telegram_api.API_URL}/bot{{0}}/{{1}}"
+            logging.getLogger().setLevel(logging.WARNING)
+            samples = asyncio.run(self._replay(module, records, options['speed']))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            server.terminate()
+
+        report = {
+            'app': options['app'],
+            'log': os.path.basename(options['log']),
+            'updates': [
+                {'update_id': record['update'].get('update_id'), 'kind': update_kind(record['update']), 'ms': round(ms, 3)}
+                for record, ms in zip(records, samples)
+            ],
+        }
+        report['summary'] = _stats(samples)
+        self._print_summary(report, previous)
+        if previous:
+            self._print_regressions(report, previous, options['top'])
+
+        if options['save_report']:
+            options['save_report'].write_text(json.dumps(report, indent=1, ensure_ascii=False) + "\n")
+            self.stdout.write(f"Отчет записан в {options['save_report']}")
+
+        if previous and options['tolerance'] is not None:
+            change = (report['summary']['p95'] - previous['summary']['p95']) / previous['summary']['p95'] * 100
+            if change > options['tolerance']:
+                raise CommandError(f"p95 стал медленнее на {change:.0f}% (допустимо {options['tolerance']:.0f}%)")
+
+    async def _replay(self, module, records, speed):
+        if asyncio.iscoroutinefunction(module.process_update):
+            process_update = module.process_update
+        else:
+            # Синхронный обработчик (telebot_app) - в отдельном потоке, как в пуле воркеров
+            process_update = sync_to_async(module.process_update, thread_sensitive=False)
+        bots = {bot.name: bot for bot in getattr(module, 'BOTS', ())}
+
+        async def run(record):
+            args = (record['update'],)
+            if bots:
+                # Бот из записи, если он есть среди текущих BOT_TOKENS, иначе первый
+                args += (bots.get(record.get('bot')) or next(iter(bots.values())),)
+            started = time.perf_counter()
+            try:
+                await process_update(*args)
+            except Exception as e:
+                self.stderr.write(f"update {record['update'].get('update_id')}: {e}")
+            return (time.perf_counter() - started) * 1000
+
+        await telegram_api.open_async_client()
+        try:
+            if not speed:
+                return [await run(record) for record in records]
+
+            # С паузами как в записи (ускоренными в speed раз); update обрабатываются одновременно, как на сервере
+            started, first_ts = time.monotonic(), records[0]['ts']
+
+            async def scheduled(record):
+                await asyncio.sleep(max(0.0, (record['ts'] - first_ts) / speed - (time.monotonic() - started)))
+                return await run(record)
+
+            return list(await asyncio.gather(*(scheduled(record) for record in records)))
+        finally:
+            await telegram_api.close_async_client()
+
+    def _print_summary(self, report, previous):
+        by_kind = {}
+        for item in report['updates']:
+            by_kind.setdefault(item['kind'], []).append(item['ms'])
+        previous_by_kind = {}
+        for item in (previous or {}).get('updates', ()):
+            previous_by_kind.setdefault(item['kind'], []).append(item['ms'])
+
+        self.stdout.write(f"{'update':<28}{'кол-во':>8}{'p50, мс':>10}{'p95, мс':>10}{'было p50':>10}{'изм.':>8}")
+        rows = [('всего', [item['ms'] for item in report['updates']], [item['ms'] for item in (previous or {}).get('updates', ())])]
+        rows += [(kind, samples, previous_by_kind.get(kind)) for kind, samples in sorted(by_kind.items())]
+        for kind, samples, before in rows:
+            stats = _stats(samples)
+            line = f"{kind[:27]:<28}{stats['count']:>8}{stats['p50']:>10.2f}{stats['p95']:>10.2f}"
+            if before:
+                was = statistics.median(before)
+                line += f"{was:>10.2f}{(stats['p50'] - was) / was * 100 if was else 0:>+7.0f}%"
+            self.stdout.write(line)
+
+    def _print_regressions(self, report, previous, top):
+        # Журнал тот же, поэтому update сопоставляются по порядковому номеру
+        deltas = [
+            (item['ms'] - before['ms'], i, item, before)
+            for i, (item, before) in enumerate(zip(report['updates'], previous['updates']))
+            if item['update_id'] == before['update_id']
+        ]
+        if len(deltas) < len(report['updates']):
+            self.stderr.write(f"Сопоставлено {len(deltas)} из {len(report['updates'])} update")
+        self.stdout.write("\nСамые замедлившиеся update:")
+        for delta, i, item, before in sorted(deltas, key=lambda row: -row[0])[:top]:
+            self.stdout.write(
+                f"  #{i:<6}{item['kind'][:27]:<28}{before['ms']:>9.2f} -> {item['ms']:>9.2f} мс ({delta:+.2f})"
+            )
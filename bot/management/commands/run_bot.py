@@ -1,9 +1,34 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from bot.telegram_bot import main
 
 class Command(BaseCommand):
     help = 'Запуск Telegram бота'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--webhook', action='store_true', help='Получать обновления через webhook вместо long-polling')
+        parser.add_argument('--listen', default='0.0.0.0', help='Адрес, на котором слушает встроенный сервер')
+        parser.add_argument('--port', type=int, default=8443, help='Порт встроенного сервера')
+        parser.add_argument('--url', help='Публичный адрес бота (по умолчанию TELEGRAM_WEBHOOK_URL)')
+        parser.add_argument('--url-path', default='telegram', help='Путь webhook на сервере')
+        parser.add_argument('--secret-token', help='Секрет для проверки запросов Telegram (по умолчанию TELEGRAM_WEBHOOK_SECRET)')
+        parser.add_argument('--max-connections', type=int, default=40, help='Максимум одновременных соединений от Telegram (1-100)')
+        parser.add_argument('--concurrency', type=int, help='Сколько чатов обрабатывать параллельно (по умолчанию BOT_CONCURRENCY или 1)')
+
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('Запуск Telegram бота...'))
-        main()
\ No newline at end of file
+        if not 1 <= options['max_connections'] <= 100:
+            # Telegram отклонит setWebhook уже после запуска бота
+            raise CommandError('--max-connections должен быть от 1 до 100')
+        if options['webhook']:
+            self.stdout.write(self.style.SUCCESS('Запуск Telegram бота (webhook)...'))
+        else:
+            self.stdout.write(self.style.SUCCESS('Запуск Telegram бота...'))
+        main(
+            webhook=options['webhook'],
+            listen=options['listen'],
+            port=options['port'],
+            webhook_url=options['url'],
+            url_path=options['url_path'],
+            secret_token=options['secret_token'],
+            max_connections=options['max_connections'],
+            concurrency=options['concurrency'],
+        )
@@ -0,0 +1,50 @@
+import asyncio
+import datetime
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bot import telegram_api
+from bot.digest import DigestSender
+
+
+class Command(BaseCommand):
+    help = 'Рассылка родителям недельной сводки по детям (запускать по расписанию, например из cron по понедельникам)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--week', type=datetime.date.fromisoformat, help='Понедельник недели YYYY-MM-DD (по умолчанию прошлая неделя)')
+        parser.add_argument('--rate', type=float, default=25, help='Не больше сообщений в секунду на всю рассылку')
+        parser.add_argument('--concurrency', type=int, default=20, help='Одновременных запросов к Telegram')
+        parser.add_argument('--batch-size', type=int, default=500, help='Родителей в одной пачке (один запрос сводки на пачку)')
+        parser.add_argument('--retry-failed', action='store_true', help='Повторить отправку тем, кому сводка не дошла')
+        parser.add_argument('--dry-run', action='store_true', help='Посчитать сообщения, ничего не отправляя и не записывая')
+
+    def handle(self, *args, **options):
+        token = os.environ.get('TELEGRAM_TOKEN')
+        if not token:
+            raise CommandError('Токен Telegram не найден в переменных окружения.')
+        if options['week'] and options['week'].weekday() != 0:
+            raise CommandError('--week должен быть понедельником')
+
+        sender = DigestSender(
+            token,
+            week_start=options['week'],
+            rate=options['rate'],
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        run = asyncio.run(self._run(sender, options['retry_failed']))
+        self.stdout.write(self.style.SUCCESS(
+            f'Сводка за неделю с {run.week_start}: в этом запуске отправлено {sender.sent}, ошибок {sender.failed}; '
+            f'всего отправлено {run.sent}, ошибок {run.failed}'
+        ))
+
+    async def _run(self, sender, retry_failed):
+        await telegram_api.open_async_client(sender.concurrency)
+        try:
+            if retry_failed:
+                return await sender.retry_failed()
+            return await sender.send_all()
+        finally:
+            await telegram_api.close_async_client()
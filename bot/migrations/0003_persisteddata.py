@@ -0,0 +1,26 @@
+# Generated by Django 5.1.1 on 2026-10-19 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0002_parent_kinddeed_added_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersistedData',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=100)),
+                ('key', models.CharField(max_length=255)),
+                ('data', models.JSONField(null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'key'), name='unique_persisted_data_key')],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:15
+
+from django.db import migrations, models
+
+
+def normalize_name(name):
+    # Копия bot.models.normalize_name на момент миграции
+    return " ".join(name.split()).casefold().replace("ё", "е")
+
+
+def fill_name_key(apps, schema_editor):
+    Child = apps.get_model('bot', 'Child')
+    batch = []
+    for child in Child.objects.only('telegram_id', 'name').iterator(chunk_size=1000):
+        child.name_key = normalize_name(child.name)
+        batch.append(child)
+        if len(batch) >= 1000:
+            Child.objects.bulk_update(batch, ['name_key'])
+            batch = []
+    if batch:
+        Child.objects.bulk_update(batch, ['name_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0005_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='child',
+            name='name_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=200),
+        ),
+        migrations.RunPython(fill_name_key, migrations.RunPython.noop),
+    ]
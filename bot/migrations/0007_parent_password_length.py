@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0006_child_name_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='parent',
+            name='password',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:22
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+# Копия bot.progress.BADGES на момент миграции
+BADGES = (
+    ('points', 100), ('points', 500), ('points', 1000), ('points', 3000),
+    ('points', 5000), ('points', 10000), ('points', 35000),
+    ('streak', 3), ('streak', 7), ('streak', 30),
+)
+
+
+def _mask(kind, value):
+    return sum(1 << bit for bit, (badge_kind, threshold) in enumerate(BADGES)
+               if badge_kind == kind and value >= threshold)
+
+
+def fill_progress(apps, schema_editor):
+    """Один проход по истории при установке; дальше прогресс обновляется по одному делу"""
+    Child = apps.get_model('bot', 'Child')
+    KindDeed = apps.get_model('bot', 'KindDeed')
+    ChildProgress = apps.get_model('bot', 'ChildProgress')
+
+    streaks = {}
+    deeds = KindDeed.objects.order_by('child_id', 'created_at').values_list('child_id', 'created_at')
+    for child_id, created_at in deeds.iterator(chunk_size=5000):
+        day = timezone.localdate(created_at)
+        current, best, last = streaks.get(child_id, (0, 0, None))
+        if last is None or day - last > datetime.timedelta(days=1):
+            current = 1
+        elif day > last:
+            current += 1
+        streaks[child_id] = (current, max(best, current), max(day, last or day))
+
+    batch = []
+    for child_id, total_points in Child.objects.values_list('telegram_id', 'total_points').iterator(chunk_size=1000):
+        current, best, last = streaks.get(child_id, (0, 0, None))
+        batch.append(ChildProgress(
+            child_id=child_id,
+            current_streak=current,
+            best_streak=best,
+            last_deed_date=last,
+            # Старые достижения не показываем как новые
+            badges=_mask('points', total_points) | _mask('streak', best),
+        ))
+        if len(batch) >= 1000:
+            ChildProgress.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ChildProgress.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0007_parent_password_length'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChildProgress',
+            fields=[
+                ('child', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='progress', serialize=False, to='bot.child')),
+                ('current_streak', models.IntegerField(default=0)),
+                ('best_streak', models.IntegerField(default=0)),
+                ('last_deed_date', models.DateField(blank=True, null=True)),
+                ('badges', models.BigIntegerField(default=0)),
+                ('new_badges', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def open_balances(apps, schema_editor):
+    """Начальный остаток журнала - текущий total_points; прежние дела остаются в KindDeed"""
+    Child = apps.get_model('bot', 'Child')
+    PointsTransaction = apps.get_model('bot', 'PointsTransaction')
+    batch = []
+    children = Child.objects.exclude(total_points=0).values_list('telegram_id', 'total_points')
+    for child_id, total_points in children.iterator(chunk_size=1000):
+        batch.append(PointsTransaction(
+            child_id=child_id, kind='opening', amount=total_points, description="Баланс до появления журнала",
+        ))
+        if len(batch) >= 1000:
+            PointsTransaction.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PointsTransaction.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0008_childprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PointsTransaction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Начальный остаток'), ('award', 'Начисление'), ('redemption', 'Обмен на награду'), ('correction', 'Исправление')], max_length=10)),
+                ('amount', models.IntegerField()),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='bot.child')),
+                ('deed', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='bot.kinddeed')),
+                ('reward', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='transactions', to='bot.reward')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PointsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('child', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='bot.child')),
+                ('last_transaction', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='bot.pointstransaction')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='pointstransaction',
+            index=models.Index(fields=['child', 'id'], name='transaction_child_tail'),
+        ),
+        migrations.AddIndex(
+            model_name='pointssnapshot',
+            index=models.Index(fields=['child', '-last_transaction'], name='snapshot_child_latest'),
+        ),
+        migrations.RunPython(open_balances, migrations.RunPython.noop),
+    ]
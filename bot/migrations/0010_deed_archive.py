@@ -0,0 +1,58 @@
+# Generated by Django 5.1.1 on 2026-10-19 14:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bot', '0009_points_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeedArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('deeds', models.IntegerField()),
+                ('points', models.IntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('last_created_at', models.DateTimeField()),
+                ('payload', models.BinaryField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeedRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('deeds', models.IntegerField(default=0)),
+                ('points', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='kinddeed',
+            index=models.Index(fields=['child', '-created_at'], name='deed_child_recent'),
+        ),
+        migrations.AddField(
+            model_name='deedarchive',
+            name='child',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deed_archives', to='bot.child'),
+        ),
+        migrations.AddField(
+            model_name='deedrollup',
+            name='child',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deed_rollups', to='bot.child'),
+        ),
+        migrations.AddIndex(
+            model_name='deedarchive',
+            index=models.Index(fields=['child', 'year'], name='deed_archive_child_year'),
+        ),
+        migrations.AddConstraint(
+            model_name='deedrollup',
+            constraint=models.UniqueConstraint(fields=('child', 'month'), name='unique_deed_rollup'),
+        ),
+    ]
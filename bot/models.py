@@ -1,11 +1,24 @@
 from django.db import models
 
+def normalize_name(name):
+    """Ключ поиска по имени: без лишних пробелов, без учета регистра, ё = е"""
+    return " ".join(name.split()).casefold().replace("ё", "е")
+
 class Child(models.Model):
     """Модель ребенка"""
     telegram_id = models.BigIntegerField(primary_key=True)
     name = models.CharField(max_length=100)
+    # Заполняется в save() из name; по нему ищут ребенка по имени
+    name_key = models.CharField(max_length=200, db_index=True, editable=False, default='')
     total_points = models.IntegerField(default=0)
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def save(self, *args, **kwargs):
+        self.name_key = normalize_name(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'name_key'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.name} ({self.total_points} баллов)"
@@ -14,9 +27,9 @@ class Parent(models.Model):
     """Модель родителя"""
     telegram_id = models.BigIntegerField(primary_key=True)
     name = models.CharField(max_length=100)
-    password = models.CharField(max_length=100, blank=True, null=True)  # Простой пароль для авторизации
+    password = models.CharField(max_length=128, blank=True, null=True)  # Хеш пароля в формате Django (bot/passwords.py)
     children = models.ManyToManyField(Child, related_name='parents')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
     def __str__(self):
         return f"{self.name} (Родитель)"
@@ -27,7 +40,13 @@ class KindDeed(models.Model):
     description = models.TextField()
     points = models.IntegerField()
     added_by = models.ForeignKey(Parent, on_delete=models.SET_NULL, null=True, blank=True, related_name='added_deeds')
-    created_at = models.DateTimeField(auto_now_add=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Последние дела ребенка: get_recent_deeds и отбор дел для архива
+            models.Index(fields=['child', '-created_at'], name='deed_child_recent'),
+        ]
 
     def __str__(self):
         return f"{self.description} ({self.points} баллов)"
@@ -39,4 +58,154 @@ class Reward(models.Model):
     description = models.TextField(blank=True, null=True)
     
     def __str__(self):
-        return f"{self.name} ({self.points_required} баллов)"
\ No newline at end of file
+        return f"{self.name} ({self.points_required} баллов)"
+
+class PersistedData(models.Model):
+    """Сохраненные данные ботов: состояния диалогов и user_data python-telegram-bot, состояния TeleBot"""
+    kind = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    data = models.JSONField(null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'key'], name='unique_persisted_data_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.key}"
+
+class DigestRun(models.Model):
+    """Рассылка недельной сводки родителям: контрольная точка для продолжения после сбоя"""
+    week_start = models.DateField(unique=True)  # Понедельник недели, за которую сводка
+    last_parent_id = models.BigIntegerField(default=0)  # Родители до этого id включительно обработаны
+    sent = models.IntegerField(default=0)
+    failed = models.IntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Сводка за неделю с {self.week_start}"
+
+class DigestDelivery(models.Model):
+    """Результат отправки сводки одному родителю"""
+    SENT = 'sent'
+    BLOCKED = 'blocked'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (SENT, 'Отправлена'),
+        (BLOCKED, 'Бот заблокирован'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    run = models.ForeignKey(DigestRun, on_delete=models.CASCADE, related_name='deliveries')
+    parent = models.ForeignKey(Parent, on_delete=models.CASCADE, related_name='digest_deliveries')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['run', 'parent'], name='unique_digest_delivery'),
+        ]
+
+    def __str__(self):
+        return f"{self.run}: {self.parent_id} ({self.status})"
+
+class ChildProgress(models.Model):
+    """Серия дней с добрыми делами и полученные значки; обновляется при каждом новом деле (bot/progress.py)"""
+    child = models.OneToOneField(Child, on_delete=models.CASCADE, primary_key=True, related_name='progress')
+    current_streak = models.IntegerField(default=0)  # Дней подряд до last_deed_date включительно
+    best_streak = models.IntegerField(default=0)
+    last_deed_date = models.DateField(null=True, blank=True)  # Местная дата последнего дела
+    badges = models.BigIntegerField(default=0)  # Битовая маска значков из bot.progress.BADGES
+    new_badges = models.BigIntegerField(default=0)  # Полученные, но еще не показанные ребенку
+
+    def __str__(self):
+        return f"{self.child_id}: серия {self.current_streak}"
+
+class PointsTransaction(models.Model):
+    """Запись журнала баллов: начисление, обмен на награду или исправление. Только добавляется (bot/ledger.py)"""
+    OPENING = 'opening'
+    AWARD = 'award'
+    REDEMPTION = 'redemption'
+    CORRECTION = 'correction'
+    KIND_CHOICES = [
+        (OPENING, 'Начальный остаток'),
+        (AWARD, 'Начисление'),
+        (REDEMPTION, 'Обмен на награду'),
+        (CORRECTION, 'Исправление'),
+    ]
+
+    child = models.ForeignKey(Child, on_delete=models.CASCADE, related_name='transactions')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    amount = models.IntegerField()  # Со знаком: обмен на награду уменьшает баланс
+    deed = models.ForeignKey(KindDeed, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    reward = models.ForeignKey(Reward, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Хвост после снимка: транзакции ребенка с id больше снимка
+            models.Index(fields=['child', 'id'], name='transaction_child_tail'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Записи журнала баллов не изменяются: добавьте исправление")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Записи журнала баллов не удаляются: добавьте исправление")
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.amount:+d} ({self.child_id})"
+
+class PointsSnapshot(models.Model):
+    """Баланс ребенка после транзакции last_transaction; баланс = последний снимок + более поздние транзакции"""
+    child = models.ForeignKey(Child, on_delete=models.CASCADE, related_name='snapshots')
+    last_transaction = models.OneToOneField(PointsTransaction, on_delete=models.CASCADE, related_name='snapshot')
+    balance = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['child', '-last_transaction'], name='snapshot_child_latest'),
+        ]
+
+    def __str__(self):
+        return f"{self.child_id}: {self.balance} после #{self.last_transaction_id}"
+
+class DeedRollup(models.Model):
+    """Итоги перенесенных в архив добрых дел ребенка за месяц (bot/archive.py)"""
+    child = models.ForeignKey(Child, on_delete=models.CASCADE, related_name='deed_rollups')
+    month = models.DateField()  # Первое число месяца, местное время
+    deeds = models.IntegerField(default=0)
+    points = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['child', 'month'], name='unique_deed_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.child_id} {self.month:%m.%Y}: {self.deeds} дел, {self.points} баллов"
+
+class DeedArchive(models.Model):
+    """Сжатые старые добрые дела ребенка за год: JSON-список строк KindDeed в zlib"""
+    child = models.ForeignKey(Child, on_delete=models.CASCADE, related_name='deed_archives')
+    year = models.IntegerField()
+    deeds = models.IntegerField()
+    points = models.IntegerField()
+    first_created_at = models.DateTimeField()
+    last_created_at = models.DateTimeField()
+    payload = models.BinaryField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['child', 'year'], name='deed_archive_child_year'),
+        ]
+
+    def __str__(self):
+        return f"{self.child_id} {self.year}: {self.deeds} дел"
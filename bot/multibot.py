@@ -0,0 +1,195 @@
+"""Несколько ботов (например, по одному на школу) в одном процессе.
+
+Токены задаются в BOT_TOKENS через запятую, каждый - как ``имя=токен`` или
+просто токен (тогда имя - id бота, часть токена до двоеточия). Без BOT_TOKENS
+работает один бот с TELEGRAM_TOKEN, как раньше.
+
+У каждого бота свой webhook-путь, свой пул соединений с Bot API
+(telegram_api.py) и свои лимиты частоты отправки; база, пул потоков
+sync_to_async и код обработчиков общие. Бот текущего update хранится в
+contextvar: обработчики не передают его явно, а состояния диалогов
+(BotStateDict) и отправка сообщений (bot_api) берут его сами.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+# Лимиты Bot API: около 30 сообщений в секунду на бота, не чаще раза в секунду
+# в один чат (короткие всплески допустимы), в группу - до 20 в минуту
+RATE_PER_SECOND = float(os.environ.get('TELEGRAM_RATE_PER_SECOND', 30))
+CHAT_RATE_PER_SECOND = float(os.environ.get('TELEGRAM_CHAT_RATE_PER_SECOND', 1))
+GROUP_RATE_PER_SECOND = float(os.environ.get('TELEGRAM_GROUP_RATE_PER_SECOND', 20 / 60))
+CHAT_BURST = int(os.environ.get('TELEGRAM_CHAT_BURST', 3))
+CHAT_BUCKETS_LIMIT = 10000
+
+_bots = OrderedDict()
+_current_bot = contextvars.ContextVar('current_bot', default=None)
+
+
+class RateBucket:
+    """Ведро жетонов с резервированием: reserve() сразу берет жетон и говорит, сколько ждать.
+
+    Жетоны могут уйти в минус - это очередь на будущее, поэтому ждать можно
+    вне блокировки и в любом цикле событий (под Flask у каждого запроса свой цикл).
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class RateLimiter:
+    """Лимиты одного бота: общий на все чаты и отдельный на каждый чат"""
+
+    def __init__(self):
+        self.total = RateBucket(RATE_PER_SECOND, max(RATE_PER_SECOND, 1))
+        self.chats = OrderedDict()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, chat_id=None):
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self.total.reserve(now), self.paused_until - now)
+            if chat_id is not None:
+                bucket = self.chats.get(chat_id)
+                if bucket is None:
+                    rate = GROUP_RATE_PER_SECOND if chat_id < 0 else CHAT_RATE_PER_SECOND
+                    bucket = self.chats[chat_id] = RateBucket(rate, CHAT_BURST)
+                    if len(self.chats) > CHAT_BUCKETS_LIMIT:
+                        self.chats.popitem(last=False)
+                else:
+                    self.chats.move_to_end(chat_id)
+                wait = max(wait, bucket.reserve(now))
+            return wait
+
+    async def acquire(self, chat_id=None):
+        wait = self.reserve(chat_id)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        # Telegram ответил 429: придерживаем все отправки этого бота
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class BotInstance:
+    def __init__(self, name, token):
+        self.name = name
+        self.token = token
+        self.webhook_path = f"/{token}"
+        self.limiter = RateLimiter()
+        # Состояния диалогов этого бота (см. BotStateDict)
+        self.state = {}
+
+    def __repr__(self):
+        return f"<BotInstance {self.name}>"
+
+
+def parse_tokens(value):
+    """Список BotInstance из строки "имя=токен,токен,..." """
+    bots = []
+    for item in value.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, token = item.partition('=')
+        if not sep:
+            name, token = item.split(':', 1)[0], item
+        bots.append(BotInstance(name.strip(), token.strip()))
+    return bots
+
+
+def load_bots():
+    """Регистрирует ботов из BOT_TOKENS (или одного из TELEGRAM_TOKEN), возвращает их список"""
+    if not _bots:
+        value = os.environ.get('BOT_TOKENS') or os.environ.get('TELEGRAM_TOKEN') or ''
+        for bot in parse_tokens(value):
+            if bot.name in _bots:
+                raise ValueError(f"Имя бота {bot.name} указано в BOT_TOKENS дважды")
+            _bots[bot.name] = bot
+    return list(_bots.values())
+
+
+def get_bot(name=None):
+    """Бот по имени; без имени - первый зарегистрированный. KeyError, если такого нет"""
+    bots = load_bots()
+    if name is None:
+        if not bots:
+            raise KeyError('Не задан ни BOT_TOKENS, ни TELEGRAM_TOKEN')
+        return bots[0]
+    return _bots[name]
+
+
+def current_bot():
+    """Бот, чей update сейчас обрабатывается (вне обработки - первый)"""
+    return _current_bot.get() or get_bot()
+
+
+@contextmanager
+def use_bot(bot):
+    """Внутри блока current_bot() - ``bot``"""
+    token = _current_bot.set(bot)
+    try:
+        yield bot
+    finally:
+        _current_bot.reset(token)
+
+
+async def bot_api(method, payload):
+    """call_api от имени текущего бота с учетом его лимитов"""
+    # telegram_api тянет requests: при ленивом старте он загружается с первым update
+    from bot.telegram_api import call_api
+
+    bot = current_bot()
+    if method != 'answerCallbackQuery':
+        await bot.limiter.acquire(payload.get('chat_id'))
+    response_json = await call_api(bot.token, method, payload)
+    if response_json.get('error_code') == 429:
+        bot.limiter.pause(response_json.get('parameters', {}).get('retry_after', 1))
+    return response_json
+
+
+class BotStateDict(MutableMapping):
+    """Словарь, у каждого бота свой: один и тот же пользователь в ботах
+    разных школ ведет независимые диалоги.
+
+    Заменяет обычный словарь состояний на уровне модуля без изменений в обработчиках.
+    """
+
+    def __init__(self, key):
+        self.key = key
+
+    def _data(self):
+        return current_bot().state.setdefault(self.key, {})
+
+    def __getitem__(self, item):
+        return self._data()[item]
+
+    def __setitem__(self, item, value):
+        self._data()[item] = value
+
+    def __delitem__(self, item):
+        del self._data()[item]
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return len(self._data())
@@ -0,0 +1,82 @@
+import contextvars
+from contextlib import asynccontextmanager
+
+# Максимальная длина текста сообщения в Bot API
+MAX_TEXT_LENGTH = 4096
+
+# Поля sendMessage, при которых сообщения еще можно склеить
+MERGEABLE_FIELDS = {'chat_id', 'text', 'parse_mode', 'reply_markup'}
+
+_current_batch = contextvars.ContextVar('outbound_batch', default=None)
+
+# Сколько sendMessage запросили обработчики и сколько реально ушло в API
+outbound_stats = {'requested': 0, 'sent': 0}
+
+
+class OutboundBatch:
+    """Исходящие sendMessage одного update.
+
+    Подряд идущие сообщения в один чат с одинаковым parse_mode склеиваются
+    в одно (через пустую строку), если у предыдущего нет клавиатуры и общий
+    текст не длиннее лимита Telegram. Клавиатура нового сообщения переходит
+    к склеенному: она и так была под последним текстом. Порядок сохраняется:
+    склеиваются только соседние сообщения, а перед любым другим видимым
+    в чате вызовом (например, editMessageText) очередь нужно отправить.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def add(self, payload):
+        outbound_stats['requested'] += 1
+        if self.pending and _can_merge(self.pending[-1], payload):
+            last = self.pending[-1]
+            last['text'] = f"{last['text']}\n\n{payload['text']}"
+            if 'reply_markup' in payload:
+                last['reply_markup'] = payload['reply_markup']
+        else:
+            self.pending.append(dict(payload))
+
+    def drain(self):
+        pending, self.pending = self.pending, []
+        outbound_stats['sent'] += len(pending)
+        return pending
+
+
+def _can_merge(previous, payload):
+    return (
+        previous['chat_id'] == payload['chat_id']
+        and previous.get('parse_mode') == payload.get('parse_mode')
+        and 'reply_markup' not in previous
+        and previous.keys() <= MERGEABLE_FIELDS
+        and payload.keys() <= MERGEABLE_FIELDS
+        and len(previous['text']) + 2 + len(payload['text']) <= MAX_TEXT_LENGTH
+    )
+
+
+def current_batch():
+    """Очередь текущего update или None, если сообщения отправляются сразу"""
+    return _current_batch.get()
+
+
+def start_batch():
+    """Открывает очередь для текущего контекста; возвращает токен для finish_batch()"""
+    return _current_batch.set(OutboundBatch())
+
+
+def finish_batch(token):
+    """Закрывает очередь и возвращает ее: дальше сообщения отправляются сразу"""
+    batch = _current_batch.get()
+    _current_batch.reset(token)
+    return batch
+
+
+@asynccontextmanager
+async def coalescing(send):
+    """Склеивает sendMessage внутри блока; send(payload) - корутина отправки"""
+    token = start_batch()
+    try:
+        yield
+    finally:
+        for payload in finish_batch(token).drain():
+            await send(payload)
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.hashers import check_password, make_password
+
+from bot.models import Parent
+
+# Хеширование паролей намеренно медленное (PBKDF2 из PASSWORD_HASHERS), поэтому
+# идет в отдельном маленьком пуле: одновременные входы родителей не занимают
+# ни поток ORM, ни общий пул sync_to_async
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+_executor = ThreadPoolExecutor(HASH_WORKERS, thread_name_prefix="password-hash")
+
+# Сколько секунд после ввода пароля /parent открывает меню без повторного ввода
+VERIFIED_TTL = float(os.environ.get('PARENT_VERIFIED_TTL', 900))
+
+# parent_id -> (истекает, хеш пароля на момент проверки)
+_verified = {}
+
+
+def _is_legacy(encoded):
+    # Старый формат: sha256 без соли, 64 hex-символа без имени алгоритма
+    return len(encoded) == 64 and '$' not in encoded
+
+
+def _verify(password, encoded):
+    """(пароль верен, новый хеш или None, если менять не нужно)"""
+    if not encoded:
+        return False, None
+    if _is_legacy(encoded):
+        is_valid = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+        return is_valid, make_password(password) if is_valid else None
+    # setter вызывается, если хеш сделан устаревшим алгоритмом или с меньшим числом итераций
+    outdated = []
+    is_valid = check_password(password, encoded, setter=outdated.append)
+    return is_valid, make_password(password) if outdated else None
+
+
+def hash_password(password):
+    return _executor.submit(make_password, password).result()
+
+
+async def ahash_password(password):
+    return await asyncio.get_running_loop().run_in_executor(_executor, make_password, password)
+
+
+def verify_parent_password(parent, password):
+    """Проверка пароля; старый хеш при успехе заменяется на хеш Django"""
+    is_valid, upgraded = _executor.submit(_verify, password, parent.password or '').result()
+    if upgraded:
+        Parent.objects.filter(pk=parent.pk, password=parent.password).update(password=upgraded)
+        parent.password = upgraded
+    if is_valid:
+        mark_verified(parent)
+    return is_valid
+
+
+async def averify_parent_password(parent, password):
+    loop = asyncio.get_running_loop()
+    is_valid, upgraded = await loop.run_in_executor(_executor, _verify, password, parent.password or '')
+    if upgraded:
+        await sync_to_async(
+            Parent.objects.filter(pk=parent.pk, password=parent.password).update
+        )(password=upgraded)
+        parent.password = upgraded
+    if is_valid:
+        mark_verified(parent)
+    return is_valid
+
+
+def mark_verified(parent):
+    now = time.monotonic()
+    _verified[parent.pk] = (now + VERIFIED_TTL, parent.password)
+    if len(_verified) > 10000:
+        for parent_id, (expires_at, _) in list(_verified.items()):
+            if expires_at < now:
+                _verified.pop(parent_id, None)
+
+
+def is_verified(parent_id, password):
+    """Вводил ли родитель пароль за последние VERIFIED_TTL секунд; ``password`` - его текущий хеш"""
+    item = _verified.get(parent_id)
+    return item is not None and item[0] > time.monotonic() and item[1] == password
+
+
+def recently_verified(parent):
+    """То же для объекта Parent: сменившийся с тех пор пароль снимает проверку"""
+    return is_verified(parent.pk, parent.password)
+
+
+def forget_verified(parent_id):
+    _verified.pop(parent_id, None)
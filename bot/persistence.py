@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import time
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from telegram.ext import BasePersistence
+
+from bot.models import PersistedData
+
+logger = logging.getLogger(__name__)
+
+USER_DATA = "user_data"
+CHAT_DATA = "chat_data"
+BOT_DATA = "bot_data"
+CALLBACK_DATA = "callback_data"
+CONVERSATION = "conversation:"
+
+# Метка "запись нужно удалить" в буфере изменений
+_DELETED = object()
+
+
+class DjangoPersistence(BasePersistence):
+    """Хранилище python-telegram-bot в базе Django с отложенной пакетной записью.
+
+    Application передает изменения раз в ``update_interval`` секунд, они копятся
+    в памяти и пишутся в БД одной транзакцией: через ``flush_interval`` секунд
+    после первого изменения или сразу, как только накопится ``max_pending``
+    изменений. При остановке бота Application вызывает ``flush()``.
+    """
+
+    def __init__(self, store_data=None, update_interval=5, flush_interval=30, max_pending=100):
+        super().__init__(store_data=store_data, update_interval=update_interval)
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._timer = None
+        self._flush_lock = asyncio.Lock()
+        self._flush_tasks = set()
+        self.flush_count = 0
+        self.written_count = 0
+
+    # --- Чтение при запуске ---
+
+    async def get_user_data(self):
+        rows = await _load(USER_DATA)
+        return {int(key): data for key, data in rows.items()}
+
+    async def get_chat_data(self):
+        rows = await _load(CHAT_DATA)
+        return {int(key): data for key, data in rows.items()}
+
+    async def get_bot_data(self):
+        rows = await _load(BOT_DATA)
+        return rows.get(BOT_DATA, {})
+
+    async def get_callback_data(self):
+        rows = await _load(CALLBACK_DATA)
+        data = rows.get(CALLBACK_DATA)
+        if data is None:
+            return None
+        # JSON не различает списки и кортежи, восстанавливаем формат PTB
+        return [tuple(item) for item in data[0]], data[1]
+
+    async def get_conversations(self, name):
+        rows = await _load(CONVERSATION + name)
+        return {tuple(json.loads(key)): state for key, state in rows.items()}
+
+    # --- Запись (только в буфер) ---
+
+    async def update_user_data(self, user_id, data):
+        self._schedule(USER_DATA, str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._schedule(CHAT_DATA, str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        self._schedule(BOT_DATA, BOT_DATA, data)
+
+    async def update_callback_data(self, data):
+        self._schedule(CALLBACK_DATA, CALLBACK_DATA, data)
+
+    async def update_conversation(self, name, key, new_state):
+        self._schedule(
+            CONVERSATION + name,
+            json.dumps(list(key)),
+            _DELETED if new_state is None else new_state,
+        )
+
+    async def drop_user_data(self, user_id):
+        self._schedule(USER_DATA, str(user_id), _DELETED)
+
+    async def drop_chat_data(self, chat_id):
+        self._schedule(CHAT_DATA, str(chat_id), _DELETED)
+
+    # Данные в памяти Application всегда актуальнее сохраненных
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- Сброс буфера в БД ---
+
+    def _schedule(self, kind, key, data):
+        """Кладет изменение в буфер; повторные изменения одного ключа схлопываются"""
+        self._pending[(kind, key)] = data
+        if len(self._pending) >= self.max_pending:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+
+    def _start_flush(self):
+        task = asyncio.create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self):
+        async with self._flush_lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+
+            started = time.perf_counter()
+            try:
+                await _write(pending)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении состояния бота: {e}")
+                # Возвращаем изменения в буфер, не затирая более свежие
+                self._pending = {**pending, **self._pending}
+                if self._timer is None:
+                    self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._start_flush)
+                return
+
+            self.flush_count += 1
+            self.written_count += len(pending)
+            logger.info(
+                f"Состояние бота сохранено: {len(pending)} изменений "
+                f"за {(time.perf_counter() - started) * 1000:.1f} мс"
+            )
+
+
+@sync_to_async
+def _load(kind):
+    return dict(PersistedData.objects.filter(kind=kind).values_list('key', 'data'))
+
+
+@sync_to_async
+def _write(pending):
+    upserts = []
+    deletes = {}
+    for (kind, key), data in pending.items():
+        if data is _DELETED:
+            deletes.setdefault(kind, []).append(key)
+        else:
+            upserts.append(PersistedData(kind=kind, key=key, data=data))
+
+    with transaction.atomic():
+        if upserts:
+            PersistedData.objects.bulk_create(
+                upserts,
+                update_conflicts=True,
+                unique_fields=['kind', 'key'],
+                update_fields=['data', 'updated_at'],
+            )
+        for kind, keys in deletes.items():
+            PersistedData.objects.filter(kind=kind, key__in=keys).delete()
@@ -0,0 +1,155 @@
+import datetime
+import logging
+
+from asgiref.sync import sync_to_async
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from bot.models import Child, ChildProgress, KindDeed
+
+logger = logging.getLogger(__name__)
+
+# Значки: (вид, порог, название). Номер в списке - номер бита в ChildProgress.badges,
+# поэтому новые значки добавляются только в конец
+BADGES = (
+    ('points', 100, "🌱 Первые 100 баллов"),
+    ('points', 500, "🌿 500 баллов"),
+    ('points', 1000, "🌳 1000 баллов"),
+    ('points', 3000, "⭐ 3000 баллов"),
+    ('points', 5000, "🌟 5000 баллов"),
+    ('points', 10000, "🏆 10000 баллов"),
+    ('points', 35000, "👑 35000 баллов"),
+    ('streak', 3, "🔥 3 дня подряд"),
+    ('streak', 7, "🔥 Неделя добрых дел"),
+    ('streak', 30, "🔥 Месяц добрых дел"),
+)
+
+
+def earned_badges(kind, value):
+    """Маска значков вида ``kind``, порог которых достигнут"""
+    mask = 0
+    for bit, (badge_kind, threshold, _) in enumerate(BADGES):
+        if badge_kind == kind and value >= threshold:
+            mask |= 1 << bit
+    return mask
+
+
+def badge_titles(mask):
+    return [title for bit, (_, _, title) in enumerate(BADGES) if mask & (1 << bit)]
+
+
+def advance_streak(progress, day):
+    """Учитывает дело за день ``day``; возвращает True, если серия изменилась"""
+    last = progress.last_deed_date
+    if last is not None and day <= last:
+        # Еще одно дело в тот же день (или дело задним числом): серия не меняется
+        return False
+    if last is not None and day - last == datetime.timedelta(days=1):
+        progress.current_streak += 1
+    else:
+        progress.current_streak = 1
+    progress.best_streak = max(progress.best_streak, progress.current_streak)
+    progress.last_deed_date = day
+    return True
+
+
+def _award(progress, mask):
+    new = mask & ~progress.badges
+    progress.badges |= new
+    progress.new_badges |= new
+    return bool(new)
+
+
+def _locked_progress(child_id):
+    progress, _ = ChildProgress.objects.select_for_update().get_or_create(child_id=child_id)
+    return progress
+
+
+def _after_commit(func, *args):
+    """Обновление прогресса после сохранения дела или баллов, в отдельной транзакции.
+
+    Серия и значки - дополнение к делу: если их обновить не удалось (например,
+    база занята), дело и баллы уже сохранены, а ошибка только пишется в лог.
+    """
+    def run():
+        try:
+            with transaction.atomic():
+                func(*args)
+        except Exception as e:
+            logger.error(f"Не удалось обновить прогресс ребенка {args[0]}: {e}")
+
+    transaction.on_commit(run)
+
+
+def _update_streak(child_id, day):
+    progress = _locked_progress(child_id)
+    if advance_streak(progress, day):
+        _award(progress, earned_badges('streak', progress.current_streak))
+        progress.save()
+
+
+def _award_point_badges(child_id, total_points):
+    mask = earned_badges('points', total_points)
+    if not mask:
+        return
+    progress = _locked_progress(child_id)
+    if _award(progress, mask):
+        progress.save()
+
+
+def award_point_badges(child_id, total_points):
+    """Значки за баллы после начисления в обход Child.save() (например, UPDATE с F())"""
+    if earned_badges('points', total_points):
+        _after_commit(_award_point_badges, child_id, total_points)
+
+
+@receiver(post_save, sender=KindDeed)
+def _deed_created(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    _after_commit(_update_streak, instance.child_id, timezone.localdate(instance.created_at))
+
+
+@receiver(post_save, sender=Child)
+def _child_saved(sender, instance, update_fields=None, raw=False, **kwargs):
+    # Баллы начисляются сохранением ребенка с update_fields=["total_points"]
+    if raw or (update_fields is not None and 'total_points' not in update_fields):
+        return
+    award_point_badges(instance.pk, instance.total_points)
+
+
+def active_streak(progress, today=None):
+    """Текущая серия: если вчера и сегодня дел не было, она уже прервалась"""
+    if progress is None or progress.last_deed_date is None:
+        return 0
+    today = today or timezone.localdate()
+    if today - progress.last_deed_date > datetime.timedelta(days=1):
+        return 0
+    return progress.current_streak
+
+
+def take_progress(child_id):
+    """Прогресс ребенка (или None) и названия еще не показанных значков; значки отмечаются показанными"""
+    progress = ChildProgress.objects.filter(child_id=child_id).first()
+    if progress is None or not progress.new_badges:
+        return progress, []
+    titles = badge_titles(progress.new_badges)
+    # Сбрасываем только показанные: значок, полученный между запросами, не потеряется
+    ChildProgress.objects.filter(pk=progress.pk, new_badges=progress.new_badges).update(new_badges=0)
+    return progress, titles
+
+
+atake_progress = sync_to_async(take_progress)
+
+
+def format_progress(progress, new_titles):
+    """Строки о серии и новых значках для ответа на /points (пустая строка, если сказать нечего)"""
+    lines = []
+    streak = active_streak(progress)
+    if streak:
+        lines.append(f"🔥 Серия: *{streak}* дн. подряд (рекорд - {progress.best_streak})")
+    if new_titles:
+        lines.append("🎖 *Новые значки:* " + ", ".join(new_titles))
+    return "\n".join(lines) + "\n\n" if lines else ""
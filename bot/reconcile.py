@@ -0,0 +1,50 @@
+import logging
+
+from django.db.models import F, Q
+
+from bot.ledger import ledger_balance
+from bot.models import Child
+
+logger = logging.getLogger(__name__)
+
+
+def expected_totals():
+    """Дети, у которых total_points расходится с балансом по журналу баллов.
+
+    Один запрос: баланс каждого ребенка - последний снимок плюс записи после
+    него (bot/ledger.py), так что история целиком не читается. Из базы приходят
+    только расходящиеся строки: (telegram_id, сохранено, должно быть).
+    """
+    return (
+        Child.objects
+        .annotate(expected=ledger_balance())
+        .filter(~Q(total_points=F('expected')))
+        .order_by('telegram_id')
+        .values_list('telegram_id', 'total_points', 'expected')
+    )
+
+
+def reconcile_points(chunk_size=1000, dry_run=False):
+    """Исправляет total_points у расходящихся детей, возвращает статистику расхождений"""
+    stats = {'checked': Child.objects.count(), 'mismatched': 0, 'updated': 0, 'net_drift': 0, 'abs_drift': 0, 'max_drift': 0}
+    mismatched = list(expected_totals())
+    for telegram_id, stored, expected in mismatched:
+        drift = stored - expected
+        stats['net_drift'] += drift
+        stats['abs_drift'] += abs(drift)
+        stats['max_drift'] = max(stats['max_drift'], abs(drift))
+    stats['mismatched'] = len(mismatched)
+
+    if not dry_run:
+        for i in range(0, len(mismatched), chunk_size):
+            ids = [row[0] for row in mismatched[i:i + chunk_size]]
+            # Баланс пересчитывается в самом UPDATE: запись, добавленная ботом после
+            # чтения расхождений, не потеряется
+            stats['updated'] += Child.objects.filter(pk__in=ids).update(total_points=ledger_balance())
+
+    logger.info(
+        f"Сверка баллов: проверено {stats['checked']}, расхождений {stats['mismatched']}, "
+        f"исправлено {stats['updated']}, суммарно {stats['net_drift']:+d} (по модулю {stats['abs_drift']}, "
+        f"максимум {stats['max_drift']})"
+    )
+    return stats
@@ -0,0 +1,159 @@
+"""Запись входящих update в журнал для воспроизведения (manage.py replay_updates).
+
+Включается переменной BOT_RECORD_UPDATES=путь: webhook-маршруты дописывают
+каждый update строкой JSON (NDJSON) в конец файла. По расширению выбирается
+сжатие: .gz - gzip, .zst - zstd (нужен пакет zstandard), иначе без сжатия.
+В пути можно указать {pid}: у каждого процесса-воркера будет свой файл.
+
+BOT_RECORD_SAMPLE (от 0 до 1) - доля записываемых пользователей. Отбор идет
+по пользователю, а не по update: диалог попадает в журнал целиком, иначе
+при воспроизведении состояния (ожидание баллов и т.п.) не сходились бы.
+
+Пароли в журнал не попадают: маршрут передает secret=True для сообщения,
+отправленного на шаге ввода пароля родителя, и вместо его текста пишется
+REDACTED. При воспроизведении такой пароль просто не подходит.
+"""
+import atexit
+import gzip
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Сжатый поток сбрасывается на диск не чаще раза в FLUSH_SECONDS: так сжатие
+# эффективнее, а при падении теряется не больше секунды записей
+FLUSH_SECONDS = 1.0
+
+REDACTED = '[скрыто]'
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+
+def _open_writer(path):
+    if path.endswith('.zst'):
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=10).stream_writer(open(path, 'ab'), closefd=True)
+    if path.endswith('.gz'):
+        # Каждое открытие дописывает новый gzip-член: gzip читает их подряд
+        return gzip.open(path, 'ab')
+    return open(path, 'ab')
+
+
+def redact_text(update):
+    """Копия update с текстом сообщения, замененным на REDACTED"""
+    redacted = dict(update)
+    for key in ('message', 'edited_message'):
+        if key in redacted and 'text' in redacted[key]:
+            redacted[key] = {**redacted[key], 'text': REDACTED}
+    return redacted
+
+
+def update_user_id(update):
+    """Пользователь, от которого пришел update (None, если определить нельзя)"""
+    for key in ('message', 'edited_message', 'callback_query'):
+        if key in update:
+            return update[key].get('from', {}).get('id')
+    return None
+
+
+class UpdateRecorder:
+    def __init__(self, path, sample=1.0):
+        self.path = path.format(pid=os.getpid())
+        self.sample = sample
+        self.flushed = time.monotonic()
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._file = _open_writer(self.path)
+        atexit.register(self.close)
+        logger.info(f"Запись update в {self.path} (доля пользователей {sample:.0%})")
+
+    def sampled(self, update):
+        if self.sample >= 1:
+            return True
+        user_id = update_user_id(update)
+        if user_id is None:
+            return random.random() < self.sample
+        return zlib.crc32(str(user_id).encode()) % 10000 < self.sample * 10000
+
+    def record(self, update, bot=None):
+        if not self.sampled(update):
+            return
+        line = json.dumps({'ts': time.time(), 'bot': bot, 'update': update}, ensure_ascii=False)
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line.encode() + b"\n")
+            self.recorded += 1
+            now = time.monotonic()
+            if now - self.flushed >= FLUSH_SECONDS:
+                self._file.flush()
+                self.flushed = now
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def get_recorder():
+    """Запись из BOT_RECORD_UPDATES или None, если она выключена"""
+    global _recorder
+
+    if _recorder is None:
+        path = os.environ.get('BOT_RECORD_UPDATES')
+        if not path:
+            return None
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = UpdateRecorder(path, float(os.environ.get('BOT_RECORD_SAMPLE', 1)))
+    return _recorder
+
+
+def record_update(update, bot=None, secret=False):
+    """Дописывает update в журнал, если запись включена.
+
+    ``bot`` - имя бота (bot/multibot.py); ``secret`` - текст сообщения нельзя
+    сохранять (пароль родителя).
+    """
+    recorder = get_recorder()
+    if recorder is None:
+        return
+    try:
+        recorder.record(redact_text(update) if secret else update, bot)
+    except Exception as e:
+        # Запись вспомогательная: ее сбой не должен мешать обработке update
+        logger.error(f"Не удалось записать update: {e}")
+
+
+def read_updates(path):
+    """Записи журнала по порядку: словари {'ts', 'bot', 'update'}.
+
+    Оборванная последняя строка (процесс остановили во время записи) пропускается.
+    """
+    if path.endswith('.zst'):
+        import zstandard
+
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+    elif path.endswith('.gz'):
+        raw = gzip.open(path, 'rb')
+    else:
+        raw = open(path, 'rb')
+
+    with io.TextIOWrapper(raw, encoding='utf-8') as lines:
+        try:
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Пропущена поврежденная строка журнала {path}")
+        except EOFError:
+            logger.warning(f"Журнал {path} обрывается: последние записи не были сброшены на диск")
@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from bot.children import remember_parent_children
+from bot.models import Child, Parent
+from bot.passwords import is_verified
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд сессия действительна без обращения к БД. Изменения из другого
+# процесса (админка, другой вариант бота) видны не позже этого срока.
+SESSION_TTL = float(os.environ.get('PARENT_SESSION_TTL', 600))
+SESSIONS_LIMIT = 10000
+
+
+class ParentNotVerified(PermissionError):
+    """Родитель не вводил пароль последние VERIFIED_TTL секунд (bot/passwords.py)"""
+
+
+class ParentSession:
+    """То, что нужно меню родителя: id, имя, дети (telegram_id, имя) и срок действия.
+
+    ``password`` - хеш пароля при загрузке: сессию выдают, только пока именно
+    этот пароль недавно вводили (passwords.is_verified).
+    """
+
+    def __init__(self, parent_id, name, children, expires_at, password):
+        self.parent_id = parent_id
+        self.name = name
+        self.children = children
+        self.expires_at = expires_at
+        self.password = password
+        self._names = dict(children)
+
+    @property
+    def child_ids(self):
+        return [child_id for child_id, _ in self.children]
+
+    def child_name(self, child_id):
+        """Имя ребенка или None, если это не ребенок этого родителя"""
+        return self._names.get(child_id)
+
+
+# parent_id -> ParentSession; дети -> родители, чьи сессии их содержат
+_sessions = OrderedDict()
+_child_parents = {}
+_lock = threading.Lock()
+session_stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+
+
+def _cached(parent_id):
+    with _lock:
+        session = _sessions.get(parent_id)
+        if session is None or session.expires_at < time.monotonic():
+            session_stats['misses'] += 1
+            return None
+        _sessions.move_to_end(parent_id)
+        session_stats['hits'] += 1
+        return session
+
+
+def _store(session):
+    with _lock:
+        _drop(session.parent_id)
+        _sessions[session.parent_id] = session
+        for child_id in session.child_ids:
+            _child_parents.setdefault(child_id, set()).add(session.parent_id)
+        while len(_sessions) > SESSIONS_LIMIT:
+            _drop(next(iter(_sessions)))
+
+
+def _drop(parent_id):
+    session = _sessions.pop(parent_id, None)
+    if session is None:
+        return False
+    for child_id in session.child_ids:
+        parents = _child_parents.get(child_id)
+        if parents is not None:
+            parents.discard(parent_id)
+            if not parents:
+                del _child_parents[child_id]
+    return True
+
+
+def load_parent_session(parent_id):
+    """Сессия из БД (два запроса); Parent.DoesNotExist, если такого родителя нет"""
+    parent = Parent.objects.only('telegram_id', 'name', 'password').get(telegram_id=parent_id)
+    children = list(parent.children.only('telegram_id', 'name', 'name_key').order_by('pk'))
+    remember_parent_children(parent.pk, children)
+    session = ParentSession(
+        parent.pk,
+        parent.name,
+        tuple((child.pk, child.name) for child in children),
+        time.monotonic() + SESSION_TTL,
+        parent.password,
+    )
+    _store(session)
+    return session
+
+
+def _verified(session):
+    if not is_verified(session.parent_id, session.password):
+        raise ParentNotVerified(f"родитель {session.parent_id} давно не вводил пароль")
+    return session
+
+
+def get_parent_session(parent_id):
+    """Сессия родителя из памяти процесса, при промахе - из БД.
+
+    ParentNotVerified, если пароль не вводили последние VERIFIED_TTL секунд.
+    """
+    return _verified(_cached(parent_id) or load_parent_session(parent_id))
+
+
+async def aget_parent_session(parent_id):
+    """То же из асинхронного кода: попадание в кэш обходится без перехода в поток БД"""
+    return _verified(_cached(parent_id) or await sync_to_async(load_parent_session)(parent_id))
+
+
+async def aparent_session_expired(parent_id):
+    """Закрыто ли меню родителя из-за давно введенного пароля (False, если такого родителя нет)"""
+    try:
+        await aget_parent_session(parent_id)
+    except ParentNotVerified:
+        return True
+    except Parent.DoesNotExist:
+        pass
+    return False
+
+
+def invalidate_parent_session(parent_id):
+    with _lock:
+        if _drop(parent_id):
+            session_stats['invalidated'] += 1
+
+
+@receiver(m2m_changed, sender=Parent.children.through)
+def _parent_children_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        invalidate_parent_session(instance.pk)
+        return
+    # Изменение со стороны ребенка: pk_set - родители, а при clear() - неизвестно кто
+    with _lock:
+        parent_ids = pk_set or set(_child_parents.get(instance.pk, ()))
+    for parent_id in parent_ids:
+        invalidate_parent_session(parent_id)
+
+
+@receiver(post_save, sender=Parent)
+@receiver(post_delete, sender=Parent)
+def _parent_changed(sender, instance, **kwargs):
+    invalidate_parent_session(instance.pk)
+
+
+@receiver(post_save, sender=Child)
+@receiver(post_delete, sender=Child)
+def _child_changed(sender, instance, signal, **kwargs):
+    # Начисление баллов тоже сохраняет ребенка; сессию сбрасываем, только если
+    # ребенок удален или его имя в ней устарело
+    deleted = signal is post_delete
+    with _lock:
+        parent_ids = [
+            parent_id for parent_id in _child_parents.get(instance.pk, ())
+            if deleted or _sessions[parent_id].child_name(instance.pk) != instance.name
+        ]
+    for parent_id in parent_ids:
+        invalidate_parent_session(parent_id)
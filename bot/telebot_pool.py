@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class ChatSerialExecutor:
+    """Ограниченный пул потоков: разные чаты параллельно, один чат - по очереди.
+
+    Состояния TeleBot хранятся на пару (чат, пользователь), поэтому обновления
+    одного чата нельзя обрабатывать одновременно. ``max_pending`` ограничивает
+    общее число принятых задач (ожидающих и выполняющихся); сверх него
+    ``submit()`` возвращает False, и вызывающий код сам решает, что делать.
+    """
+
+    def __init__(self, max_workers=8, max_pending=256, stats_every=1000):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.stats_every = stats_every
+        self._executor = ThreadPoolExecutor(max_workers, thread_name_prefix="telebot-worker")
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._waits = deque(maxlen=1000)
+        self.pending = 0
+        self.running = 0
+        self.submitted = 0
+        self.started = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def submit(self, key, fn, *args):
+        if key is None:
+            # Обновления без чата ни с чем не упорядочиваем
+            key = object()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            self.submitted += 1
+            task = (fn, args, time.perf_counter())
+            queue = self._queues.get(key)
+            if queue is not None:
+                # По этому чату уже работает поток: он заберет задачу сам
+                queue.append(task)
+                return True
+            self._queues[key] = deque([task])
+        self._executor.submit(self._drain, key)
+        return True
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                queue = self._queues[key]
+                if not queue:
+                    del self._queues[key]
+                    return
+                fn, args, queued_at = queue.popleft()
+                self.running += 1
+                self._record_wait(queued_at)
+            failed = False
+            try:
+                fn(*args)
+            except Exception as e:
+                failed = True
+                logger.error(f"Ошибка при обработке обновления чата {key}: {e}")
+            finally:
+                # Как после обычного запроса Django: не держим сломанные и устаревшие соединения
+                close_old_connections()
+                with self._lock:
+                    self.running -= 1
+                    self.pending -= 1
+                    self.completed += 1
+                    self.failed += failed
+
+    def _record_wait(self, queued_at):
+        wait = time.perf_counter() - queued_at
+        self.started += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._waits.append(wait)
+        if self.stats_every and not self.started % self.stats_every:
+            logger.info(f"Пул обработчиков: {self._format_stats(self._stats())}")
+
+    def stats(self):
+        """Метрики загрузки пула (время ожидания в миллисекундах)"""
+        with self._lock:
+            return self._stats()
+
+    def _stats(self):
+        recent = sorted(self._waits)
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "running": self.running,
+            "pending": self.pending,
+            "active_chats": len(self._queues),
+            "saturation": self.pending / self.max_pending,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": self.total_wait / self.started * 1000 if self.started else 0.0,
+            "p95_wait_ms": recent[int(len(recent) * 0.95) - 1] * 1000 if recent else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    @staticmethod
+    def _format_stats(stats):
+        return (
+            f"работают {stats['running']}/{stats['max_workers']}, "
+            f"принято {stats['pending']}/{stats['max_pending']}, отклонено {stats['rejected']}, "
+            f"ожидание avg {stats['avg_wait_ms']:.1f} мс, p95 {stats['p95_wait_ms']:.1f} мс"
+        )
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+        logger.info(f"Пул обработчиков остановлен: {self._format_stats(self.stats())}")
+
+
+def update_chat_key(update):
+    """Ключ сериализации для сырого update Bot API: чат, а без чата - пользователь"""
+    for field in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if field in update:
+            return update[field]['chat']['id']
+    callback_query = update.get('callback_query')
+    if callback_query:
+        if callback_query.get('message'):
+            return callback_query['message']['chat']['id']
+        return ("user", callback_query['from']['id'])
+    for value in update.values():
+        if isinstance(value, dict) and 'from' in value:
+            return ("user", value['from']['id'])
+    return None
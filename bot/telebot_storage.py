@@ -0,0 +1,254 @@
+import copy
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import sync_to_async
+from telebot.asyncio_storage import StateStorageBase as AsyncStateStorageBase
+from telebot.asyncio_storage.base_storage import StateDataContext as AsyncStateDataContext
+from telebot.storage import StateStorageBase
+from telebot.storage.base_storage import StateDataContext
+
+from bot.models import PersistedData
+
+logger = logging.getLogger(__name__)
+
+# Метка "в кэше нет записи"
+_MISSING = object()
+
+
+def state_cache_ttl():
+    """Время жизни кэша состояний из TELEBOT_STATE_CACHE_TTL (по умолчанию 2 с).
+
+    Кэш верен только при одном процессе: при WEB_CONCURRENCY > 1 он выключен.
+    """
+    ttl = float(os.environ.get('TELEBOT_STATE_CACHE_TTL', 2))
+    if ttl and int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+        if 'TELEBOT_STATE_CACHE_TTL' in os.environ:
+            logger.error("TELEBOT_STATE_CACHE_TTL верен только для одного процесса, при WEB_CONCURRENCY > 1 кэш выключен")
+        return 0.0
+    return ttl
+
+
+class StateCache:
+    """LRU-кэш состояний с временем жизни записей, безопасный для потоков.
+
+    Запоминает и отсутствие записи: у большинства сообщений состояния нет,
+    и повторно спрашивать об этом БД незачем.
+    """
+
+    def __init__(self, maxsize=10000, ttl=2.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < time.monotonic():
+                self.misses += 1
+                return _MISSING
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key, record):
+        if not self.ttl or not self.maxsize:
+            return
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, record)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+
+class _DjangoStateStore:
+    """Общая часть хранилищ: запись {"state": ..., "data": {...}} в PersistedData.
+
+    Кэш в памяти процесса сквозной: запись идет в БД и сразу в кэш, чтение
+    из БД только при промахе. Он верен только при одном процессе: другой
+    процесс мог уже записать состояние, а кэш (в том числе запомненное
+    отсутствие записи) еще ``cache_ttl`` секунд отдавал бы старое, и шаг
+    диалога терялся бы. Если webhook обслуживают несколько процессов, нужен
+    ``cache_ttl=0`` (см. state_cache_ttl()).
+    """
+
+    def __init__(self, prefix="telebot", separator=":", cache_size=10000, cache_ttl=2.0):
+        if not prefix:
+            raise ValueError("Prefix cannot be empty")
+        self.prefix = prefix
+        self.separator = separator
+        self.cache = StateCache(cache_size, cache_ttl)
+
+    def _make_key(self, chat_id, user_id, business_connection_id, message_thread_id, bot_id):
+        return self._get_key(
+            chat_id, user_id, self.prefix, self.separator,
+            business_connection_id, message_thread_id, bot_id,
+        )
+
+    def _fetch(self, key):
+        record = (
+            PersistedData.objects.filter(kind=self.prefix, key=key)
+            .values_list('data', flat=True)
+            .first()
+        )
+        self.cache.put(key, record)
+        return record
+
+    def _store(self, key, record):
+        if record is None:
+            PersistedData.objects.filter(kind=self.prefix, key=key).delete()
+        else:
+            PersistedData.objects.update_or_create(kind=self.prefix, key=key, defaults={'data': record})
+        self.cache.put(key, record)
+
+
+def _state_name(state):
+    return state.name if hasattr(state, "name") else state
+
+
+class DjangoStateStorage(_DjangoStateStore, StateStorageBase):
+    """Хранилище состояний TeleBot в базе Django, общее для всех процессов"""
+
+    def _load(self, key):
+        record = self.cache.get(key)
+        if record is _MISSING:
+            record = self._fetch(key)
+        return record
+
+    def set_state(self, chat_id, user_id, state,
+                  business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = self._load(key) or {"data": {}}
+        self._store(key, {**record, "state": _state_name(state)})
+        return True
+
+    def get_state(self, chat_id, user_id,
+                  business_connection_id=None, message_thread_id=None, bot_id=None):
+        record = self._load(self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        return record["state"] if record else None
+
+    def delete_state(self, chat_id, user_id,
+                     business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        if self._load(key) is None:
+            return False
+        self._store(key, None)
+        return True
+
+    def set_data(self, chat_id, user_id, key, value,
+                 business_connection_id=None, message_thread_id=None, bot_id=None):
+        _key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = self._load(_key)
+        if record is None:
+            raise RuntimeError(f"DjangoStateStorage: key {_key} does not exist.")
+        self._store(_key, {**record, "data": {**record["data"], key: value}})
+        return True
+
+    def get_data(self, chat_id, user_id,
+                 business_connection_id=None, message_thread_id=None, bot_id=None):
+        record = self._load(self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        # Копия: запись из кэша не должна меняться в обход _store()
+        return copy.deepcopy(record["data"]) if record else {}
+
+    def reset_data(self, chat_id, user_id,
+                   business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = self._load(key)
+        if record is None:
+            return False
+        self._store(key, {**record, "data": {}})
+        return True
+
+    def get_interactive_data(self, chat_id, user_id,
+                             business_connection_id=None, message_thread_id=None, bot_id=None):
+        return StateDataContext(
+            self, chat_id=chat_id, user_id=user_id, business_connection_id=business_connection_id,
+            message_thread_id=message_thread_id, bot_id=bot_id,
+        )
+
+    def save(self, chat_id, user_id, data,
+             business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = self._load(key)
+        if record is None:
+            return False
+        self._store(key, {**record, "data": data})
+        return True
+
+
+class AsyncDjangoStateStorage(_DjangoStateStore, AsyncStateStorageBase):
+    """То же для AsyncTeleBot: попадания в кэш обслуживаются без перехода в поток БД"""
+
+    async def _load(self, key):
+        record = self.cache.get(key)
+        if record is _MISSING:
+            record = await sync_to_async(self._fetch)(key)
+        return record
+
+    async def _astore(self, key, record):
+        await sync_to_async(self._store)(key, record)
+
+    async def set_state(self, chat_id, user_id, state,
+                        business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = await self._load(key) or {"data": {}}
+        await self._astore(key, {**record, "state": _state_name(state)})
+        return True
+
+    async def get_state(self, chat_id, user_id,
+                        business_connection_id=None, message_thread_id=None, bot_id=None):
+        record = await self._load(self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        return record["state"] if record else None
+
+    async def delete_state(self, chat_id, user_id,
+                           business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        if await self._load(key) is None:
+            return False
+        await self._astore(key, None)
+        return True
+
+    async def set_data(self, chat_id, user_id, key, value,
+                       business_connection_id=None, message_thread_id=None, bot_id=None):
+        _key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = await self._load(_key)
+        if record is None:
+            raise RuntimeError(f"AsyncDjangoStateStorage: key {_key} does not exist.")
+        await self._astore(_key, {**record, "data": {**record["data"], key: value}})
+        return True
+
+    async def get_data(self, chat_id, user_id,
+                       business_connection_id=None, message_thread_id=None, bot_id=None):
+        record = await self._load(self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id))
+        return copy.deepcopy(record["data"]) if record else {}
+
+    async def reset_data(self, chat_id, user_id,
+                         business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = await self._load(key)
+        if record is None:
+            return False
+        await self._astore(key, {**record, "data": {}})
+        return True
+
+    def get_interactive_data(self, chat_id, user_id,
+                             business_connection_id=None, message_thread_id=None, bot_id=None):
+        return AsyncStateDataContext(
+            self, chat_id=chat_id, user_id=user_id, business_connection_id=business_connection_id,
+            message_thread_id=message_thread_id, bot_id=bot_id,
+        )
+
+    async def save(self, chat_id, user_id, data,
+                   business_connection_id=None, message_thread_id=None, bot_id=None):
+        key = self._make_key(chat_id, user_id, business_connection_id, message_thread_id, bot_id)
+        record = await self._load(key)
+        if record is None:
+            return False
+        await self._astore(key, {**record, "data": data})
+        return True
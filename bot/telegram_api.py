@@ -0,0 +1,80 @@
+import logging
+import os
+import threading
+
+import requests
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
+
+API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+TIMEOUT = float(os.environ.get('TELEGRAM_API_TIMEOUT', 10))
+
+# Пулы соединений для WSGI-режима, по одному на токен: соединения с Telegram
+# переиспользуются между запросами, а не открываются заново на каждый вызов,
+# и боты разных школ (bot/multibot.py) не делят соединения друг с другом
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+# Асинхронные клиенты (тоже по одному на токен) живут столько же, сколько цикл
+# событий ASGI-сервера (см. asgi_webhooks.py). Пока open_async_client() не
+# вызван, запросы идут через _sessions.
+_async_clients = None
+_max_connections = 100
+
+
+async def call_api(token, method, payload):
+    """Вызов метода Bot API, возвращает разобранный JSON-ответ"""
+    url = f"{API_URL}/bot{token}/{method}"
+    if _async_clients is not None:
+        response = await _async_client(token).post(url, json=payload)
+    else:
+        response = await _post_in_thread(_session(token), url, payload)
+    return response.json()
+
+
+def _session(token):
+    session = _sessions.get(token)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.setdefault(token, requests.Session())
+    return session
+
+
+def _async_client(token):
+    import httpx
+
+    client = _async_clients.get(token)
+    if client is None:
+        client = _async_clients[token] = httpx.AsyncClient(
+            timeout=TIMEOUT,
+            limits=httpx.Limits(max_connections=_max_connections, max_keepalive_connections=20),
+        )
+        logger.info(f"Открыт HTTP-клиент для бота {token.split(':', 1)[0]}")
+    return client
+
+
+# thread_sensitive=False: HTTP-запросы не должны занимать поток, в котором
+# sync_to_async выполняет запросы к БД
+@sync_to_async(thread_sensitive=False)
+def _post_in_thread(session, url, payload):
+    return session.post(url, json=payload, timeout=TIMEOUT)
+
+
+async def open_async_client(max_connections=100):
+    """Переводит вызовы на httpx; клиент каждого токена создается при первом запросе"""
+    global _async_clients, _max_connections
+
+    if _async_clients is None:
+        _async_clients = {}
+        _max_connections = max_connections
+
+
+async def close_async_client():
+    global _async_clients
+
+    if _async_clients is not None:
+        clients, _async_clients = _async_clients, None
+        for client in clients.values():
+            await client.aclose()
+        logger.info(f"HTTP-клиенты для Telegram API закрыты: {len(clients)}")
@@ -1,19 +1,23 @@
 import logging
 import os
 import django
-import hashlib
+import re
+import secrets
 from dotenv import load_dotenv
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import (
     Application,
+    ApplicationHandlerStop,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ContextTypes,
     ConversationHandler,
     filters,
+    PersistenceInput,
 )
-from asgiref.sync import sync_to_async
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -23,6 +27,31 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
 django.setup()
 
 from bot.models import Child, KindDeed, Reward, Parent
+from bot.keyboards import (
+    BACK_TO_MENU_KEYBOARD,
+    CHART_KEYBOARD,
+    CHILD_ACTIONS_KEYBOARD,
+    CHILD_MENU_KEYBOARD,
+    DEED_ADDED_KEYBOARD,
+    FALLBACK_REWARDS_TEXT,
+    LOGIN_CHOICE_KEYBOARD,
+    MAIN_MENU_KEYBOARD,
+    PARENT_MENU_KEYBOARD,
+    PARENT_MENU_NO_CHILDREN_KEYBOARD,
+    PARENT_MENU_WITH_CHILDREN_KEYBOARD,
+    PARENT_SESSION_EXPIRED_TEXT,
+    POINTS_KEYBOARD,
+    ptb_markup,
+)
+from bot.charts import PERIODS, charts_available, points_chart, remember_file_id
+from bot.db_router import read_replica
+from bot.children import afind_child_by_name, remember_parent_children
+from bot.ledger import InsufficientPoints, aadd_points, aredeem_reward
+from bot.passwords import ahash_password, averify_parent_password, mark_verified, recently_verified
+from bot.progress import atake_progress, format_progress
+from bot.persistence import DjangoPersistence
+from bot.sessions import aget_parent_session, aparent_session_expired, invalidate_parent_session
+from bot.update_processor import PerChatUpdateProcessor
 
 # Состояния для ConversationHandler
 CHOOSING_ACTION, ADDING_DEED, ADDING_POINTS = range(3)
@@ -36,99 +65,126 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Функции для работы с БД в асинхронном режиме
-@sync_to_async
-def get_or_create_child(telegram_id, name):
-    return Child.objects.get_or_create(
+# Функции для работы с БД через нативный асинхронный ORM Django (aget, acreate, async for)
+async def get_or_create_child(telegram_id, name):
+    return await Child.objects.aget_or_create(
         telegram_id=telegram_id,
         defaults={"name": name}
     )
 
-@sync_to_async
-def get_child(telegram_id):
-    return Child.objects.get(telegram_id=telegram_id)
+async def get_child(telegram_id):
+    return await Child.objects.aget(telegram_id=telegram_id)
+
+async def get_child_points(telegram_id):
+    return await Child.objects.filter(telegram_id=telegram_id).values_list('total_points', flat=True).afirst()
+
+async def get_child_parent_ids(child_id):
+    return [parent_id async for parent_id in Parent.objects.filter(children=child_id).values_list('telegram_id', flat=True)]
 
-@sync_to_async
-def get_recent_deeds(child, limit=5):
-    return list(child.deeds.order_by('-created_at')[:limit])
+async def get_recent_deeds(child, limit=5):
+    with read_replica(child.pk):
+        return [deed async for deed in child.deeds.order_by('-created_at')[:limit]]
 
-@sync_to_async
-def get_rewards():
-    return list(Reward.objects.all().order_by('points_required'))
+async def get_recent_deeds_for_children(children, limit=3):
+    """Последние дела сразу для нескольких детей одним запросом (вместо запроса на каждого)"""
+    recent = {child.telegram_id: [] for child in children}
+    deeds = (
+        KindDeed.objects
+        .filter(child_id__in=recent.keys())
+        .annotate(row_number=Window(
+            RowNumber(),
+            partition_by=F('child_id'),
+            order_by=F('created_at').desc(),
+        ))
+        .filter(row_number__lte=limit)
+        .order_by('child_id', 'row_number')
+    )
+    with read_replica(*recent):
+        async for deed in deeds:
+            recent[deed.child_id].append(deed)
+    return recent
+
+async def get_rewards():
+    with read_replica():
+        return [reward async for reward in Reward.objects.order_by('points_required')]
 
-@sync_to_async
-def create_deed(child, description, points, parent=None):
-    return KindDeed.objects.create(
+async def create_deed(child, description, points, parent=None):
+    return await KindDeed.objects.acreate(
         child=child,
         description=description,
         points=points,
         added_by=parent
     )
 
-@sync_to_async
-def update_child_points(child, points):
-    child.total_points += points
-    child.save()
-    return child.total_points
+async def update_child_points(child, points):
+    return await aadd_points(child, points)
 
-@sync_to_async
-def get_or_create_parent(telegram_id, name):
-    return Parent.objects.get_or_create(
+async def get_or_create_parent(telegram_id, name):
+    return await Parent.objects.aget_or_create(
         telegram_id=telegram_id,
         defaults={"name": name}
     )
 
-@sync_to_async
-def get_parent(telegram_id):
-    return Parent.objects.get(telegram_id=telegram_id)
+async def get_parent(telegram_id):
+    return await Parent.objects.aget(telegram_id=telegram_id)
 
-@sync_to_async
-def set_parent_password(parent, password):
-    # Простое хеширование пароля (в реальном проекте нужно использовать более надежные методы)
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    parent.password = hashed_password
-    parent.save()
+async def set_parent_password(parent, password):
+    # PBKDF2 считается в отдельном пуле bot/passwords.py
+    parent.password = await ahash_password(password)
+    await parent.asave(update_fields=["password"])
+    mark_verified(parent)
     return parent
 
-@sync_to_async
-def verify_parent_password(parent, password):
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    return parent.password == hashed_password
+async def verify_parent_password(parent, password):
+    return await averify_parent_password(parent, password)
+
+async def get_parent_children(parent):
+    children = [child async for child in parent.children.all()]
+    remember_parent_children(parent.pk, children)
+    return children
 
-@sync_to_async
-def get_parent_children(parent):
-    return list(parent.children.all())
+async def get_children_by_ids(child_ids):
+    with read_replica(*child_ids):
+        return [child async for child in Child.objects.filter(telegram_id__in=child_ids).order_by('pk')]
 
-@sync_to_async
-def add_child_to_parent(parent, child):
-    parent.children.add(child)
+async def add_child_to_parent(parent, child):
+    # Сессию родителя сбросит сигнал m2m_changed (bot/sessions.py)
+    await parent.children.aadd(child)
     return True
 
-@sync_to_async
-def get_child_by_name(name):
-    try:
-        return Child.objects.get(name=name)
-    except Child.DoesNotExist:
-        return None
-    except Child.MultipleObjectsReturned:
-        # Если несколько детей с одинаковым именем, берём первого
-        return Child.objects.filter(name=name).first()
-    
-@sync_to_async
-def get_all_children():
-    return list(Child.objects.all())
+async def get_child_by_name(name, parent=None):
+    # Без учета регистра и ё/е; при совпадении имен дети родителя идут первыми
+    return await afind_child_by_name(name, parent)
+
+async def get_all_children():
+    return [child async for child in Child.objects.all()]
 
-@sync_to_async
-def is_parent_of_child(parent, child):
-    return parent.children.filter(telegram_id=child.telegram_id).exists()
+async def is_parent_of_child(parent, child):
+    return await parent.children.filter(telegram_id=child.telegram_id).aexists()
 
-@sync_to_async
-def verify_parent(telegram_id):
+async def verify_parent(telegram_id):
     try:
-        return Parent.objects.get(telegram_id=telegram_id), True
+        return await Parent.objects.aget(telegram_id=telegram_id), True
     except Parent.DoesNotExist:
         return None, False
 
+# --- Подтверждение нажатий кнопок ---
+
+# Метрики answerCallbackQuery
+callback_answer_stats = {"answered": 0, "failed": 0}
+
+def answer_in_background(query, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Подтверждает нажатие кнопки параллельно с обработчиком, не дожидаясь ответа Telegram"""
+    context.application.create_task(answer_callback(query))
+
+async def answer_callback(query) -> None:
+    try:
+        await query.answer()
+        callback_answer_stats["answered"] += 1
+    except Exception as e:
+        callback_answer_stats["failed"] += 1
+        logger.warning(f"Не удалось подтвердить нажатие кнопки: {e}")
+
 # --- Функции для работы с ботом в группе ---
 
 async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -170,7 +226,7 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
                 return
             
             # Находим ребенка по имени
-            child = await get_child_by_name(child_name)
+            child = await get_child_by_name(child_name, parent)
             
             if not child:
                 await update.message.reply_text(
@@ -266,10 +322,7 @@ async def group_message_handler(update: Update, context: ContextTypes.DEFAULT_TY
             
             if not rewards:
                 text = "Пока в базе нет доступных наград. Но дети могут копить на:\n\n"
-                text += f"• *Обычная игрушка*: 1000 баллов\n"
-                text += f"• *Приставка на выходные*: 3000 баллов\n"
-                text += f"• *Крутая игрушка*: 5000 баллов\n"
-                text += f"• *Nintendo Switch*: 35000 баллов\n"
+                text += FALLBACK_REWARDS_TEXT
             else:
                 text = "🎁 *Доступные награды:*\n\n"
                 for reward in rewards:
@@ -323,11 +376,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         parent = await get_parent(telegram_id)
         # Если пользователь - родитель, предлагаем меню родителя
-        keyboard = [
-            [InlineKeyboardButton("👨‍👧‍👦 Войти как родитель", callback_data="parent_login")],
-            [InlineKeyboardButton("👶 Войти как ребенок", callback_data="child_login")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = ptb_markup(LOGIN_CHOICE_KEYBOARD)
         
         await update.message.reply_text(
             f"Привет, {user.first_name}! Вы зарегистрированы как родитель.\n\n"
@@ -343,14 +392,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     try:
         child, created = await get_or_create_child(telegram_id, user.first_name)
         
-        keyboard = [
-            [InlineKeyboardButton("📝 Добавить доброе дело", callback_data="add_deed")],
-            [InlineKeyboardButton("🌟 Мои баллы", callback_data="check_points")],
-            [InlineKeyboardButton("🎁 Посмотреть награды", callback_data="view_rewards")],
-            [InlineKeyboardButton("❓ Помощь", callback_data="help")],
-            [InlineKeyboardButton("👨‍👩‍👧‍👦 Я родитель", callback_data="register_parent")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = ptb_markup(MAIN_MENU_KEYBOARD)
         
         await update.message.reply_text(
             f"Привет, {child.name}! 👋 Это бот для записи твоих добрых дел.\n\n"
@@ -375,6 +417,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "/start - Запустить бота и показать главное меню\n"
         "/add - Добавить новое доброе дело\n"
         "/points - Посмотреть мои баллы\n"
+        "/chart - График баллов (/chart week - по неделям)\n"
         "/rewards - Посмотреть список доступных наград\n"
         "/parent - Режим родителя\n"
         "/help - Показать эту справку\n\n"
@@ -411,27 +454,76 @@ async def check_points_command(update: Update, context: ContextTypes.DEFAULT_TYP
         recent_deeds = await get_recent_deeds(child)
         
         text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+        text += format_progress(*await atake_progress(child.pk))
         if recent_deeds:
             text += "📋 *Твои последние добрые дела:*\n"
             for deed in recent_deeds:
                 date_str = deed.created_at.strftime("%d.%m.%Y")
                 text += f"• {deed.description}: *{deed.points} баллов* ({date_str})\n"
         
-        await update.message.reply_text(text, parse_mode='Markdown')
+        await update.message.reply_text(text, reply_markup=ptb_markup(CHART_KEYBOARD), parse_mode='Markdown')
     except Exception as e:
         logger.error(f"Ошибка при получении баллов: {e}")
         await update.message.reply_text("Произошла ошибка. Начни заново: /start")
 
+async def send_points_chart(context: ContextTypes.DEFAULT_TYPE, chat_id, telegram_id, period) -> None:
+    """Отправляет график баллов ребенка; повторный запрос без новых дел берется из кэша"""
+    if not charts_available():
+        await context.bot.send_message(chat_id, "Графики сейчас недоступны.")
+        return
+    try:
+        child = await get_child(telegram_id)
+    except Child.DoesNotExist:
+        await context.bot.send_message(chat_id, "Сначала запусти бота: /start")
+        return
+    key, photo = await points_chart(child.telegram_id, child.name, period)
+    if key is None:
+        await context.bot.send_message(chat_id, "Пока нет добрых дел - график строить не из чего.")
+        return
+    message = await context.bot.send_photo(chat_id, photo=photo, caption=f"📈 Баллы {PERIODS[period]}")
+    remember_file_id(key, message.photo[-1].file_id)
+
+async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /chart [day|week]"""
+    period = context.args[0].lower() if context.args else 'day'
+    if period not in PERIODS:
+        await update.message.reply_text("Используй /chart day или /chart week")
+        return
+    try:
+        await send_points_chart(context, update.effective_chat.id, update.effective_user.id, period)
+    except Exception as e:
+        logger.error(f"Ошибка при построении графика: {e}")
+        await update.message.reply_text("Не удалось построить график. Попробуй позже.")
+
+async def chart_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Кнопки графика; обрабатываются до диалога, чтобы не сбивать его состояние"""
+    query = update.callback_query
+    answer_in_background(query, context)
+    period = query.data.removeprefix("chart_")
+    if period in PERIODS:
+        try:
+            await send_points_chart(context, query.message.chat.id, update.effective_user.id, period)
+        except Exception as e:
+            logger.error(f"Ошибка при построении графика: {e}")
+            await context.bot.send_message(query.message.chat.id, "Не удалось построить график. Попробуй позже.")
+    raise ApplicationHandlerStop
+
+def redeem_buttons(rewards, total_points):
+    """Кнопки обмена для наград, на которые ребенку хватает баллов"""
+    return [
+        [InlineKeyboardButton(f"🎁 Получить: {reward.name}", callback_data=f"redeem_{reward.pk}")]
+        for reward in rewards
+        if total_points is not None and reward.points_required <= total_points
+    ]
+
 async def view_rewards_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Команда для просмотра наград"""
     rewards = await get_rewards()
+    buttons = redeem_buttons(rewards, await get_child_points(update.effective_user.id))
     
     if not rewards:
         text = "Пока нет доступных наград. Попроси взрослых добавить их.\n\n"
-        text += f"• *Обычная игрушка*: 1000 баллов\n"
-        text += f"• *Приставка на выходные*: 3000 баллов\n"
-        text += f"• *Крутая игрушка*: 5000 баллов\n"
-        text += f"• *Nintendo Switch*: 35000 баллов\n"
+        text += FALLBACK_REWARDS_TEXT
     else:
         text = "🎁 *Доступные награды:*\n\n"
         for reward in rewards:
@@ -440,7 +532,69 @@ async def view_rewards_command(update: Update, context: ContextTypes.DEFAULT_TYP
                 text += f" - {reward.description}"
             text += "\n"
     
-    await update.message.reply_text(text, parse_mode='Markdown')
+    reply_markup = InlineKeyboardMarkup(buttons) if buttons else None
+    await update.message.reply_text(text, reply_markup=reply_markup, parse_mode='Markdown')
+
+async def redeem_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обмен баллов на награду: выбор награды, подтверждение, списание"""
+    query = update.callback_query
+    answer_in_background(query, context)
+    action = query.data.removeprefix("redeem_")
+    back = ptb_markup(BACK_TO_MENU_KEYBOARD)
+    
+    if action == "cancel":
+        await query.edit_message_text("Обмен отменен.", reply_markup=back)
+        raise ApplicationHandlerStop
+    
+    confirmed = action.startswith("ok_")
+    try:
+        reward = await Reward.objects.aget(pk=int(action.removeprefix("ok_")))
+    except (ValueError, Reward.DoesNotExist):
+        await query.edit_message_text("Такой награды больше нет.", reply_markup=back)
+        raise ApplicationHandlerStop
+    
+    if not confirmed:
+        keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("✅ Да, обменять", callback_data=f"redeem_ok_{reward.pk}")],
+            [InlineKeyboardButton("❌ Отмена", callback_data="redeem_cancel")],
+        ])
+        await query.edit_message_text(
+            f"Обменять *{reward.points_required} баллов* на награду *{reward.name}*?",
+            reply_markup=keyboard,
+            parse_mode='Markdown'
+        )
+        raise ApplicationHandlerStop
+    
+    child_id = update.effective_user.id
+    try:
+        entry = await aredeem_reward(child_id, reward.pk)
+    except InsufficientPoints as e:
+        await query.edit_message_text(
+            f"Пока не хватает баллов: нужно {e.required}, у тебя {e.balance}.", reply_markup=back
+        )
+        raise ApplicationHandlerStop
+    except Exception as e:
+        logger.error(f"Ошибка при обмене баллов: {e}")
+        await query.edit_message_text("Произошла ошибка. Попробуй позже.", reply_markup=back)
+        raise ApplicationHandlerStop
+    
+    await query.edit_message_text(
+        f"🎉 Награда *{reward.name}* твоя!\n"
+        f"Осталось *{entry.balance} баллов*. Покажи это сообщение родителям.",
+        reply_markup=back,
+        parse_mode='Markdown'
+    )
+    child = await get_child(child_id)
+    for parent_id in await get_child_parent_ids(child_id):
+        try:
+            await context.bot.send_message(
+                parent_id,
+                f"🎁 {child.name} обменял(а) {reward.points_required} баллов "
+                f"на награду «{reward.name}»."
+            )
+        except Exception as e:
+            logger.warning(f"Не удалось уведомить родителя {parent_id} об обмене: {e}")
+    raise ApplicationHandlerStop
 
 async def process_deed(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка описания доброго дела"""
@@ -480,11 +634,7 @@ async def process_points(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Очищаем данные
         context.user_data.clear()
         
-        keyboard = [
-            [InlineKeyboardButton("📝 Добавить еще доброе дело", callback_data="add_deed")],
-            [InlineKeyboardButton("🏠 Вернуться в меню", callback_data="back_to_menu")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = ptb_markup(DEED_ADDED_KEYBOARD)
         
         await update.message.reply_text(
             f"🎉 Отлично! Доброе дело '{deed.description}' добавлено.\n\n"
@@ -518,6 +668,16 @@ async def parent_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Проверяем, зарегистрирован ли пользователь как родитель
     try:
         parent = await get_parent(telegram_id)
+        if recently_verified(parent):
+            # Пароль вводили недавно: сразу открываем меню, без повторного хеширования
+            children = (await aget_parent_session(parent.pk)).children
+            await update.message.reply_text(
+                f"👋 Здравствуйте, {parent.name}! Вы в режиме родителя.\n\n"
+                f"У вас {len(children)} {'детей' if len(children) != 1 else 'ребенок'} в системе.\n\n"
+                "Выберите действие:",
+                reply_markup=ptb_markup(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
+            )
+            return PARENT_MENU
         # Запрашиваем пароль
         await update.message.reply_text(
             f"Здравствуйте, {parent.name}! Для доступа к режиму родителя, пожалуйста, введите пароль:"
@@ -535,7 +695,7 @@ async def parent_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 async def handle_parent_auth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка выбора режима входа"""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query, context)
     
     if query.data == "parent_login":
         await query.edit_message_text(
@@ -552,14 +712,7 @@ async def handle_parent_auth(update: Update, context: ContextTypes.DEFAULT_TYPE)
             # Проверяем, есть ли у этого телеграм ID зарегистрированный ребенок
             child = await get_child(telegram_id)
             
-            keyboard = [
-                [InlineKeyboardButton("📝 Добавить доброе дело", callback_data="add_deed")],
-                [InlineKeyboardButton("🌟 Мои баллы", callback_data="check_points")],
-                [InlineKeyboardButton("🎁 Посмотреть награды", callback_data="view_rewards")],
-                [InlineKeyboardButton("❓ Помощь", callback_data="help")],
-                [InlineKeyboardButton("👨‍👩‍👧‍👦 Я родитель", callback_data="register_parent")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ptb_markup(MAIN_MENU_KEYBOARD)
             
             await query.edit_message_text(
                 f"Привет, {child.name}! 👋 Это бот для записи твоих добрых дел.\n\n"
@@ -574,13 +727,7 @@ async def handle_parent_auth(update: Update, context: ContextTypes.DEFAULT_TYPE)
             # Если ребенок не зарегистрирован, создаем его
             child, created = await get_or_create_child(telegram_id, user.first_name)
             
-            keyboard = [
-                [InlineKeyboardButton("📝 Добавить доброе дело", callback_data="add_deed")],
-                [InlineKeyboardButton("🌟 Мои баллы", callback_data="check_points")],
-                [InlineKeyboardButton("🎁 Посмотреть награды", callback_data="view_rewards")],
-                [InlineKeyboardButton("❓ Помощь", callback_data="help")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ptb_markup(CHILD_MENU_KEYBOARD)
             
             await query.edit_message_text(
                 f"Привет, {child.name}! 👋 Это бот для записи твоих добрых дел.\n\n"
@@ -608,12 +755,7 @@ async def handle_parent_password(update: Update, context: ContextTypes.DEFAULT_T
         # Очищаем флаг регистрации
         context.user_data.pop("registering_parent", None)
         
-        keyboard = [
-            [InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child")],
-            [InlineKeyboardButton("📊 Просмотр статистики детей", callback_data="view_children")],
-            [InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode")],
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = ptb_markup(PARENT_MENU_KEYBOARD)
         
         await update.message.reply_text(
             f"🎉 Поздравляем! Вы зарегистрированы как родитель.\n\n"
@@ -628,18 +770,11 @@ async def handle_parent_password(update: Update, context: ContextTypes.DEFAULT_T
         is_valid = await verify_parent_password(parent, password)
         
         if is_valid:
-            # Пароль верный, показываем меню родителя
-            children = await get_parent_children(parent)
+            # Пароль верный: сессия родителя перечитывается, дальше меню работает по ней
+            invalidate_parent_session(parent.pk)
+            children = (await aget_parent_session(parent.pk)).children
             
-            keyboard = []
-            if children:
-                keyboard.append([InlineKeyboardButton("➕ Добавить доброе дело ребенку", callback_data="add_deed_to_child")])
-                keyboard.append([InlineKeyboardButton("📊 Просмотр статистики детей", callback_data="view_children")])
-            
-            keyboard.append([InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child")])
-            keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode")])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ptb_markup(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
             
             await update.message.reply_text(
                 f"👋 Здравствуйте, {parent.name}! Вы вошли в режим родителя.\n\n"
@@ -665,11 +800,16 @@ async def handle_parent_password(update: Update, context: ContextTypes.DEFAULT_T
 async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработка меню родителя"""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query, context)
     
     user = update.effective_user
     telegram_id = user.id
     
+    # Меню родителя работает, только пока пароль вводили недавно
+    if query.data != "exit_parent_mode" and await aparent_session_expired(telegram_id):
+        await query.edit_message_text(PARENT_SESSION_EXPIRED_TEXT)
+        return ConversationHandler.END
+    
     if query.data == "add_child":
         # Переходим к добавлению ребенка
         await query.edit_message_text(
@@ -680,15 +820,10 @@ async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif query.data == "view_children":
         # Показываем статистику детей
         try:
-            parent = await get_parent(telegram_id)
-            children = await get_parent_children(parent)
+            session = await aget_parent_session(telegram_id)
             
-            if not children:
-                keyboard = [
-                    [InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child")],
-                    [InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode")],
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            if not session.children:
+                reply_markup = ptb_markup(PARENT_MENU_NO_CHILDREN_KEYBOARD)
                 
                 await query.edit_message_text(
                     "У вас пока нет добавленных детей. Добавьте ребенка, чтобы видеть его статистику.",
@@ -697,8 +832,11 @@ async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 return PARENT_MENU
             
             text = "📊 *Статистика ваших детей:*\n\n"
+            # Баллы и дела меняются часто, поэтому их читаем из БД, а не из сессии
+            children = await get_children_by_ids(session.child_ids)
+            recent_by_child = await get_recent_deeds_for_children(children, limit=3)
             for child in children:
-                recent_deeds = await get_recent_deeds(child, limit=3)
+                recent_deeds = recent_by_child[child.telegram_id]
                 
                 text += f"👶 *{child.name}*: {child.total_points} баллов\n"
                 if recent_deeds:
@@ -708,11 +846,7 @@ async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
                         text += f"• {deed.description}: {deed.points} баллов ({date_str})\n"
                 text += "\n"
             
-            keyboard = [
-                [InlineKeyboardButton("➕ Добавить доброе дело", callback_data="add_deed_to_child")],
-                [InlineKeyboardButton("◀️ Назад", callback_data="back_to_parent_menu")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ptb_markup(CHILD_ACTIONS_KEYBOARD)
             
             await query.edit_message_text(
                 text,
@@ -731,15 +865,10 @@ async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif query.data == "add_deed_to_child":
         # Выбираем ребенка для добавления доброго дела
         try:
-            parent = await get_parent(telegram_id)
-            children = await get_parent_children(parent)
+            session = await aget_parent_session(telegram_id)
             
-            if not children:
-                keyboard = [
-                    [InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child")],
-                    [InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode")],
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
+            if not session.children:
+                reply_markup = ptb_markup(PARENT_MENU_NO_CHILDREN_KEYBOARD)
                 
                 await query.edit_message_text(
                     "У вас пока нет добавленных детей. Добавьте ребенка, чтобы добавлять ему добрые дела.",
@@ -749,8 +878,8 @@ async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
             
             # Создаем кнопки для выбора ребенка
             keyboard = []
-            for child in children:
-                keyboard.append([InlineKeyboardButton(f"👶 {child.name}", callback_data=f"select_child_{child.telegram_id}")])
+            for child_id, child_name in session.children:
+                keyboard.append([InlineKeyboardButton(f"👶 {child_name}", callback_data=f"select_child_{child_id}")])
             
             keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data="back_to_parent_menu")])
             reply_markup = InlineKeyboardMarkup(keyboard)
@@ -771,21 +900,13 @@ async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif query.data == "back_to_parent_menu":
         # Возвращаемся в основное меню родителя
         try:
-            parent = await get_parent(telegram_id)
-            children = await get_parent_children(parent)
-            
-            keyboard = []
-            if children:
-                keyboard.append([InlineKeyboardButton("➕ Добавить доброе дело ребенку", callback_data="add_deed_to_child")])
-                keyboard.append([InlineKeyboardButton("📊 Просмотр статистики детей", callback_data="view_children")])
-            
-            keyboard.append([InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child")])
-            keyboard.append([InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode")])
+            session = await aget_parent_session(telegram_id)
+            children = session.children
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ptb_markup(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
             
             await query.edit_message_text(
-                f"👋 Здравствуйте, {parent.name}! Вы в режиме родителя.\n\n"
+                f"👋 Здравствуйте, {session.name}! Вы в режиме родителя.\n\n"
                 f"У вас {len(children)} {'детей' if len(children) != 1 else 'ребенок'} в системе.\n\n"
                 "Выберите действие:",
                 reply_markup=reply_markup
@@ -810,13 +931,16 @@ async def handle_parent_menu(update: Update, context: ContextTypes.DEFAULT_TYPE)
     elif query.data.startswith("select_child_"):
         try:
             child_telegram_id = int(query.data.split("_")[-1])
-            child = await get_child(child_telegram_id)
+            session = await aget_parent_session(telegram_id)
+            child_name = session.child_name(child_telegram_id)
+            if child_name is None:
+                raise ValueError(f"ребенок {child_telegram_id} не привязан к родителю {telegram_id}")
             
             # Сохраняем ID выбранного ребенка в контексте
             context.user_data["selected_child_id"] = child_telegram_id
             
             await query.edit_message_text(
-                f"Вы выбрали ребенка: *{child.name}*\n\n"
+                f"Вы выбрали ребенка: *{child_name}*\n\n"
                 "Опишите доброе дело, которое совершил ребенок:",
                 parse_mode='Markdown'
             )
@@ -843,7 +967,7 @@ async def handle_adding_child(update: Update, context: ContextTypes.DEFAULT_TYPE
         parent = await get_parent(telegram_id)
         
         # Проверяем, существует ли ребенок с таким именем
-        child = await get_child_by_name(child_name)
+        child = await get_child_by_name(child_name, parent)
         
         if child:
             # Если ребенок найден, привязываем его к родителю
@@ -951,7 +1075,7 @@ async def handle_parent_deed_points(update: Update, context: ContextTypes.DEFAUL
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Обработчик нажатий на кнопки"""
     query = update.callback_query
-    await query.answer()
+    answer_in_background(query, context)
     
     if query.data == "add_deed":
         await query.edit_message_text("📝 Опиши свое доброе дело:")
@@ -964,14 +1088,14 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             recent_deeds = await get_recent_deeds(child)
             
             text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+            text += format_progress(*await atake_progress(child.pk))
             if recent_deeds:
                 text += "📋 *Твои последние добрые дела:*\n"
                 for deed in recent_deeds:
                     date_str = deed.created_at.strftime("%d.%m.%Y")
                     text += f"• {deed.description}: *{deed.points} баллов* ({date_str})\n"
             
-            keyboard = [[InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu")]]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ptb_markup(POINTS_KEYBOARD)
             
             await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
         except Exception as e:
@@ -985,10 +1109,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         
         if not rewards:
             text = "Пока в базе нет доступных наград. Но ты можешь копить на:\n\n"
-            text += f"• *Обычная игрушка*: 1000 баллов\n"
-            text += f"• *Приставка на выходные*: 3000 баллов\n"
-            text += f"• *Крутая игрушка*: 5000 баллов\n"
-            text += f"• *Nintendo Switch*: 35000 баллов\n"
+            text += FALLBACK_REWARDS_TEXT
         else:
             text = "🎁 *Доступные награды:*\n\n"
             for reward in rewards:
@@ -997,8 +1118,8 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                     text += f" - {reward.description}"
                 text += "\n"
         
-        keyboard = [[InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        buttons = redeem_buttons(rewards, await get_child_points(update.effective_user.id))
+        reply_markup = InlineKeyboardMarkup(buttons + [list(row) for row in ptb_markup(BACK_TO_MENU_KEYBOARD).inline_keyboard])
         
         await query.edit_message_text(text, reply_markup=reply_markup, parse_mode='Markdown')
         return CHOOSING_ACTION
@@ -1021,8 +1142,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             "/help - Показать эту справку\n"
         )
         
-        keyboard = [[InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = ptb_markup(BACK_TO_MENU_KEYBOARD)
         
         await query.edit_message_text(help_text, reply_markup=reply_markup, parse_mode='Markdown')
         return CHOOSING_ACTION
@@ -1044,14 +1164,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         try:
             child = await get_child(telegram_id)
             
-            keyboard = [
-                [InlineKeyboardButton("📝 Добавить доброе дело", callback_data="add_deed")],
-                [InlineKeyboardButton("🌟 Мои баллы", callback_data="check_points")],
-                [InlineKeyboardButton("🎁 Посмотреть награды", callback_data="view_rewards")],
-                [InlineKeyboardButton("❓ Помощь", callback_data="help")],
-                [InlineKeyboardButton("👨‍👩‍👧‍👦 Я родитель", callback_data="register_parent")],
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            reply_markup = ptb_markup(MAIN_MENU_KEYBOARD)
             
             await query.edit_message_text(
                 f"Привет, {child.name}! 👋 Это бот для записи твоих добрых дел.\n\n"
@@ -1080,14 +1193,24 @@ async def setup_commands(application: Application) -> None:
         BotCommand("start", "Запустить бота и показать главное меню"),
         BotCommand("add", "Добавить новое доброе дело"),
         BotCommand("points", "Посмотреть мои баллы"),
+        BotCommand("chart", "График моих баллов"),
         BotCommand("rewards", "Посмотреть список доступных наград"),
         BotCommand("parent", "Режим родителя"),
         BotCommand("help", "Показать справку по использованию бота"),
     ]
     await application.bot.set_my_commands(commands)
 
-def main(token=None) -> None:
-    """Запуск бота"""
+async def log_drained(application: Application) -> None:
+    """Вызывается после остановки: все принятые обновления к этому моменту обработаны"""
+    logger.info(
+        "Бот остановлен, очередь обновлений обработана. "
+        f"Нажатий кнопок подтверждено: {callback_answer_stats['answered']}, "
+        f"с ошибкой: {callback_answer_stats['failed']}"
+    )
+
+def main(token=None, webhook=False, listen="0.0.0.0", port=8443, webhook_url=None,
+         url_path="telegram", secret_token=None, max_connections=40, concurrency=None) -> None:
+    """Запуск бота (long-polling или webhook)"""
     # Получаем токен из параметра или из переменных окружения
     if not token:
         token = os.environ.get("TELEGRAM_TOKEN")
@@ -1096,10 +1219,30 @@ def main(token=None) -> None:
         logger.error("Токен Telegram не найден в переменных окружения или параметрах.")
         return
     
-    application = Application.builder().token(token).build()
+    # Состояния диалогов и user_data переживают перезапуск; запись в БД пакетная
+    persistence = DjangoPersistence(
+        store_data=PersistenceInput(bot_data=False, chat_data=False, callback_data=False),
+        update_interval=float(os.environ.get("BOT_PERSISTENCE_UPDATE_INTERVAL", 5)),
+        flush_interval=float(os.environ.get("BOT_PERSISTENCE_FLUSH_INTERVAL", 30)),
+        max_pending=int(os.environ.get("BOT_PERSISTENCE_MAX_PENDING", 100)),
+    )
+    
+    builder = Application.builder().token(token).persistence(persistence)
+    
+    # По умолчанию PTB обрабатывает обновления строго по одному. При concurrency > 1
+    # разные чаты обрабатываются параллельно, а сообщения одного чата - по очереди
+    concurrency = concurrency or int(os.environ.get("BOT_CONCURRENCY", 1))
+    if concurrency > 1:
+        builder = builder.concurrent_updates(PerChatUpdateProcessor(
+            max_running=concurrency,
+            max_pending=int(os.environ.get("BOT_MAX_PENDING_UPDATES", concurrency * 16)),
+        ))
+    
+    application = builder.build()
     
     # Настройка команд в меню
     application.post_init = setup_commands
+    application.post_stop = log_drained
     
     # Настройка обработчика разговора
     conv_handler = ConversationHandler(
@@ -1139,13 +1282,18 @@ def main(token=None) -> None:
             ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
-        per_message=False
+        per_message=False,
+        name="main_conversation",
+        persistent=True,
     )
     
     # Добавление обработчиков команд
+    application.add_handler(CallbackQueryHandler(chart_button, pattern=r'^chart_'), group=-1)
+    application.add_handler(CallbackQueryHandler(redeem_button, pattern=r'^redeem_'), group=-1)
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("points", check_points_command))
+    application.add_handler(CommandHandler("chart", chart_command))
     application.add_handler(CommandHandler("rewards", view_rewards_command))
     # Добавляем обработчики для работы в группе
     application.add_handler(CommandHandler("grouphelp", group_help_command))
@@ -1156,10 +1304,36 @@ def main(token=None) -> None:
         group_message_handler
     ))
     
-    logger.info("Бот запущен!")
+    if not webhook:
+        logger.info("Бот запущен!")
+        
+        # Запуск бота
+        application.run_polling()
+        return
     
-    # Запуск бота
-    application.run_polling()
+    webhook_url = webhook_url or os.environ.get("TELEGRAM_WEBHOOK_URL")
+    if not webhook_url:
+        logger.error("Для режима webhook нужен адрес (--url или TELEGRAM_WEBHOOK_URL).")
+        return
+    
+    # Telegram присылает секрет в заголовке X-Telegram-Bot-Api-Secret-Token,
+    # запросы без него встроенный сервер PTB отклоняет с кодом 403
+    secret_token = secret_token or os.environ.get("TELEGRAM_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    
+    logger.info(f"Бот запущен в режиме webhook на {listen}:{port}/{url_path}")
+    
+    # При SIGINT/SIGTERM PTB сначала останавливает HTTP-сервер, затем дорабатывает
+    # уже принятые обновления и сохраняет состояние. Webhook при этом не удаляется,
+    # и Telegram доставит новые обновления следующему экземпляру.
+    application.run_webhook(
+        listen=listen,
+        port=port,
+        url_path=url_path,
+        webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+        secret_token=secret_token,
+        max_connections=max_connections,
+        allowed_updates=Update.ALL_TYPES,
+    )
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
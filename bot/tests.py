@@ -1,3 +1,831 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth.hashers import identify_hasher
+from django.db import connection, connections
+from telegram import Update
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from bot.archive import archive_deeds
+from bot.charts import _chart_version
+from bot.children import afind_child_by_name, find_child_by_name, remember_parent_children
+from bot.digest import DigestSender
+from bot import children, db_router, ledger, passwords, recording, sessions
+from bot.ledger import InsufficientPoints, add_points, correct_points, get_balance, redeem_reward
+from bot.models import (
+    Child, ChildProgress, DigestDelivery, DigestRun, KindDeed, Parent, PersistedData, PointsSnapshot,
+    PointsTransaction, Reward, normalize_name,
+)
+from bot.multibot import BotStateDict, RateLimiter, bot_api, parse_tokens, use_bot
+from bot.persistence import DjangoPersistence
+from bot.progress import earned_badges
+from bot.reconcile import expected_totals
+from bot.telebot_pool import ChatSerialExecutor
+from bot.telebot_storage import AsyncDjangoStateStorage, DjangoStateStorage, state_cache_ttl
+from bot.update_processor import PerChatUpdateProcessor
+
+
+class ProgressSignalsTests(TestCase):
+    def setUp(self):
+        self.child = Child.objects.create(telegram_id=1, name="Маша")
+
+    def add_deed(self, points=10, created_at=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            deed = KindDeed.objects.create(child=self.child, description="Помог", points=points)
+        if created_at:
+            KindDeed.objects.filter(pk=deed.pk).update(created_at=created_at)
+        return deed
+
+    def test_streak_counts_days_in_a_row(self):
+        today = timezone.localdate()
+        with mock.patch('bot.progress.timezone.localdate', side_effect=[today - datetime.timedelta(days=1), today]):
+            self.add_deed()
+            self.add_deed()
+        progress = ChildProgress.objects.get(child=self.child)
+        self.assertEqual(progress.current_streak, 2)
+        self.assertEqual(progress.last_deed_date, today)
+
+    def test_point_badges_after_save(self):
+        self.child.total_points = 150
+        with self.captureOnCommitCallbacks(execute=True):
+            self.child.save(update_fields=['total_points'])
+        progress = ChildProgress.objects.get(child=self.child)
+        self.assertEqual(progress.badges, earned_badges('points', 150))
+
+    def test_progress_error_does_not_break_deed(self):
+        with mock.patch('bot.progress._locked_progress', side_effect=RuntimeError("database is locked")):
+            with self.assertLogs('bot.progress', 'ERROR'):
+                self.add_deed()
+        self.assertEqual(KindDeed.objects.filter(child=self.child).count(), 1)
+
+
+class LedgerTests(TestCase):
+    def setUp(self):
+        self.child = Child.objects.create(telegram_id=1, name="Маша")
+
+    def test_balance_is_snapshot_plus_tail(self):
+        with mock.patch.object(ledger, 'SNAPSHOT_EVERY', 3):
+            for points in (1, 2, 3, 4, 5):
+                KindDeed.objects.create(child=self.child, description="Помог", points=points)
+        snapshot = PointsSnapshot.objects.get(child=self.child)
+        self.assertEqual(snapshot.balance, 6)
+        self.assertEqual(get_balance(self.child.pk), 15)
+        # Баланс не читает записи до снимка
+        PointsTransaction.objects.filter(pk__lte=snapshot.last_transaction_id).update(amount=0)
+        self.assertEqual(get_balance(self.child.pk), 15)
+
+    def test_entries_are_append_only(self):
+        entry = correct_points(self.child.pk, 5, "Подарок")
+        entry.amount = 50
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+    def test_redeem_reward_blocks_overspend(self):
+        reward = Reward.objects.create(name="Мороженое", points_required=60)
+        correct_points(self.child.pk, 100, "Начальный остаток")
+
+        entry = redeem_reward(self.child.pk, reward.pk)
+        self.assertEqual(entry.balance, 40)
+        with self.assertRaises(InsufficientPoints) as raised:
+            redeem_reward(self.child.pk, reward.pk)
+        self.assertEqual(raised.exception.balance, 40)
+        self.assertEqual(Child.objects.get(pk=1).total_points, 40)
+        self.assertEqual(PointsTransaction.objects.filter(kind=PointsTransaction.REDEMPTION).count(), 1)
+
+    def test_correct_points_changes_ledger_and_total(self):
+        correct_points(self.child.pk, 30, "Начальный остаток")
+        correct_points(self.child.pk, -10, "Ошибка в деле")
+        self.assertEqual(get_balance(self.child.pk), 20)
+        self.assertEqual(Child.objects.get(pk=1).total_points, 20)
+        self.assertEqual(list(expected_totals()), [])
+
+
+class OpeningBalanceMigrationTests(TransactionTestCase):
+    before = [('bot', '0008_childprogress')]
+    after = [('bot', '0009_points_ledger')]
+
+    def tearDown(self):
+        # Возвращаем схему к последней миграции для следующих тестов
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_opening_balance_from_total_points(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        old_apps = executor.loader.project_state(self.before).apps
+        OldChild = old_apps.get_model('bot', 'Child')
+        OldChild.objects.create(telegram_id=1, name="Маша", total_points=120)
+        OldChild.objects.create(telegram_id=2, name="Петя", total_points=0)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        new_apps = executor.loader.project_state(self.after).apps
+        entries = new_apps.get_model('bot', 'PointsTransaction').objects.values_list('child_id', 'kind', 'amount')
+        self.assertEqual(list(entries), [(1, 'opening', 120)])
+
+
+class AddPointsTests(TestCase):
+    def test_award_keeps_redemption_made_after_child_was_loaded(self):
+        Child.objects.create(telegram_id=1, name="Маша")
+        correct_points(1, 100, "Начальный остаток")
+        reward = Reward.objects.create(name="Мороженое", points_required=60)
+        child = Child.objects.get(pk=1)
+
+        redeem_reward(child.pk, reward.pk)
+        self.assertEqual(add_points(child, 10), 50)
+        self.assertEqual(Child.objects.get(pk=1).total_points, 50)
+
+    def test_award_gives_point_badges(self):
+        child = Child.objects.create(telegram_id=1, name="Маша", total_points=95)
+        with self.captureOnCommitCallbacks(execute=True):
+            add_points(child, 10)
+        self.assertEqual(ChildProgress.objects.get(child=child).badges, earned_badges('points', 105))
+
+
+class DeedCorrectionsTests(TestCase):
+    def setUp(self):
+        self.child = Child.objects.create(telegram_id=1, name="Маша")
+        self.deed = KindDeed.objects.create(child=self.child, description="Помог", points=10)
+        add_points(self.child, 10)
+
+    def test_changed_points_show_up_in_reconcile(self):
+        self.deed.points = 4
+        self.deed.save()
+        self.assertEqual(get_balance(self.child.pk), 4)
+        self.assertEqual(list(expected_totals()), [(1, 10, 4)])
+
+    def test_deleted_deed_is_corrected(self):
+        self.deed.delete()
+        self.assertEqual(get_balance(self.child.pk), 0)
+        self.assertEqual(PointsTransaction.objects.filter(kind=PointsTransaction.CORRECTION).count(), 1)
+
+    def test_archived_deeds_keep_points(self):
+        KindDeed.objects.filter(pk=self.deed.pk).update(created_at=timezone.now() - datetime.timedelta(days=400))
+        recent = KindDeed.objects.create(child=self.child, description="Убрал", points=5)
+        add_points(self.child, 5)
+        archive_deeds(older_than_days=365, keep_recent=1)
+        self.assertEqual(list(KindDeed.objects.all()), [recent])
+        self.assertEqual(get_balance(self.child.pk), 15)
+        self.assertEqual(list(expected_totals()), [])
+
+    def test_archive_without_keeping_recent(self):
+        KindDeed.objects.filter(pk=self.deed.pk).update(created_at=timezone.now() - datetime.timedelta(days=400))
+        self.assertEqual(archive_deeds(older_than_days=365, keep_recent=0)['deeds'], 1)
+        self.assertEqual(get_balance(self.child.pk), 10)
+
+    def test_child_can_be_deleted(self):
+        self.child.delete()
+        self.assertFalse(PointsTransaction.objects.exists())
+
+
+class ConcurrentDeedsTests(TransactionTestCase):
+    THREADS = 8
+    DEEDS_PER_THREAD = 30
+
+    def test_every_deed_gets_its_award(self):
+        child = Child.objects.create(telegram_id=1, name="Маша")
+        errors = []
+
+        def add_deeds():
+            try:
+                for _ in range(self.DEEDS_PER_THREAD):
+                    KindDeed.objects.create(child=child, description="Помог", points=1)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_deeds) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        total = self.THREADS * self.DEEDS_PER_THREAD
+        self.assertEqual(errors, [])
+        self.assertEqual(KindDeed.objects.count(), total)
+        self.assertEqual(PointsTransaction.objects.filter(kind=PointsTransaction.AWARD).count(), total)
+        self.assertEqual(get_balance(child.pk), total)
+
+
+def text_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {'message_id': update_id, 'chat': {'id': user_id}, 'from': {'id': user_id}, 'text': text},
+    }
+
+
+class RecordingTests(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, updates, sample=1.0):
+        path = os.path.join(self.dir.name, name)
+        recorder = recording.UpdateRecorder(path, sample)
+        for update in updates:
+            recorder.record(update, 'school')
+        recorder.close()
+        return path
+
+    def assert_round_trip(self, name):
+        updates = [text_update(i, 1, f"дело {i}") for i in range(5)]
+        path = self.write(name, updates)
+        records = list(recording.read_updates(path))
+        self.assertEqual([record['update'] for record in records], updates)
+        self.assertEqual({record['bot'] for record in records}, {'school'})
+
+    def test_round_trip_ndjson(self):
+        self.assert_round_trip('updates.ndjson')
+
+    def test_round_trip_gzip(self):
+        self.assert_round_trip('updates.ndjson.gz')
+
+    @unittest.skipUnless(importlib.util.find_spec('zstandard'), 'нет пакета zstandard')
+    def test_round_trip_zstd(self):
+        self.assert_round_trip('updates.ndjson.zst')
+
+    def test_truncated_last_line_is_skipped(self):
+        path = self.write('updates.ndjson', [text_update(1, 1, "Помог")])
+        with open(path, 'ab') as f:
+            f.write(b'{"ts": 1, "update": {"update_')
+        with self.assertLogs('bot.recording', 'WARNING'):
+            records = list(recording.read_updates(path))
+        self.assertEqual([record['update']['update_id'] for record in records], [1])
+
+    def test_truncated_gzip_keeps_earlier_records(self):
+        path = self.write('updates.ndjson.gz', [text_update(i, 1, "Помог " * 50) for i in range(20)])
+        with open(path, 'rb') as f:
+            data = f.read()
+        with open(path, 'wb') as f:
+            f.write(data[:-20])
+        with self.assertLogs('bot.recording', 'WARNING'):
+            records = list(recording.read_updates(path))
+        self.assertGreater(len(records), 0)
+        self.assertEqual([record['update']['update_id'] for record in records], list(range(len(records))))
+        with self.assertRaises(EOFError):
+            gzip.decompress(data[:-20])
+
+    def test_sampling_keeps_whole_dialogs(self):
+        recorder = recording.UpdateRecorder(os.path.join(self.dir.name, 'updates.ndjson'), 0.3)
+        self.addCleanup(recorder.close)
+        picked = {
+            user_id: {recorder.sampled(text_update(i, user_id, "Помог")) for i in range(5)}
+            for user_id in range(1, 1001)
+        }
+        # У каждого пользователя либо все update в журнале, либо ни одного
+        self.assertTrue(all(len(results) == 1 for results in picked.values()))
+        share = sum(True in results for results in picked.values()) / len(picked)
+        self.assertAlmostEqual(share, 0.3, delta=0.05)
+
+    def test_secret_text_is_redacted(self):
+        path = os.path.join(self.dir.name, 'updates.ndjson')
+        recorder = recording.UpdateRecorder(path)
+        update = text_update(1, 1, "пароль123")
+        with mock.patch.object(recording, '_recorder', recorder):
+            recording.record_update(update, 'school', secret=True)
+            recording.record_update(text_update(2, 1, "/points"), 'school')
+        recorder.close()
+        texts = [record['update']['message']['text'] for record in recording.read_updates(path)]
+        self.assertEqual(texts, [recording.REDACTED, "/points"])
+        # Исходный update, который дальше идет в обработчики, не меняется
+        self.assertEqual(update['message']['text'], "пароль123")
+
+
+class StateStorageTests(TestCase):
+    """Два экземпляра хранилища на одной базе - как два воркера gunicorn"""
+
+    def test_workers_see_each_other_states(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '2'}):
+            first, second = DjangoStateStorage(cache_ttl=state_cache_ttl()), DjangoStateStorage(cache_ttl=state_cache_ttl())
+        # Отсутствие состояния не запоминается: иначе первый воркер не увидел бы шаг второго
+        self.assertIsNone(first.get_state(1, 1))
+        second.set_state(1, 1, 'PARENT_PASSWORD')
+        self.assertEqual(first.get_state(1, 1), 'PARENT_PASSWORD')
+        first.set_data(1, 1, 'child', 7)
+        self.assertEqual(second.get_data(1, 1), {'child': 7})
+        second.delete_state(1, 1)
+        self.assertIsNone(first.get_state(1, 1))
+
+    def test_async_workers_see_each_other_states(self):
+        first, second = AsyncDjangoStateStorage(cache_ttl=0), AsyncDjangoStateStorage(cache_ttl=0)
+        self.assertIsNone(async_to_sync(first.get_state)(1, 1))
+        async_to_sync(second.set_state)(1, 1, 'WAITING_DEED')
+        self.assertEqual(async_to_sync(first.get_state)(1, 1), 'WAITING_DEED')
+
+    def test_cache_only_for_single_process(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+            self.assertEqual(state_cache_ttl(), 2)
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4', 'TELEBOT_STATE_CACHE_TTL': '5'}):
+            with self.assertLogs('bot.telebot_storage', 'ERROR'):
+                self.assertEqual(state_cache_ttl(), 0)
+
+    def test_single_process_cache_skips_repeated_reads(self):
+        storage = DjangoStateStorage(cache_ttl=60)
+        storage.get_state(1, 1)
+        with self.assertNumQueries(0):
+            self.assertIsNone(storage.get_state(1, 1))
+
+
+class ReadReplicaRouterTests(TestCase):
+    def setUp(self):
+        default = connections.settings['default']
+        replica = {**default, 'NAME': f"file:{default['NAME']}?mode=ro"}
+        patches = [
+            mock.patch.dict(connections.settings, {'replica': replica}),
+            mock.patch.dict(db_router._sticky, clear=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.router = db_router.ReadReplicaRouter()
+        self.child = Child.objects.create(telegram_id=1, name="Маша")
+        db_router._sticky.clear()
+
+    def db_for_read(self):
+        return self.router.db_for_read(KindDeed)
+
+    def test_only_reads_inside_read_replica_go_to_replica(self):
+        self.assertIsNone(self.db_for_read())
+        with db_router.read_replica():
+            self.assertEqual(self.db_for_read(), 'replica')
+            self.assertEqual(self.router.db_for_write(KindDeed), 'default')
+        self.assertIsNone(self.db_for_read())
+
+    def test_written_child_is_read_from_default(self):
+        KindDeed.objects.create(child=self.child, description="Помог", points=1)
+        with db_router.read_replica(self.child.pk):
+            self.assertEqual(self.db_for_read(), 'default')
+        with db_router.read_replica(2):
+            self.assertEqual(self.db_for_read(), 'replica')
+        with mock.patch('bot.db_router.time.monotonic', return_value=time.monotonic() + db_router.STICKY_SECONDS + 1):
+            with db_router.read_replica(self.child.pk):
+                self.assertEqual(self.db_for_read(), 'replica')
+
+    def test_archived_deeds_and_added_points_are_sticky(self):
+        deed = KindDeed.objects.create(child=self.child, description="Помог", points=1)
+        KindDeed.objects.filter(pk=deed.pk).update(created_at=timezone.now() - datetime.timedelta(days=400))
+        db_router._sticky.clear()
+        # Перенос в архив не пишет журнал баллов: отметку ставит само удаление
+        archive_deeds(older_than_days=365, keep_recent=0)
+        with db_router.read_replica(self.child.pk):
+            self.assertEqual(self.db_for_read(), 'default')
+        db_router._sticky.clear()
+        add_points(self.child, 5)
+        with db_router.read_replica(self.child.pk):
+            self.assertEqual(self.db_for_read(), 'default')
+
+    def test_temporary_database_is_read_from_default(self):
+        # Реплика открывает рабочий файл, а default подменен временной базой
+        with mock.patch.dict(connections.settings['default'], {'NAME': '/tmp/replay.sqlite3'}):
+            with db_router.read_replica():
+                self.assertEqual(self.db_for_read(), 'default')
+
+
+class ChartVersionTests(TestCase):
+    """Ключ кэша графика меняется при любом изменении, которое видно на графике"""
+
+    def setUp(self):
+        self.child = Child.objects.create(telegram_id=1, name="Маша")
+        self.old = KindDeed.objects.create(child=self.child, description="Помог", points=10)
+        self.last = KindDeed.objects.create(child=self.child, description="Убрал", points=5)
+        self.version = _chart_version(self.child.pk)
+
+    def test_no_deeds(self):
+        self.assertIsNone(_chart_version(2))
+
+    def test_unchanged(self):
+        self.assertEqual(_chart_version(self.child.pk), self.version)
+
+    def test_new_deed(self):
+        KindDeed.objects.create(child=self.child, description="Полил цветы", points=3)
+        self.assertNotEqual(_chart_version(self.child.pk), self.version)
+
+    def test_points_edited(self):
+        self.old.points = 4
+        self.old.save()
+        self.assertNotEqual(_chart_version(self.child.pk), self.version)
+
+    def test_older_deed_deleted(self):
+        self.old.delete()
+        self.assertNotEqual(_chart_version(self.child.pk), self.version)
+
+    def test_deeds_archived(self):
+        KindDeed.objects.filter(pk=self.old.pk).update(created_at=timezone.now() - datetime.timedelta(days=400))
+        archive_deeds(older_than_days=365, keep_recent=0)
+        self.assertNotEqual(_chart_version(self.child.pk), self.version)
+
+
+class ParentSessionTests(TestCase):
+    def setUp(self):
+        for state in (sessions._sessions, sessions._child_parents, passwords._verified):
+            patch = mock.patch.dict(state, clear=True)
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.child = Child.objects.create(telegram_id=1, name="Маша")
+        self.parent = Parent.objects.create(telegram_id=10, name="Мама", password="hash-1")
+        self.parent.children.add(self.child)
+
+    def test_session_needs_recent_password(self):
+        with self.assertRaises(sessions.ParentNotVerified):
+            sessions.get_parent_session(self.parent.pk)
+        passwords.mark_verified(self.parent)
+        self.assertEqual(sessions.get_parent_session(self.parent.pk).children, ((1, "Маша"),))
+        self.assertFalse(async_to_sync(sessions.aparent_session_expired)(self.parent.pk))
+
+    def test_verification_expires(self):
+        passwords.mark_verified(self.parent)
+        sessions.get_parent_session(self.parent.pk)
+        later = time.monotonic() + passwords.VERIFIED_TTL + 1
+        with mock.patch('bot.passwords.time.monotonic', return_value=later):
+            # Сессия еще в кэше, но меню уже закрыто
+            with self.assertRaises(sessions.ParentNotVerified):
+                sessions.get_parent_session(self.parent.pk)
+            self.assertTrue(async_to_sync(sessions.aparent_session_expired)(self.parent.pk))
+
+    def test_changed_password_closes_session(self):
+        passwords.mark_verified(self.parent)
+        sessions.get_parent_session(self.parent.pk)
+        self.parent.password = "hash-2"
+        self.parent.save()
+        with self.assertRaises(sessions.ParentNotVerified):
+            sessions.get_parent_session(self.parent.pk)
+
+    def test_unknown_parent_is_not_expired(self):
+        self.assertFalse(async_to_sync(sessions.aparent_session_expired)(99))
+
+    def test_children_change_invalidates(self):
+        passwords.mark_verified(self.parent)
+        sessions.get_parent_session(self.parent.pk)
+        brother = Child.objects.create(telegram_id=2, name="Петя")
+        self.parent.children.add(brother)
+        self.assertEqual(sessions.get_parent_session(self.parent.pk).child_ids, [1, 2])
+        # Со стороны ребенка
+        self.child.parents.remove(self.parent)
+        self.assertEqual(sessions.get_parent_session(self.parent.pk).child_ids, [2])
+        brother.parents.clear()
+        self.assertEqual(sessions.get_parent_session(self.parent.pk).children, ())
+
+    def test_child_rename_invalidates(self):
+        passwords.mark_verified(self.parent)
+        sessions.get_parent_session(self.parent.pk)
+        # Начисление баллов сессию не сбрасывает
+        self.child.total_points = 10
+        self.child.save()
+        self.assertIn(self.parent.pk, sessions._sessions)
+        self.child.name = "Мария"
+        self.child.save()
+        self.assertNotIn(self.parent.pk, sessions._sessions)
+        self.assertEqual(sessions.get_parent_session(self.parent.pk).child_name(1), "Мария")
+
+
+class DjangoPersistenceTests(TestCase):
+    async def rows(self):
+        return await sync_to_async(lambda: dict(PersistedData.objects.values_list('key', 'data')))()
+
+    async def test_changes_are_written_on_flush(self):
+        persistence = DjangoPersistence(flush_interval=60)
+        await persistence.update_user_data(1, {'step': 1})
+        await persistence.update_user_data(1, {'step': 2})
+        await persistence.update_conversation('main', (5, 5), 3)
+        self.assertEqual(await self.rows(), {})
+
+        await persistence.flush()
+        # Повторные изменения одного ключа схлопываются в одну запись
+        self.assertEqual(persistence.written_count, 2)
+        self.assertEqual(await persistence.get_user_data(), {1: {'step': 2}})
+        self.assertEqual(await persistence.get_conversations('main'), {(5, 5): 3})
+
+        await persistence.update_conversation('main', (5, 5), None)
+        await persistence.drop_user_data(1)
+        await persistence.flush()
+        self.assertEqual(await self.rows(), {})
+
+    async def test_max_pending_starts_flush(self):
+        persistence = DjangoPersistence(flush_interval=60, max_pending=3)
+        for user_id in range(3):
+            await persistence.update_user_data(user_id, {'n': user_id})
+        await asyncio.gather(*persistence._flush_tasks)
+        self.assertEqual(persistence.flush_count, 1)
+        self.assertEqual(len(await persistence.get_user_data()), 3)
+
+    async def test_flush_after_interval(self):
+        persistence = DjangoPersistence(flush_interval=0.01)
+        await persistence.update_chat_data(-1, {'deeds': 2})
+        await asyncio.sleep(0.05)
+        await asyncio.gather(*persistence._flush_tasks)
+        self.assertEqual(await persistence.get_chat_data(), {-1: {'deeds': 2}})
+
+    async def test_failed_write_keeps_changes(self):
+        persistence = DjangoPersistence(flush_interval=60)
+        await persistence.update_user_data(1, {'step': 1})
+        with mock.patch('bot.persistence._write', side_effect=RuntimeError("database is locked")):
+            with self.assertLogs('bot.persistence', 'ERROR'):
+                await persistence.flush()
+        # Изменение, пришедшее после неудачной записи, новее возвращенного
+        await persistence.update_user_data(1, {'step': 2})
+        await persistence.flush()
+        self.assertEqual(await persistence.get_user_data(), {1: {'step': 2}})
+
+
+def chat_update(update_id, chat_id):
+    return Update.de_json(
+        {'update_id': update_id, 'message': {'message_id': update_id, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}}},
+        None,
+    )
+
+
+class PerChatUpdateProcessorTests(unittest.IsolatedAsyncioTestCase):
+    async def test_cancelled_wait_is_not_counted(self):
+        processor = PerChatUpdateProcessor(max_running=4)
+        release = asyncio.Event()
+        first = asyncio.create_task(processor.do_process_update(chat_update(1, 5), release.wait()))
+        second_body = asyncio.sleep(0)
+        second = asyncio.create_task(processor.do_process_update(chat_update(2, 5), second_body))
+        await asyncio.sleep(0.01)
+        self.assertEqual(processor.waiting, 1)
+
+        # Второе обновление того же чата отменено, пока ждало первое
+        second.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await second
+        second_body.close()
+        self.assertEqual(processor.waiting, 0)
+
+        release.set()
+        await first
+        self.assertEqual(processor.stats()['active_chats'], 0)
+
+    async def test_updates_of_one_chat_run_in_order(self):
+        processor = PerChatUpdateProcessor(max_running=4)
+        events = []
+
+        async def handler(name, delay):
+            events.append(f"{name} начало")
+            await asyncio.sleep(delay)
+            events.append(f"{name} конец")
+
+        await asyncio.gather(
+            processor.do_process_update(chat_update(1, 5), handler("A1", 0.02)),
+            processor.do_process_update(chat_update(2, 5), handler("A2", 0)),
+            processor.do_process_update(chat_update(3, 6), handler("B1", 0)),
+        )
+        # Второе сообщение чата 5 ждет первое, а чат 6 в это время не ждет
+        self.assertLess(events.index("A1 конец"), events.index("A2 начало"))
+        self.assertLess(events.index("B1 конец"), events.index("A1 конец"))
+        self.assertEqual(processor.stats()['processed'], 3)
+
+    async def test_max_running_limits_all_chats(self):
+        processor = PerChatUpdateProcessor(max_running=2)
+        peak = 0
+
+        async def handler():
+            nonlocal peak
+            peak = max(peak, processor.running)
+            await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(processor.do_process_update(chat_update(i, i), handler()) for i in range(6)))
+        self.assertEqual(peak, 2)
+        self.assertEqual(processor.waiting, 0)
+
+
+class ChatSerialExecutorTests(TestCase):
+    def setUp(self):
+        self.pool = ChatSerialExecutor(max_workers=2, max_pending=2)
+        self.addCleanup(self.pool.shutdown)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def test_rejects_when_saturated(self):
+        self.assertTrue(self.pool.submit(1, self.release.wait))
+        self.assertTrue(self.pool.submit(2, self.release.wait))
+        self.assertFalse(self.pool.submit(3, self.release.wait))
+        self.assertEqual(self.pool.stats()['rejected'], 1)
+        self.assertEqual(self.pool.stats()['saturation'], 1.0)
+
+        self.release.set()
+        self.pool.shutdown()
+        self.assertEqual(self.pool.stats()['pending'], 0)
+        self.assertEqual(self.pool.stats()['completed'], 2)
+
+    def test_one_chat_runs_in_order(self):
+        pool = ChatSerialExecutor(max_workers=4, max_pending=100)
+        order = []
+        for i in range(20):
+            pool.submit(5, order.append, i)
+        pool.shutdown()
+        self.assertEqual(order, list(range(20)))
+
+    def test_webhook_answers_503_when_saturated(self):
+        # Модуль бота при импорте настраивает логирование: для тестов оно не нужно
+        with mock.patch.dict(os.environ, {'TELEGRAM_TOKEN': '1:test'}), mock.patch('logging.basicConfig'):
+            telebot_app = importlib.import_module('telebot_app')
+        update = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'chat': {'id': 3, 'type': 'private'}, 'from': {'id': 3}}}
+        self.pool.submit(1, self.release.wait)
+        self.pool.submit(2, self.release.wait)
+        with mock.patch.object(telebot_app, 'update_pool', self.pool), self.assertLogs('telebot_app', 'WARNING'):
+            response = telebot_app.app.test_client().post(f'/{telebot_app.TOKEN}', json=update)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.pool.stats()['rejected'], 1)
+
+
+class DigestResumeTests(TestCase):
+    def setUp(self):
+        for parent_id in range(1, 6):
+            parent = Parent.objects.create(telegram_id=parent_id, name=f"Родитель {parent_id}")
+            parent.children.add(Child.objects.create(telegram_id=100 + parent_id, name=f"Ребенок {parent_id}"))
+        self.sent_to = []
+
+    async def fake_call_api(self, token, method, payload):
+        self.sent_to.append(payload['chat_id'])
+        return {'ok': True, 'result': {}}
+
+    def send_all(self):
+        sender = DigestSender('0:test', week_start=datetime.date(2026, 10, 5), rate=1000, batch_size=2)
+        with mock.patch('bot.digest.call_api', self.fake_call_api):
+            return async_to_sync(sender.send_all)()
+
+    def test_resume_skips_processed_parents(self):
+        # Прошлый запуск упал посреди пачки 3-4: родителю 3 сводка уже ушла
+        run = DigestRun.objects.create(week_start=datetime.date(2026, 10, 5), last_parent_id=2)
+        DigestDelivery.objects.create(run=run, parent_id=3, status=DigestDelivery.SENT)
+
+        run = self.send_all()
+        self.assertEqual(self.sent_to, [4, 5])
+        self.assertIsNotNone(run.finished_at)
+        self.assertEqual(run.last_parent_id, 5)
+        # Итоги - за всю рассылку, включая прерванный запуск
+        self.assertEqual(run.sent, 3)
+
+    def test_finished_run_is_not_sent_again(self):
+        self.send_all()
+        self.assertEqual(self.sent_to, [1, 2, 3, 4, 5])
+        self.sent_to.clear()
+        self.send_all()
+        self.assertEqual(self.sent_to, [])
+
+
+class ChildNameTests(TestCase):
+    def setUp(self):
+        patch = mock.patch.dict(children._parent_maps, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.parent = Parent.objects.create(telegram_id=10, name="Мама")
+        self.own = Child.objects.create(telegram_id=2, name="Алёна")
+        self.other = Child.objects.create(telegram_id=1, name="Алена")
+        self.parent.children.add(self.own)
+
+    def test_normalize_name(self):
+        self.assertEqual(normalize_name("  Алёна   Петрова "), "алена петрова")
+        self.assertEqual(normalize_name("ÉCOLE"), "école")
+        self.assertEqual(normalize_name("Straße"), "strasse")
+        self.assertEqual(normalize_name("   "), "")
+        self.assertEqual(self.own.name_key, "алена")
+
+    def test_own_child_goes_first(self):
+        self.assertEqual(find_child_by_name("АЛЕНА"), self.other)
+        self.assertEqual(find_child_by_name("алена", self.parent), self.own)
+        self.assertIsNone(find_child_by_name("  ", self.parent))
+
+    def test_remembered_children_answer_without_join(self):
+        remember_parent_children(self.parent.pk, [self.own])
+        with self.assertNumQueries(1):
+            self.assertEqual(find_child_by_name("Алена", self.parent), self.own)
+
+    def test_map_forgotten_on_children_change(self):
+        remember_parent_children(self.parent.pk, [self.own])
+        self.parent.children.remove(self.own)
+        self.assertNotIn(self.parent.pk, children._parent_maps)
+        self.assertEqual(find_child_by_name("Алена", self.parent), self.other)
+
+        remember_parent_children(self.parent.pk, [])
+        self.own.parents.add(self.parent)
+        self.assertNotIn(self.parent.pk, children._parent_maps)
+
+        remember_parent_children(self.parent.pk, [self.own])
+        self.own.parents.clear()
+        self.assertEqual(children._parent_maps, {})
+
+    def test_renamed_child_is_not_found_by_old_name(self):
+        remember_parent_children(self.parent.pk, [self.own])
+        self.own.name = "Вера"
+        self.own.save()
+        self.assertEqual(find_child_by_name("Алена", self.parent), self.other)
+        self.assertEqual(async_to_sync(afind_child_by_name)("вера", self.parent), self.own)
+
+    def test_deleted_child_is_forgotten(self):
+        remember_parent_children(self.parent.pk, [self.own])
+        self.own.delete()
+        self.assertEqual(async_to_sync(afind_child_by_name)("Алена", self.parent), self.other)
+        self.assertNotIn(self.parent.pk, children._parent_maps)
+
+
+class LegacyPasswordTests(TestCase):
+    def setUp(self):
+        patch = mock.patch.dict(passwords._verified, clear=True)
+        patch.start()
+        self.addCleanup(patch.stop)
+        legacy = hashlib.sha256("секрет".encode()).hexdigest()
+        self.parent = Parent.objects.create(telegram_id=10, name="Мама", password=legacy)
+
+    def stored_password(self):
+        return Parent.objects.get(pk=self.parent.pk).password
+
+    def test_legacy_hash_is_upgraded_on_login(self):
+        self.assertTrue(passwords.verify_parent_password(self.parent, "секрет"))
+        stored = self.stored_password()
+        self.assertEqual(identify_hasher(stored).algorithm, 'pbkdf2_sha256')
+        self.assertEqual(self.parent.password, stored)
+        self.assertTrue(passwords.recently_verified(self.parent))
+        # Новый хеш проверяется как обычно и больше не меняется
+        self.assertTrue(passwords.verify_parent_password(self.parent, "секрет"))
+        self.assertEqual(self.stored_password(), stored)
+
+    def test_wrong_password_keeps_legacy_hash(self):
+        legacy = self.parent.password
+        self.assertFalse(passwords.verify_parent_password(self.parent, "не тот"))
+        self.assertEqual(self.stored_password(), legacy)
+        self.assertFalse(passwords.recently_verified(self.parent))
+
+    def test_async_login_upgrades_too(self):
+        self.assertTrue(async_to_sync(passwords.averify_parent_password)(self.parent, "секрет"))
+        self.assertEqual(identify_hasher(self.stored_password()).algorithm, 'pbkdf2_sha256')
+
+    def test_upgrade_does_not_overwrite_a_new_password(self):
+        # Пока шла проверка старого пароля, родитель задал новый
+        Parent.objects.filter(pk=self.parent.pk).update(password="новый-хеш")
+        self.assertTrue(passwords.verify_parent_password(self.parent, "секрет"))
+        self.assertEqual(self.stored_password(), "новый-хеш")
+
+
+class MultiBotTests(unittest.TestCase):
+    def setUp(self):
+        self.first, self.second = parse_tokens("school1=1:a,2:b")
+
+    def test_parse_tokens(self):
+        self.assertEqual((self.first.name, self.first.webhook_path), ("school1", "/1:a"))
+        self.assertEqual((self.second.name, self.second.token), ("2", "2:b"))
+
+    def test_state_is_separate_per_bot(self):
+        states = BotStateDict('user_states')
+        with use_bot(self.first):
+            states[5] = 'WAITING_DEED'
+        with use_bot(self.second):
+            self.assertNotIn(5, states)
+            states[5] = 'PARENT_PASSWORD'
+        with use_bot(self.first):
+            self.assertEqual(dict(states), {5: 'WAITING_DEED'})
+            del states[5]
+            self.assertEqual(len(states), 0)
+        self.assertEqual(self.second.state, {'user_states': {5: 'PARENT_PASSWORD'}})
+
+    def test_429_pauses_only_that_bot(self):
+        async def call_api(token, method, payload):
+            return {'ok': False, 'error_code': 429, 'parameters': {'retry_after': 3}}
+
+        with mock.patch('bot.telegram_api.call_api', call_api), use_bot(self.first):
+            async_to_sync(bot_api)('sendMessage', {'chat_id': 5, 'text': "Привет"})
+        self.assertAlmostEqual(self.first.limiter.reserve(), 3, delta=0.5)
+        self.assertEqual(self.second.limiter.reserve(), 0)
+
+    def test_chat_limit(self):
+        limiter = RateLimiter()
+        with mock.patch.multiple('bot.multibot', CHAT_RATE_PER_SECOND=1, CHAT_BURST=2):
+            waits = [limiter.reserve(5) for _ in range(3)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 1, delta=0.1)
+        # Другой чат этой очереди не ждет
+        self.assertEqual(limiter.reserve(6), 0.0)
+
+
+class OutboundStatusRouteTests(unittest.TestCase):
+    def setUp(self):
+        # Модуль бота при импорте настраивает логирование (в том числе в bot.log): для тестов оно не нужно
+        with mock.patch.dict(os.environ, {'TELEGRAM_TOKEN': '1:test'}), \
+                mock.patch('logging.basicConfig'), mock.patch('logging.FileHandler'):
+            self.client = importlib.import_module('flask_app').app.test_client()
+
+    def test_hidden_by_default(self):
+        with mock.patch.dict(os.environ, {'BOT_DIAGNOSTIC_ROUTES': ''}):
+            self.assertEqual(self.client.get('/outbound_status').status_code, 404)
+
+    def test_enabled_by_env(self):
+        with mock.patch.dict(os.environ, {'BOT_DIAGNOSTIC_ROUTES': '1'}):
+            response = self.client.get('/outbound_status')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['status'], 'success')
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка обновлений разных чатов, по очереди внутри одного чата.
+
+    ConversationHandler хранит состояние на чат, поэтому два сообщения одного
+    чата не должны обрабатываться одновременно. Обновления разных чатов идут
+    параллельно, но одновременно работает не больше ``max_running`` обработчиков.
+    ``max_pending`` ограничивает общее число принятых обновлений (ожидающих
+    и выполняющихся); сверх него PTB не забирает обновления из очереди.
+
+    Ожидание считается от момента приема обновления до начала его обработки.
+    """
+
+    def __init__(self, max_running=16, max_pending=256, stats_every=1000):
+        # Семафор базового класса ограничивает принятые обновления, а не работающие:
+        # иначе сообщения одного "шумного" чата, ждущие своей очереди, занимали бы
+        # все слоты и останавливали остальные чаты.
+        super().__init__(max(max_pending, max_running))
+        self.max_running = max_running
+        self.stats_every = stats_every
+        self._running = asyncio.Semaphore(max_running)
+        self._chat_locks = {}
+        self._waits = deque(maxlen=1000)
+        self.processed = 0
+        self.waiting = 0
+        self.running = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        if self.processed:
+            self._log_stats()
+
+    async def do_process_update(self, update, coroutine):
+        key = _chat_key(update)
+        queued_at = time.perf_counter()
+        entry = None
+        locks = [self._running]
+        if key is not None:
+            entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+            locks.insert(0, entry[0])
+        try:
+            async with self._acquire(locks):
+                self._record_wait(queued_at)
+                self.running += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+        finally:
+            if entry is not None:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._chat_locks[key]
+
+    @asynccontextmanager
+    async def _acquire(self, locks):
+        """Берет блокировки по порядку; пока они не взяты, обновление считается ждущим.
+
+        Счетчик уменьшается и при отмене ожидания (остановка бота, таймаут).
+        """
+        async with AsyncExitStack() as stack:
+            self.waiting += 1
+            try:
+                for lock in locks:
+                    await stack.enter_async_context(lock)
+            finally:
+                self.waiting -= 1
+            yield
+
+    def _record_wait(self, queued_at):
+        wait = time.perf_counter() - queued_at
+        self.processed += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self._waits.append(wait)
+        if self.stats_every and not self.processed % self.stats_every:
+            self._log_stats()
+
+    def stats(self):
+        """Метрики ожидания в очереди (в миллисекундах)"""
+        recent = sorted(self._waits)
+        return {
+            "processed": self.processed,
+            "waiting": self.waiting,
+            "running": self.running,
+            "active_chats": len(self._chat_locks),
+            "avg_wait_ms": self.total_wait / self.processed * 1000 if self.processed else 0.0,
+            "p95_wait_ms": recent[int(len(recent) * 0.95) - 1] * 1000 if recent else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    def _log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"Очередь обновлений: обработано {stats['processed']}, ждут {stats['waiting']}, "
+            f"ожидание avg {stats['avg_wait_ms']:.1f} мс, p95 {stats['p95_wait_ms']:.1f} мс, "
+            f"max {stats['max_wait_ms']:.1f} мс"
+        )
+
+
+def _chat_key(update):
+    """Ключ сериализации: чат, а для обновлений без чата (inline и т.п.) - пользователь"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return ("user", update.effective_user.id)
+    return None
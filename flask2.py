@@ -1,4 +1,3 @@
-from bot.models import Child, KindDeed, Reward, Parent
 from flask import Flask, request, jsonify
 import os
 import django
@@ -28,6 +27,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
 django.setup()
 
 # Импорт необходимых модулей из проекта
+from bot.models import Child, KindDeed, Reward, Parent
+from bot.children import find_child_by_name, remember_parent_children
+from bot.passwords import ahash_password, averify_parent_password, mark_verified
+from bot.telegram_api import call_api
 
 # Создаем Flask-приложение
 app = Flask(__name__)
@@ -121,13 +124,9 @@ def verify_parent(telegram_id):
 
 
 @sync_to_async
-def get_child_by_name(name):
-    try:
-        return Child.objects.get(name=name)
-    except Child.DoesNotExist:
-        return None
-    except Child.MultipleObjectsReturned:
-        return Child.objects.filter(name=name).first()
+def get_child_by_name(name, parent=None):
+    # Без учета регистра и ё/е; при совпадении имен дети родителя идут первыми
+    return find_child_by_name(name, parent)
 
 
 @sync_to_async
@@ -135,25 +134,22 @@ def is_parent_of_child(parent, child):
     return parent.children.filter(telegram_id=child.telegram_id).exists()
 
 
-@sync_to_async
-def set_parent_password(parent, password):
-    import hashlib
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    parent.password = hashed_password
-    parent.save()
+async def set_parent_password(parent, password):
+    parent.password = await ahash_password(password)
+    await sync_to_async(parent.save)()
+    mark_verified(parent)
     return parent
 
 
-@sync_to_async
-def verify_parent_password(parent, password):
-    import hashlib
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    return parent.password == hashed_password
+async def verify_parent_password(parent, password):
+    return await averify_parent_password(parent, password)
 
 
 @sync_to_async
 def get_parent_children(parent):
-    return list(parent.children.all())
+    children = list(parent.children.all())
+    remember_parent_children(parent.pk, children)
+    return children
 
 
 @sync_to_async
@@ -180,16 +176,21 @@ async def webhook():
         update = request.get_json()
         logger.info(f"Получен update: {json.dumps(update, indent=2)}")
 
-        if 'message' in update:
-            await process_message(update['message'])
-        elif 'callback_query' in update:
-            await process_callback_query(update['callback_query'])
+        await process_update(update)
 
         return jsonify({'status': 'ok'})
     except Exception as e:
         logger.error(f"Ошибка при обработке webhook: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
+
+# Обработка одного update (вызывается маршрутом Flask и ASGI-приложением asgi_webhooks.py)
+async def process_update(update):
+    if 'message' in update:
+        await process_message(update['message'])
+    elif 'callback_query' in update:
+        await process_callback_query(update['callback_query'])
+
 # Функция обработки сообщений
 
 
@@ -324,7 +325,7 @@ async def process_message(message):
             # Пытаемся найти ребенка по имени. Если не найден, не создаем автоматом.
             # Ребенок должен сначала сам зарегистрироваться в боте через
             # /start.
-            child_to_add = await get_child_by_name(child_name_input)
+            child_to_add = await get_child_by_name(child_name_input, parent)
 
             if child_to_add:
                 await add_child_to_parent(parent, child_to_add)
@@ -846,7 +847,6 @@ async def process_back_to_menu(
 
 # Функции для работы с Telegram API
 async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
     payload = {'chat_id': chat_id, 'text': text}
     if parse_mode:
         payload['parse_mode'] = parse_mode
@@ -854,20 +854,7 @@ async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
         payload['reply_markup'] = reply_markup
 
     try:
-        # @sync_to_async # sync_to_async не нужен для requests если он не в Django view напрямую
-        # response = requests.post(url, json=payload) # Это блокирующий вызов
-
-        # Для асинхронности с requests нужен httpx или aiohttp, либо запускать requests в executor
-        # Пока оставим синхронный вариант для простоты, т.к. основная логика бота асинхронна через asgiref для Django
-        # В реальном Flask async view лучше использовать async http client
-        # Но т.к. это Flask под ASGI (вероятно, через Daphne/Uvicorn, т.к. есть
-        # django.setup()), requests.post должен быть обернут
-        @sync_to_async
-        def do_post_request():
-            return requests.post(url, json=payload)
-        response = await do_post_request()
-
-        response_json = response.json()
+        response_json = await call_api(TOKEN, 'sendMessage', payload)
         if not response_json.get('ok'):
             logger.error(
                 f"Ошибка при отправке сообщения: {response_json} | Payload: {payload}")
@@ -885,7 +872,6 @@ async def edit_message(
         text,
         parse_mode=None,
         reply_markup=None):
-    url = f"https://api.telegram.org/bot{TOKEN}/editMessageText"
     payload = {'chat_id': chat_id, 'message_id': message_id, 'text': text}
     if parse_mode:
         payload['parse_mode'] = parse_mode
@@ -893,12 +879,7 @@ async def edit_message(
         payload['reply_markup'] = reply_markup
 
     try:
-        @sync_to_async
-        def do_post_request():
-            return requests.post(url, json=payload)
-        response = await do_post_request()
-
-        response_json = response.json()
+        response_json = await call_api(TOKEN, 'editMessageText', payload)
         if not response_json.get('ok'):
             logger.error(
                 f"Ошибка при редактировании сообщения: {response_json} | Payload: {payload}")
@@ -914,7 +895,6 @@ async def answer_callback_query(
         callback_query_id,
         text=None,
         show_alert=False):
-    url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
     payload = {
         'callback_query_id': callback_query_id,
         'show_alert': show_alert}
@@ -922,12 +902,7 @@ async def answer_callback_query(
         payload['text'] = text
 
     try:
-        @sync_to_async
-        def do_post_request():
-            return requests.post(url, json=payload)
-        response = await do_post_request()
-
-        response_json = response.json()
+        response_json = await call_api(TOKEN, 'answerCallbackQuery', payload)
         if not response_json.get('ok'):
             logger.error(
                 f"Ошибка при ответе на callback_query: {response_json} | Payload: {payload}")
@@ -1,11 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, abort, request, jsonify
 import os
-import django
 import logging
 import json
-from dotenv import load_dotenv
+import time
+import asyncio
+import threading
+from collections import OrderedDict
 from asgiref.sync import sync_to_async
-import requests
+
+from bot.bootstrap import diagnostics_enabled, lazy_import, lazy_startup, load_env, run_once, setup_django
+from bot.keyboards import (
+    BACK_TO_MENU_KEYBOARD,
+    CHILD_ACTIONS_KEYBOARD,
+    DEED_ADDED_KEYBOARD,
+    FALLBACK_REWARDS_TEXT,
+    MAIN_MENU_KEYBOARD,
+    PARENT_MENU_KEYBOARD,
+    PARENT_MENU_NO_CHILDREN_KEYBOARD,
+    PARENT_MENU_WITH_CHILDREN_KEYBOARD,
+    PARENT_SESSION_EXPIRED_TEXT,
+    markup_json,
+)
+from bot.multibot import BotStateDict, bot_api, current_bot, get_bot, load_bots, use_bot
+from bot.recording import record_update
+
+# requests нужен только служебным маршрутам webhook
+requests = lazy_import('requests')
 
 # Настройка логгирования
 logging.basicConfig(
@@ -19,28 +39,54 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
-load_dotenv()
-
-# Настройка Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
-django.setup()
-
-# Импорт необходимых модулей из вашего проекта
-from bot.models import Child, KindDeed, Reward, Parent
+load_env()
+
+def _import_bot_modules():
+    """Настройка Django и импорт модулей бота, которым нужны модели"""
+    global Child, KindDeed, Reward, Parent
+    global find_child_by_name, remember_parent_children
+    global read_replica
+    global ahash_password, averify_parent_password, mark_verified, recently_verified
+    global add_points
+    global atake_progress, format_progress
+    global coalescing, current_batch, outbound_stats
+    global aget_parent_session, aparent_session_expired, invalidate_parent_session
+    setup_django()
+    from bot.models import Child, KindDeed, Reward, Parent
+    from bot.children import find_child_by_name, remember_parent_children
+    from bot.db_router import read_replica
+    from bot.passwords import ahash_password, averify_parent_password, mark_verified, recently_verified
+    from bot.ledger import add_points
+    from bot.progress import atake_progress, format_progress
+    from bot.outbound import coalescing, current_batch, outbound_stats
+    from bot.sessions import aget_parent_session, aparent_session_expired, invalidate_parent_session
+
+def load_bot():
+    run_once('flask_app', _import_bot_modules)
 
 # Создаем Flask-приложение
 app = Flask(__name__)
 
-# Телеграм токен из переменных окружения
-TOKEN = os.environ.get('TELEGRAM_TOKEN')
+# При BOT_LAZY_STARTUP=1 Django загружается первым запросом (bot/bootstrap.py)
+if lazy_startup():
+    app.before_request(load_bot)
+else:
+    load_bot()
+
+# Телеграм токены из переменных окружения: один TELEGRAM_TOKEN или несколько
+# ботов в BOT_TOKENS (bot/multibot.py), каждый со своим webhook-путем
+BOTS = load_bots()
+BOTS_BY_PATH = {bot.webhook_path: bot for bot in BOTS}
+TOKEN = BOTS[0].token if BOTS else None
 if not TOKEN:
     logger.error("Токен Telegram не найден в переменных окружения.")
 
-# Хранилище состояний пользователей (в реальном проекте лучше использовать базу данных или Redis)
-user_states = {}
-user_contexts = {}
-group_states = {}
-group_contexts = {}
+# Хранилище состояний пользователей (в реальном проекте лучше использовать базу данных или Redis);
+# у каждого бота свои словари
+user_states = BotStateDict('user_states')
+user_contexts = BotStateDict('user_contexts')
+group_states = BotStateDict('group_states')
+group_contexts = BotStateDict('group_contexts')
 
 # Состояния диалога
 class States:
@@ -180,11 +226,13 @@ def get_child(telegram_id):
 
 @sync_to_async
 def get_recent_deeds(child, limit=5):
-    return list(child.deeds.order_by('-created_at')[:limit])
+    with read_replica(child.pk):
+        return list(child.deeds.order_by('-created_at')[:limit])
 
 @sync_to_async
 def get_rewards():
-    return list(Reward.objects.all().order_by('points_required'))
+    with read_replica():
+        return list(Reward.objects.all().order_by('points_required'))
 
 @sync_to_async
 def create_deed(child, description, points, parent=None):
@@ -197,9 +245,7 @@ def create_deed(child, description, points, parent=None):
 
 @sync_to_async
 def update_child_points(child, points):
-    child.total_points += points
-    child.save()
-    return child.total_points
+    return add_points(child, points)
 
 @sync_to_async
 def get_or_create_parent(telegram_id, name):
@@ -220,66 +266,93 @@ def verify_parent(telegram_id):
         return None, False
 
 @sync_to_async
-def get_child_by_name(name):
-    try:
-        return Child.objects.get(name=name)
-    except Child.DoesNotExist:
-        return None
-    except Child.MultipleObjectsReturned:
-        return Child.objects.filter(name=name).first()
+def get_child_by_name(name, parent=None):
+    # Без учета регистра и ё/е; при совпадении имен дети родителя идут первыми
+    return find_child_by_name(name, parent)
 
 @sync_to_async
 def is_parent_of_child(parent, child):
     return parent.children.filter(telegram_id=child.telegram_id).exists()
 
-@sync_to_async
-def set_parent_password(parent, password):
+async def set_parent_password(parent, password):
     """Установка пароля родителя"""
-    import hashlib
-    # Простое хеширование пароля (в реальном проекте используйте более надежные методы)
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    parent.password = hashed_password
-    parent.save()
+    parent.password = await ahash_password(password)
+    await sync_to_async(parent.save)()
+    mark_verified(parent)
     return parent
 
-@sync_to_async
-def verify_parent_password(parent, password):
+async def verify_parent_password(parent, password):
     """Проверка пароля родителя"""
-    import hashlib
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    return parent.password == hashed_password
+    return await averify_parent_password(parent, password)
 
 @sync_to_async
 def get_parent_children(parent):
     """Получение списка детей родителя"""
-    return list(parent.children.all())
+    children = list(parent.children.all())
+    remember_parent_children(parent.pk, children)
+    return children
+
+@sync_to_async
+def get_children_by_ids(child_ids):
+    with read_replica(*child_ids):
+        return list(Child.objects.filter(telegram_id__in=child_ids).order_by('pk'))
 
 @sync_to_async
 def add_child_to_parent(parent, child):
     """Привязка ребенка к родителю"""
+    # Сессию родителя сбросит сигнал m2m_changed (bot/sessions.py)
     parent.children.add(child)
     return True
 
 # Обработка webhook-запросов от Telegram
-@app.route(f'/{TOKEN}', methods=['POST'])
 async def webhook():
     try:
         update = request.get_json()
         logger.info(f"Получен update: {json.dumps(update, indent=2)}")
+        bot = BOTS_BY_PATH[request.path]
+        record_update(update, bot.name, secret=awaiting_password(update, bot))
 
-        # Обработка сообщений
-        if 'message' in update:
-            await process_message(update['message'])
-
-        # Обработка callback-запросов (нажатия на кнопки)
-        if 'callback_query' in update:
-            await process_callback_query(update['callback_query'])
+        await process_update(update, bot)
 
         return jsonify({'status': 'ok'})
     except Exception as e:
         logger.error(f"Ошибка при обработке webhook: {e}")
         return jsonify({'status': 'error', 'message': str(e)})
 
+def awaiting_password(update, bot=None):
+    """Ждет ли бот от автора сообщения пароль родителя: такой текст не пишется в журнал update"""
+    message = update.get('message') or update.get('edited_message')
+    if not message or 'from' not in message:
+        return False
+    user_id, chat_id = message['from']['id'], message['chat']['id']
+    with use_bot(bot or current_bot()):
+        if chat_id < 0:
+            state = group_states.get(chat_id, {}).get(user_id)
+        else:
+            state = user_states.get(user_id)
+    return state == States.PARENT_PASSWORD
+
+for school_bot in BOTS:
+    app.add_url_rule(school_bot.webhook_path, f'webhook_{school_bot.name}', webhook, methods=['POST'])
+
+# Обработка одного update (вызывается маршрутом Flask и ASGI-приложением asgi_webhooks.py)
+async def process_update(update, bot=None):
+    load_bot()
+    # Ответы уходят от того бота, которому пришел update
+    with use_bot(bot or current_bot()):
+        # Сообщения, отправленные подряд в один чат, уходят одним запросом в конце обработки
+        async with coalescing(deliver_message):
+            await dispatch_update(update)
+
+async def dispatch_update(update):
+    # Обработка сообщений
+    if 'message' in update:
+        await process_message(update['message'])
+
+    # Обработка callback-запросов (нажатия на кнопки)
+    if 'callback_query' in update:
+        await process_callback_query(update['callback_query'])
+
 # Функция обработки сообщений
 async def process_message(message):
     try:
@@ -354,12 +427,7 @@ async def process_message(message):
                 total_points = await update_child_points(child, points)
                 
                 # Отправляем сообщение об успешном добавлении
-                keyboard = {
-                    "inline_keyboard": [
-                        [{"text": "📝 Добавить еще доброе дело", "callback_data": "add_deed"}],
-                        [{"text": "🏠 Вернуться в меню", "callback_data": "back_to_menu"}]
-                    ]
-                }
+                keyboard = markup_json(DEED_ADDED_KEYBOARD)
                 
                 username = message['from']['username'] if 'username' in message['from'] else message['from']['first_name']
                 await send_message(
@@ -392,13 +460,7 @@ async def process_message(message):
                 parent, created = await get_or_create_parent(user_id, message['from']['first_name'])
                 await set_parent_password(parent, password)
         
-                keyboard = {
-                    "inline_keyboard": [
-                        [{"text": "➕ Добавить ребенка", "callback_data": "add_child"}],
-                        [{"text": "📊 Просмотр статистики детей", "callback_data": "view_children"}],
-                        [{"text": "🏠 В главное меню", "callback_data": "exit_parent_mode"}]
-                    ]
-                }
+                keyboard = markup_json(PARENT_MENU_KEYBOARD)
         
                 await send_message(
                     chat_id,
@@ -416,23 +478,18 @@ async def process_message(message):
                     is_valid = await verify_parent_password(parent, password)
             
                     if is_valid:
-                        # Пароль верный, показываем меню родителя
-                        children = await get_parent_children(parent)
-                
-                        keyboard = []
-                        if children:
-                            keyboard.append([{"text": "➕ Добавить доброе дело ребенку", "callback_data": "add_deed_to_child"}])
-                            keyboard.append([{"text": "📊 Просмотр статистики детей", "callback_data": "view_children"}])
+                        # Пароль верный: сессия родителя перечитывается, дальше меню работает по ней
+                        invalidate_parent_session(parent.pk)
+                        children = (await aget_parent_session(parent.pk)).children
                 
-                        keyboard.append([{"text": "➕ Добавить ребенка", "callback_data": "add_child"}])
-                        keyboard.append([{"text": "🏠 В главное меню", "callback_data": "exit_parent_mode"}])
+                        keyboard = markup_json(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
                 
                         await send_message(
                             chat_id,
                             f"👋 Здравствуйте, {parent.name}! Вы вошли в режим родителя.\n\n"
                             f"У вас {len(children)} {'детей' if len(children) != 1 else 'ребенок'} в системе.\n\n"
                             "Выберите действие:",
-                            reply_markup={"inline_keyboard": keyboard}
+                            reply_markup=keyboard
                         )
                 
                         # Устанавливаем состояние родительского меню
@@ -460,7 +517,7 @@ async def process_message(message):
                 parent = await get_parent(user_id)
                 
                 # Проверяем, существует ли ребенок с таким именем
-                child = await get_child_by_name(child_name)
+                child = await get_child_by_name(child_name, parent)
                 
                 if child:
                     # Если ребенок найден, привязываем его к родителю
@@ -591,15 +648,7 @@ async def process_message(message):
             )
             
             # Создаем клавиатуру с кнопками и эмодзи
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "📝 Добавить доброе дело", "callback_data": "add_deed"}],
-                    [{"text": "🌟 Мои баллы", "callback_data": "check_points"}],
-                    [{"text": "🎁 Посмотреть награды", "callback_data": "view_rewards"}],
-                    [{"text": "❓ Помощь", "callback_data": "help"}],
-                    [{"text": "👨‍👩‍👧‍👦 Я родитель", "callback_data": "register_parent"}]
-                ]
-            }
+            keyboard = markup_json(MAIN_MENU_KEYBOARD)
             
             await send_message(chat_id, welcome_text, parse_mode='Markdown', reply_markup=keyboard)
             
@@ -631,11 +680,7 @@ async def process_message(message):
                 "Делай больше добрых дел и получай награды! 🎉"
             )
             
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "◀️ Назад в меню", "callback_data": "back_to_menu"}]
-                ]
-            }
+            keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
            
             await send_message(chat_id, help_text, parse_mode='Markdown', reply_markup=keyboard)
         elif text == '/grouphelp':
@@ -694,9 +739,24 @@ async def process_message(message):
         )
 
 # Функция обработки callback-запросов (нажатий на кнопки)
+# callback_data кнопок, которые обрабатывает process_callback_query (кроме select_child_*)
+CALLBACK_ACTIONS = {
+    'add_deed', 'check_points', 'view_rewards', 'help', 'register_parent', 'back_to_menu',
+    'add_child', 'view_children', 'add_deed_to_child', 'exit_parent_mode', 'back_to_parent_menu',
+}
+# Кнопки меню родителя: работают, только пока пароль вводили недавно
+PARENT_MENU_ACTIONS = {'add_child', 'view_children', 'add_deed_to_child', 'back_to_parent_menu'}
+
 async def process_callback_query(callback_query):
+    answer = None
     try:
         data = callback_query['data']
+
+        # Подтверждаем нажатие сразу, параллельно с обработкой: часики на кнопке
+        # пропадают через один запрос к Telegram, а не после всей работы обработчика
+        known = data in CALLBACK_ACTIONS or data.startswith("select_child_")
+        answer = start_answer_callback_query(callback_query['id'], None if known else "Неизвестная команда")
+
         chat_id = callback_query['message']['chat']['id']
         user_id = callback_query['from']['id']
         message_id = callback_query['message']['message_id']
@@ -705,21 +765,24 @@ async def process_callback_query(callback_query):
         
         logger.info(f"Получен callback_query: {data} от пользователя {user_id} в чате {chat_id}")
         
+        if data in PARENT_MENU_ACTIONS or data.startswith("select_child_"):
+            if await aparent_session_expired(user_id):
+                await reply_in_place(chat_id, message_id, PARENT_SESSION_EXPIRED_TEXT)
+                await reset_user_state_and_context(user_id, chat_id)
+                return
+        
         # Обработка кнопки "Добавить доброе дело"
         if data == 'add_deed':
             # Отправляем сообщение с запросом описания дела
             username = callback_query['from'].get('username', callback_query['from'].get('first_name', 'пользователь'))
             if is_group and username:
-                await send_message(chat_id, f"@{username}, 📝 опиши свое доброе дело:")
+                await reply_in_place(chat_id, message_id, f"@{username}, 📝 опиши свое доброе дело:")
             else:
-                await send_message(chat_id, "📝 Опиши свое доброе дело:")
+                await reply_in_place(chat_id, message_id, "📝 Опиши свое доброе дело:")
             
             # Устанавливаем состояние
             await set_user_state(user_id, States.WAITING_DEED, chat_id)
             logger.info(f"Установлено состояние WAITING_DEED для пользователя {user_id} в чате {chat_id}")
-            
-            # Отвечаем на callback_query
-            await answer_callback_query(callback_query['id'])
         
         # Обработка кнопки "Мои баллы"
         elif data == 'check_points':
@@ -727,22 +790,16 @@ async def process_callback_query(callback_query):
             recent_deeds = await get_recent_deeds(child)
             
             text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+            text += format_progress(*await atake_progress(child.pk))
             if recent_deeds:
                 text += "📋 *Твои последние добрые дела:*\n"
                 for deed in recent_deeds:
                     date_str = deed.created_at.strftime("%d.%m.%Y")
                     text += f"• {deed.description}: *{deed.points} баллов* ({date_str})\n"
             
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "◀️ Назад в меню", "callback_data": "back_to_menu"}]
-                ]
-            }
-            
-            await send_message(chat_id, text, parse_mode='Markdown', reply_markup=keyboard)
+            keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
             
-            # Отвечаем на callback_query
-            await answer_callback_query(callback_query['id'])
+            await reply_in_place(chat_id, message_id, text, parse_mode='Markdown', reply_markup=keyboard)
         
         # Обработка кнопки "Посмотреть награды"
         elif data == 'view_rewards':
@@ -750,10 +807,7 @@ async def process_callback_query(callback_query):
             
             if not rewards:
                 text = "Пока в базе нет доступных наград. Но ты можешь копить на:\n\n"
-                text += f"• *Обычная игрушка*: 1000 баллов\n"
-                text += f"• *Приставка на выходные*: 3000 баллов\n"
-                text += f"• *Крутая игрушка*: 5000 баллов\n"
-                text += f"• *Nintendo Switch*: 35000 баллов\n"
+                text += FALLBACK_REWARDS_TEXT
             else:
                 text = "🎁 *Доступные награды:*\n\n"
                 for reward in rewards:
@@ -762,16 +816,9 @@ async def process_callback_query(callback_query):
                         text += f" - {reward.description}"
                     text += "\n"
             
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "◀️ Назад в меню", "callback_data": "back_to_menu"}]
-                ]
-            }
+            keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
             
-            await send_message(chat_id, text, parse_mode='Markdown', reply_markup=keyboard)
-            
-            # Отвечаем на callback_query
-            await answer_callback_query(callback_query['id'])
+            await reply_in_place(chat_id, message_id, text, parse_mode='Markdown', reply_markup=keyboard)
         
         # Обработка кнопки "Помощь"
         elif data == 'help':
@@ -792,22 +839,16 @@ async def process_callback_query(callback_query):
                 "/help - Показать эту справку\n"
             )
             
-            keyboard = {
-                "inline_keyboard": [
-                    [{"text": "◀️ Назад в меню", "callback_data": "back_to_menu"}]
-                ]
-            }
-            
-            await send_message(chat_id, help_text, parse_mode='Markdown', reply_markup=keyboard)
+            keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
             
-            # Отвечаем на callback_query
-            await answer_callback_query(callback_query['id'])
+            await reply_in_place(chat_id, message_id, help_text, parse_mode='Markdown', reply_markup=keyboard)
         
         # Обработка кнопки "Я родитель"
         elif data == 'register_parent':
             # Переходим к регистрации родителя
-            await send_message(
+            await reply_in_place(
                 chat_id,
+                message_id,
                 "Вы хотите зарегистрироваться как родитель?\n\n"
                 "Введите пароль, который будет использоваться для входа в режим родителя:"
             )
@@ -815,50 +856,39 @@ async def process_callback_query(callback_query):
             # Сохраняем состояние для ожидания создания пароля
             await set_user_state(user_id, States.PARENT_PASSWORD, chat_id)
             await set_user_context(user_id, chat_id, 'registering_parent', True)
-
-            # Отвечаем на callback_query
-            await answer_callback_query(callback_query['id'])
         
         # Обработка кнопки "Назад в меню"
         elif data == 'back_to_menu':
-            await process_back_to_menu(chat_id, user_id)
-            
-            # Отвечаем на callback_query
-            await answer_callback_query(callback_query['id'])
+            await process_back_to_menu(chat_id, user_id, message_id)
         
         # Обработка кнопки "Добавить ребенка"
         elif data == 'add_child':
-            await send_message(
+            await reply_in_place(
                 chat_id,
+                message_id,
                 "👶 Введите имя ребенка, которого хотите добавить:"
             )
             await set_user_state(user_id, States.PARENT_ADD_CHILD, chat_id)
-            
-            await answer_callback_query(callback_query['id'])
         
         # Обработка кнопки "Просмотр статистики детей"
         elif data == 'view_children':
             try:
-                parent = await get_parent(user_id)
-                children = await get_parent_children(parent)
+                session = await aget_parent_session(user_id)
                 
-                if not children:
-                    keyboard = {
-                        "inline_keyboard": [
-                            [{"text": "➕ Добавить ребенка", "callback_data": "add_child"}],
-                            [{"text": "🏠 В главное меню", "callback_data": "exit_parent_mode"}]
-                        ]
-                    }
+                if not session.children:
+                    keyboard = markup_json(PARENT_MENU_NO_CHILDREN_KEYBOARD)
                     
-                    await send_message(
+                    await reply_in_place(
                         chat_id,
+                        message_id,
                         "У вас пока нет добавленных детей. Добавьте ребенка, чтобы видеть его статистику.",
                         reply_markup=keyboard
                     )
                     return
                 
                 text = "📊 *Статистика ваших детей:*\n\n"
-                for child in children:
+                # Баллы и дела меняются часто, поэтому их читаем из БД, а не из сессии
+                for child in await get_children_by_ids(session.child_ids):
                     recent_deeds = await get_recent_deeds(child, limit=3)
                     
                     text += f"👶 *{child.name}*: {child.total_points} баллов\n"
@@ -869,15 +899,11 @@ async def process_callback_query(callback_query):
                             text += f"• {deed.description}: {deed.points} баллов ({date_str})\n"
                     text += "\n"
                 
-                keyboard = {
-                    "inline_keyboard": [
-                        [{"text": "➕ Добавить доброе дело", "callback_data": "add_deed_to_child"}],
-                        [{"text": "◀️ Назад", "callback_data": "back_to_parent_menu"}]
-                    ]
-                }
+                keyboard = markup_json(CHILD_ACTIONS_KEYBOARD)
                 
-                await send_message(
+                await reply_in_place(
                     chat_id,
+                    message_id,
                     text,
                     parse_mode='Markdown',
                     reply_markup=keyboard
@@ -889,25 +915,18 @@ async def process_callback_query(callback_query):
                     chat_id,
                     "❌ Произошла ошибка. Пожалуйста, попробуйте еще раз."
                 )
-                
-            await answer_callback_query(callback_query['id'])
         
         # Обработка кнопки "Добавить доброе дело ребенку"
         elif data == 'add_deed_to_child':
             try:
-                parent = await get_parent(user_id)
-                children = await get_parent_children(parent)
+                session = await aget_parent_session(user_id)
                 
-                if not children:
-                    keyboard = {
-                        "inline_keyboard": [
-                            [{"text": "➕ Добавить ребенка", "callback_data": "add_child"}],
-                            [{"text": "🏠 В главное меню", "callback_data": "exit_parent_mode"}]
-                        ]
-                    }
+                if not session.children:
+                    keyboard = markup_json(PARENT_MENU_NO_CHILDREN_KEYBOARD)
                     
-                    await send_message(
+                    await reply_in_place(
                         chat_id,
+                        message_id,
                         "У вас пока нет добавленных детей. Добавьте ребенка, чтобы добавлять ему добрые дела.",
                         reply_markup=keyboard
                     )
@@ -915,13 +934,14 @@ async def process_callback_query(callback_query):
                 
                 # Создаем кнопки для выбора ребенка
                 keyboard = []
-                for child in children:
-                    keyboard.append([{"text": f"👶 {child.name}", "callback_data": f"select_child_{child.telegram_id}"}])
+                for child_id, child_name in session.children:
+                    keyboard.append([{"text": f"👶 {child_name}", "callback_data": f"select_child_{child_id}"}])
                 
                 keyboard.append([{"text": "◀️ Назад", "callback_data": "back_to_parent_menu"}])
                 
-                await send_message(
+                await reply_in_place(
                     chat_id,
+                    message_id,
                     "Выберите ребенка, которому хотите добавить доброе дело:",
                     reply_markup={"inline_keyboard": keyboard}
                 )
@@ -932,38 +952,31 @@ async def process_callback_query(callback_query):
                     chat_id,
                     "❌ Произошла ошибка. Пожалуйста, попробуйте еще раз."
                 )
-                
-            await answer_callback_query(callback_query['id'])
         
         # Обработка кнопки "В главное меню" из режима родителя
         elif data == 'exit_parent_mode':
-            await send_message(
+            await reply_in_place(
                 chat_id,
+                message_id,
                 "Вы вышли из режима родителя. Используйте /start для начала работы с ботом."
             )
             await reset_user_state_and_context(user_id, chat_id)
-            await answer_callback_query(callback_query['id'])
         
         # Обработка кнопки "Назад" в меню родителя
         elif data == 'back_to_parent_menu':
             try:
-                parent = await get_parent(user_id)
-                children = await get_parent_children(parent)
-                
-                keyboard = []
-                if children:
-                    keyboard.append([{"text": "➕ Добавить доброе дело ребенку", "callback_data": "add_deed_to_child"}])
-                    keyboard.append([{"text": "📊 Просмотр статистики детей", "callback_data": "view_children"}])
+                session = await aget_parent_session(user_id)
+                children = session.children
                 
-                keyboard.append([{"text": "➕ Добавить ребенка", "callback_data": "add_child"}])
-                keyboard.append([{"text": "🏠 В главное меню", "callback_data": "exit_parent_mode"}])
+                keyboard = markup_json(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
                 
-                await send_message(
+                await reply_in_place(
                     chat_id,
-                    f"👋 Здравствуйте, {parent.name}! Вы в режиме родителя.\n\n"
+                    message_id,
+                    f"👋 Здравствуйте, {session.name}! Вы в режиме родителя.\n\n"
                     f"У вас {len(children)} {'детей' if len(children) != 1 else 'ребенок'} в системе.\n\n"
                     "Выберите действие:",
-                    reply_markup={"inline_keyboard": keyboard}
+                    reply_markup=keyboard
                 )
                 
             except Exception as e:
@@ -972,22 +985,24 @@ async def process_callback_query(callback_query):
                     chat_id,
                     "❌ Произошла ошибка. Пожалуйста, попробуйте еще раз."
                 )
-                
-            await answer_callback_query(callback_query['id'])
         
         # Обработка выбора ребенка (формат: select_child_TELEGRAM_ID)
         elif data.startswith("select_child_"):
             try:
                 child_telegram_id = int(data.split("_")[-1])
-                child = await get_child(child_telegram_id)
+                session = await aget_parent_session(user_id)
+                child_name = session.child_name(child_telegram_id)
+                if child_name is None:
+                    raise ValueError(f"ребенок {child_telegram_id} не привязан к родителю {user_id}")
                 
                 # Сохраняем ID выбранного ребенка в контексте
                 await set_user_state(user_id, States.PARENT_ADD_DEED, chat_id)
-                await set_user_context(user_id, "selected_child_id", child_telegram_id)
+                await set_user_context(user_id, chat_id, "selected_child_id", child_telegram_id)
                 
-                await send_message(
+                await reply_in_place(
                     chat_id,
-                    f"Вы выбрали ребенка: *{child.name}*\n\n"
+                    message_id,
+                    f"Вы выбрали ребенка: *{child_name}*\n\n"
                     "Опишите доброе дело, которое совершил ребенок:",
                     parse_mode='Markdown'
                 )
@@ -1001,16 +1016,18 @@ async def process_callback_query(callback_query):
                     chat_id,
                     "❌ Произошла ошибка. Пожалуйста, попробуйте еще раз."
                 )
-                
-            await answer_callback_query(callback_query['id'])
         
         # Если не распознали callback_data
         else:
             logger.warning(f"Неизвестный callback_data: {data}")
-            await answer_callback_query(callback_query['id'], "Неизвестная команда")
         
     except Exception as e:
         logger.error(f"Ошибка при обработке callback_query: {e}")
+    finally:
+        # Под обычным Flask цикл событий живет только до конца запроса, поэтому
+        # дожидаемся подтверждения здесь; обычно к этому моменту оно уже отправлено
+        if answer is not None:
+            await answer
 
 # Дополнительные функции обработки команд
 async def process_points_command(chat_id, user_id):
@@ -1020,17 +1037,14 @@ async def process_points_command(chat_id, user_id):
         recent_deeds = await get_recent_deeds(child)
 
         text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+        text += format_progress(*await atake_progress(child.pk))
         if recent_deeds:
             text += "📋 *Твои последние добрые дела:*\n"
             for deed in recent_deeds:
                 date_str = deed.created_at.strftime("%d.%m.%Y")
                 text += f"• {deed.description}: *{deed.points} баллов* ({date_str})\n"
 
-        keyboard = {
-            "inline_keyboard": [
-                [{"text": "◀️ Назад в меню", "callback_data": "back_to_menu"}]
-            ]
-        }
+        keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
 
         await send_message(chat_id, text, parse_mode='Markdown', reply_markup=keyboard)
     except Exception as e:
@@ -1044,10 +1058,7 @@ async def process_rewards_command(chat_id, user_id):
 
         if not rewards:
             text = "Пока в базе нет доступных наград. Но ты можешь копить на:\n\n"
-            text += f"• *Обычная игрушка*: 1000 баллов\n"
-            text += f"• *Приставка на выходные*: 3000 баллов\n"
-            text += f"• *Крутая игрушка*: 5000 баллов\n"
-            text += f"• *Nintendo Switch*: 35000 баллов\n"
+            text += FALLBACK_REWARDS_TEXT
         else:
             text = "🎁 *Доступные награды:*\n\n"
             for reward in rewards:
@@ -1056,11 +1067,7 @@ async def process_rewards_command(chat_id, user_id):
                     text += f" - {reward.description}"
                 text += "\n"
 
-        keyboard = {
-            "inline_keyboard": [
-                [{"text": "◀️ Назад в меню", "callback_data": "back_to_menu"}]
-            ]
-        }
+        keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
 
         await send_message(chat_id, text, parse_mode='Markdown', reply_markup=keyboard)
     except Exception as e:
@@ -1072,7 +1079,18 @@ async def process_parent_command(chat_id, user_id):
     try:
         parent, is_parent = await verify_parent(user_id)
 
-        if is_parent:
+        if is_parent and recently_verified(parent):
+            # Пароль вводили недавно: сразу открываем меню, без повторного хеширования
+            children = (await aget_parent_session(parent.pk)).children
+            await send_message(
+                chat_id,
+                f"👋 Здравствуйте, {parent.name}! Вы в режиме родителя.\n\n"
+                f"У вас {len(children)} {'детей' if len(children) != 1 else 'ребенок'} в системе.\n\n"
+                "Выберите действие:",
+                reply_markup=markup_json(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
+            )
+            await set_user_state(user_id, States.PARENT_MENU, chat_id)
+        elif is_parent:
             await send_message(
                 chat_id,
                 f"Здравствуйте, {parent.name}! Для доступа к режиму родителя, пожалуйста, введите пароль:"
@@ -1093,8 +1111,8 @@ async def process_parent_command(chat_id, user_id):
         logger.error(f"Ошибка при обработке команды parent: {e}")
         await send_message(chat_id, "Произошла ошибка. Пожалуйста, начните сначала с /start")
 
-async def process_back_to_menu(chat_id, user_id):
-    """Возврат в главное меню"""
+async def process_back_to_menu(chat_id, user_id, message_id=None):
+    """Возврат в главное меню (при нажатии кнопки - в том же сообщении)"""
     try:
         child = await get_child(user_id)
 
@@ -1104,27 +1122,86 @@ async def process_back_to_menu(chat_id, user_id):
             "Выбери действие:"
         )
 
-        keyboard = {
-            "inline_keyboard": [
-                [{"text": "📝 Добавить доброе дело", "callback_data": "add_deed"}],
-                [{"text": "🌟 Мои баллы", "callback_data": "check_points"}],
-                [{"text": "🎁 Посмотреть награды", "callback_data": "view_rewards"}],
-                [{"text": "❓ Помощь", "callback_data": "help"}],
-                [{"text": "👨‍👩‍👧‍👦 Я родитель", "callback_data": "register_parent"}]
-            ]
-        }
+        keyboard = markup_json(MAIN_MENU_KEYBOARD)
 
-        await send_message(chat_id, text, parse_mode='Markdown', reply_markup=keyboard)
+        await reply_in_place(chat_id, message_id, text, parse_mode='Markdown', reply_markup=keyboard)
 
         # Сбрасываем состояние
         user_states[user_id] = States.IDLE
     except Exception as e:
         logger.error(f"Ошибка при возврате в меню: {e}")
 
+# Отпечатки последнего отрисованного содержимого сообщений с кнопками:
+# {(бот, chat_id): OrderedDict(message_id -> hash)}. Если содержимое не изменилось,
+# editMessageText не вызываем: Telegram все равно ответил бы "message is not modified".
+# Кэш живет в памяти процесса, поэтому верен только при одном процессе: другой
+# воркер мог уже отредактировать сообщение, и пропуск оставил бы в чате старый
+# текст. Он включается явно (BOT_RENDER_CACHE=1) и выключается при
+# WEB_CONCURRENCY > 1; без него правка отправляется всегда, а ответ
+# "message is not modified" считается успехом.
+RENDER_CACHE = os.environ.get('BOT_RENDER_CACHE') == '1'
+if RENDER_CACHE and int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+    logger.error("BOT_RENDER_CACHE верен только для одного процесса, при WEB_CONCURRENCY > 1 он выключен")
+    RENDER_CACHE = False
+rendered_messages = OrderedDict()
+rendered_messages_lock = threading.Lock()
+RENDERED_CHATS_LIMIT = 10000
+RENDERED_MESSAGES_PER_CHAT = 8
+
+def render_hash(text, parse_mode=None, reply_markup=None):
+    if reply_markup is not None and not isinstance(reply_markup, str):
+        reply_markup = json.dumps(reply_markup, ensure_ascii=False, sort_keys=True)
+    return hash((text, parse_mode, reply_markup))
+
+def remember_render(chat_id, message_id, digest):
+    if not RENDER_CACHE:
+        return
+    # У разных ботов одинаковые chat_id и message_id - это разные сообщения
+    key = (current_bot().name, chat_id)
+    with rendered_messages_lock:
+        messages = rendered_messages.get(key)
+        if messages is None:
+            messages = rendered_messages[key] = OrderedDict()
+            if len(rendered_messages) > RENDERED_CHATS_LIMIT:
+                rendered_messages.popitem(last=False)
+        else:
+            rendered_messages.move_to_end(key)
+
+        messages[message_id] = digest
+        messages.move_to_end(message_id)
+        if len(messages) > RENDERED_MESSAGES_PER_CHAT:
+            messages.popitem(last=False)
+
+def is_rendered(chat_id, message_id, digest):
+    if not RENDER_CACHE:
+        return False
+    with rendered_messages_lock:
+        return rendered_messages.get((current_bot().name, chat_id), {}).get(message_id) == digest
+
+async def reply_in_place(chat_id, message_id, text, parse_mode=None, reply_markup=None):
+    """Ответ на нажатие кнопки: редактирует сообщение с кнопками вместо отправки нового"""
+    if message_id is None:
+        return await send_message(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+
+    digest = render_hash(text, parse_mode, reply_markup)
+    if is_rendered(chat_id, message_id, digest):
+        logger.info(f"Сообщение {message_id} в чате {chat_id} не изменилось, редактирование пропущено")
+        return None
+
+    response_json = await edit_message(chat_id, message_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+    if response_json and (
+        response_json.get('ok') or 'message is not modified' in response_json.get('description', '')
+    ):
+        remember_render(chat_id, message_id, digest)
+        return response_json
+
+    # Сообщение нельзя отредактировать (слишком старое, без текста и т.п.) - отправляем новое
+    logger.info(f"Не удалось отредактировать сообщение {message_id}: {response_json}")
+    return await send_message(chat_id, text, parse_mode=parse_mode, reply_markup=reply_markup)
+
 # Функции для работы с Telegram API
 async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
     """Функция для отправки сообщений"""
-    url = f"https://api.telegram.org/bot{TOKEN}/sendMessage"
 
     payload = {
         'chat_id': chat_id,
@@ -1137,17 +1214,28 @@ async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
     if reply_markup:
        payload['reply_markup'] = reply_markup
 
-    try:
-        # Используем sync_to_async для выполнения синхронного запроса в асинхронной функции
-        @sync_to_async
-        def do_request():
-            return requests.post(url, json=payload)
+    batch = current_batch()
+    if batch is not None:
+        # Отправится в конце обработки update, возможно вместе с соседними сообщениями
+        batch.add(payload)
+        return None
 
-        response = await do_request()
-        response_json = response.json()
+    return await deliver_message(payload)
+
+async def deliver_message(payload):
+    """Отправка sendMessage без очереди"""
+    try:
+        response_json = await bot_api('sendMessage', payload)
 
         if not response_json.get('ok'):
             logger.error(f"Ошибка при отправке сообщения: {response_json}")
+        elif payload.get('reply_markup'):
+            # Запоминаем содержимое: следующее нажатие кнопки в этом сообщении его отредактирует
+            remember_render(
+                payload['chat_id'],
+                response_json['result']['message_id'],
+                render_hash(payload['text'], payload.get('parse_mode'), payload['reply_markup']),
+            )
 
         return response_json
     except Exception as e:
@@ -1156,7 +1244,6 @@ async def send_message(chat_id, text, parse_mode=None, reply_markup=None):
 
 async def edit_message(chat_id, message_id, text, parse_mode=None, reply_markup=None):
     """Функция для редактирования сообщений"""
-    url = f"https://api.telegram.org/bot{TOKEN}/editMessageText"
 
     payload = {
         'chat_id': chat_id,
@@ -1170,20 +1257,20 @@ async def edit_message(chat_id, message_id, text, parse_mode=None, reply_markup=
     if reply_markup:
         payload['reply_markup'] = reply_markup
 
-    try:
-        @sync_to_async
-        def do_request():
-            return requests.post(url, json=payload)
+    # Сообщения, ожидающие в очереди, должны появиться в чате раньше правки
+    batch = current_batch()
+    if batch is not None:
+        for pending in batch.drain():
+            await deliver_message(pending)
 
-        response = await do_request()
-        return response.json()
+    try:
+        return await bot_api('editMessageText', payload)
     except Exception as e:
         logger.error(f"Ошибка при редактировании сообщения: {e}")
         return None
 
 async def answer_callback_query(callback_query_id, text=None):
     """Функция для ответа на callback_query"""
-    url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
 
     payload = {
         'callback_query_id': callback_query_id
@@ -1193,21 +1280,64 @@ async def answer_callback_query(callback_query_id, text=None):
         payload['text'] = text
 
     try:
-        @sync_to_async
-        def do_request():
-            return requests.post(url, json=payload)
-
-        response = await do_request()
-        return response.json()
+        return await bot_api('answerCallbackQuery', payload)
     except Exception as e:
         logger.error(f"Ошибка при ответе на callback_query: {e}")
         return None
 
+# Метрики подтверждения нажатий кнопок
+callback_answer_stats = {'answered': 0, 'failed': 0, 'total_ms': 0.0, 'max_ms': 0.0}
+
+def start_answer_callback_query(callback_query_id, text=None):
+    """Запускает answerCallbackQuery в фоне и возвращает задачу"""
+    return asyncio.create_task(answer_callback_query_tracked(callback_query_id, text))
+
+async def answer_callback_query_tracked(callback_query_id, text=None):
+    started = time.perf_counter()
+    response_json = await answer_callback_query(callback_query_id, text)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if response_json and response_json.get('ok'):
+        callback_answer_stats['answered'] += 1
+        callback_answer_stats['total_ms'] += elapsed_ms
+        callback_answer_stats['max_ms'] = max(callback_answer_stats['max_ms'], elapsed_ms)
+    else:
+        callback_answer_stats['failed'] += 1
+        logger.warning(f"Не удалось подтвердить нажатие кнопки {callback_query_id}: {response_json}")
+
+@app.route('/callback_status', methods=['GET'])
+def callback_status():
+    if not diagnostics_enabled():
+        abort(404)
+    answered = callback_answer_stats['answered']
+    return jsonify({
+        'status': 'success',
+        'answered': answered,
+        'failed': callback_answer_stats['failed'],
+        'avg_ms': callback_answer_stats['total_ms'] / answered if answered else 0.0,
+        'max_ms': callback_answer_stats['max_ms'],
+    })
+
+@app.route('/outbound_status', methods=['GET'])
+def outbound_status():
+    if not diagnostics_enabled():
+        abort(404)
+    # Сколько sendMessage запросили обработчики и сколько ушло после склейки
+    return jsonify({'status': 'success', **outbound_stats})
+
+def selected_bot():
+    """Бот из параметра ?bot=имя служебных маршрутов webhook (по умолчанию - первый)"""
+    try:
+        return get_bot(request.args.get('bot'))
+    except KeyError:
+        abort(404)
+
 # Маршрут для установки webhook
 @app.route('/set_webhook', methods=['GET'])
 def set_webhook():
-    webhook_url = f"https://{request.host}/{TOKEN}"
-    url = f"https://api.telegram.org/bot{TOKEN}/setWebhook?url={webhook_url}"
+    bot = selected_bot()
+    webhook_url = f"https://{request.host}{bot.webhook_path}"
+    url = f"https://api.telegram.org/bot{bot.token}/setWebhook?url={webhook_url}"
 
     response = requests.get(url)
     data = response.json()
@@ -1228,7 +1358,7 @@ def set_webhook():
 # Маршрут для удаления webhook
 @app.route('/remove_webhook', methods=['GET'])
 def remove_webhook():
-    url = f"https://api.telegram.org/bot{TOKEN}/deleteWebhook"
+    url = f"https://api.telegram.org/bot{selected_bot().token}/deleteWebhook"
     response = requests.get(url)
     data = response.json()
 
@@ -1241,7 +1371,7 @@ def remove_webhook():
 # Маршрут для проверки статуса webhook
 @app.route('/webhook_status', methods=['GET'])
 def webhook_status():
-    url = f"https://api.telegram.org/bot{TOKEN}/getWebhookInfo"
+    url = f"https://api.telegram.org/bot{selected_bot().token}/getWebhookInfo"
     response = requests.get(url)
     data = response.json()
 
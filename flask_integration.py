@@ -1,15 +1,9 @@
 from flask import Flask, request, jsonify
 import os
-import django
 import logging
 import json
-from dotenv import load_dotenv
-import asyncio
-from telebot.async_telebot import AsyncTeleBot
-from telebot import types
 
-# Импортируем бота из telebot_app.py
-from telebot_app import bot
+from bot.bootstrap import lazy_startup, load_env, run_once
 
 # Настройка логгирования
 logging.basicConfig(
@@ -23,21 +17,35 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Загрузка переменных окружения
-load_dotenv()
+load_env()
 
-# Настройка Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
-django.setup()
+# Бот из telebot_app.py; импорт telebot_app настраивает Django
+bot = None
+types = None
+
+def _import_bot():
+    global bot, types
+    from telebot import types
+    from telebot_app import bot
+
+def load_bot():
+    run_once('flask_integration', _import_bot)
 
 # Создаем Flask-приложение
 app = Flask(__name__)
 
-# Получаем TOKEN из telebot_app
-TOKEN = bot.token
+# Тот же токен, что использует telebot_app
+TOKEN = os.environ.get('TELEGRAM_TOKEN')
+
+# При BOT_LAZY_STARTUP=1 telebot и Django загружаются первым запросом (bot/bootstrap.py)
+if lazy_startup():
+    app.before_request(load_bot)
+else:
+    load_bot()
 
 # Обработка webhook-запросов от Telegram
 @app.route(f'/{TOKEN}', methods=['POST'])
-async def webhook():
+def webhook():
     try:
         if request.headers.get('content-type') == 'application/json':
             update = request.get_json()
@@ -46,8 +54,8 @@ async def webhook():
             # Создание объекта Update
             telegram_update = types.Update.de_json(update)
             
-            # Создаем задачу для асинхронной обработки
-            asyncio.create_task(bot.process_new_updates([telegram_update]))
+            # bot из telebot_app - синхронный TeleBot, обрабатываем обновление сразу.
+            bot.process_new_updates([telegram_update])
             
             return jsonify({'status': 'ok'})
         else:
@@ -58,11 +66,11 @@ async def webhook():
 
 # Маршрут для установки webhook
 @app.route('/set_webhook', methods=['GET'])
-async def set_webhook():
+def set_webhook():
     webhook_url = f"https://{request.host}/{TOKEN}"
     try:
-        await bot.remove_webhook()
-        await bot.set_webhook(url=webhook_url)
+        bot.remove_webhook()
+        bot.set_webhook(url=webhook_url)
         return jsonify({
             'status': 'success',
             'message': f'Webhook установлен на {webhook_url}'
@@ -73,9 +81,9 @@ async def set_webhook():
 
 # Маршрут для удаления webhook
 @app.route('/remove_webhook', methods=['GET'])
-async def remove_webhook():
+def remove_webhook():
     try:
-        await bot.remove_webhook()
+        bot.remove_webhook()
         return jsonify({
             'status': 'success',
             'message': 'Webhook удален'
@@ -86,9 +94,9 @@ async def remove_webhook():
 
 # Маршрут для проверки статуса webhook
 @app.route('/webhook_status', methods=['GET'])
-async def webhook_status():
+def webhook_status():
     try:
-        info = await bot.get_webhook_info()
+        info = bot.get_webhook_info()
         return jsonify({
             'status': 'success',
             'webhook_info': {
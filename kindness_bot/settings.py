@@ -68,9 +68,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: читатели не блокируют писателя и наоборот
+            'init_command': 'PRAGMA journal_mode=WAL;',
+            # Транзакции сразу берут блокировку записи: транзакция, начавшая с чтения
+            # (журнал баллов, прогресс), иначе не может перейти к записи, если другой
+            # писатель успел закоммитить, и сразу падает с "database is locked"
+            'transaction_mode': 'IMMEDIATE',
+        },
+        # Тесты с потоками нужен файл: общая база в памяти не ждет снятия блокировок
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
+# Соединение только для чтения для экранов баллов, наград и статистики (bot/db_router.py).
+# Для SQLite - тот же файл, открытый по URI в режиме ro; для PostgreSQL здесь
+# указываются параметры реплики. Включается явно DB_READ_REPLICA=1, по умолчанию
+# все читается из default: реплика может отставать, а липкость после записи
+# (STICKY_SECONDS) действует только в пределах процесса.
+if os.environ.get('DB_READ_REPLICA') == '1':
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"file:{DATABASES['default']['NAME']}?mode=ro",
+        'OPTIONS': {'uri': True},
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_ROUTERS = ['bot.db_router.ReadReplicaRouter']
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -1,22 +1,44 @@
 import telebot
 from telebot import types
-from telebot.storage import StateMemoryStorage
-from telebot.handler_backends import State, StatesGroup
+from telebot.handler_backends import BaseMiddleware, State, StatesGroup
 import os
+import atexit
+import threading
 import django
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, abort, request, jsonify
+
+from bot.bootstrap import diagnostics_enabled, setup_django
 
 # Настройка логгирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Настройка Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
-django.setup()
+# Настройка Django (и переменные окружения из .env)
+setup_django()
 
 # Импорт моделей
 from bot.models import Child, KindDeed, Reward, Parent
+from bot.children import find_child_by_name, remember_parent_children
+from bot.db_router import read_replica
+from bot.passwords import hash_password, mark_verified, verify_parent_password
+from bot.ledger import add_points
+from bot.progress import format_progress, take_progress
+from bot.recording import record_update
+from bot.outbound import current_batch, finish_batch, start_batch
+from bot.keyboards import (
+    BACK_TO_MENU_KEYBOARD,
+    CHILD_ACTIONS_KEYBOARD,
+    DEED_ADDED_KEYBOARD,
+    FALLBACK_REWARDS_TEXT,
+    MAIN_MENU_KEYBOARD,
+    PARENT_MENU_KEYBOARD,
+    PARENT_MENU_NO_CHILDREN_KEYBOARD,
+    PARENT_MENU_WITH_CHILDREN_KEYBOARD,
+    markup_json,
+)
+from bot.telebot_pool import ChatSerialExecutor, update_chat_key
+from bot.telebot_storage import DjangoStateStorage, state_cache_ttl
 
 # Определение состояний бота
 class BotStates(StatesGroup):
@@ -34,8 +56,79 @@ TOKEN = os.environ.get('TELEGRAM_TOKEN')
 if not TOKEN:
     logger.error("Токен Telegram не найден в переменных окружения.")
 
-# Создание бота с хранилищем состояний
-bot = telebot.TeleBot(TOKEN, state_storage=StateMemoryStorage())
+# Режим обработки webhook:
+#   inline - update обрабатывается внутри запроса Flask (как раньше)
+#   pool   - update ставится в ограниченный пул потоков, ответ Telegram уходит сразу
+EXECUTION_MODE = os.environ.get('TELEBOT_EXECUTION_MODE', 'inline')
+if EXECUTION_MODE not in ('inline', 'pool'):
+    logger.error(f"Неизвестный режим TELEBOT_EXECUTION_MODE={EXECUTION_MODE}, используется inline")
+    EXECUTION_MODE = 'inline'
+
+update_pool = None
+if EXECUTION_MODE == 'pool':
+    update_pool = ChatSerialExecutor(
+        max_workers=int(os.environ.get('TELEBOT_POOL_WORKERS', 8)),
+        max_pending=int(os.environ.get('TELEBOT_POOL_MAX_PENDING', 256)),
+    )
+    atexit.register(update_pool.shutdown)
+
+# Состояния хранятся в БД, поэтому переживают перезапуск и общие для всех воркеров
+# gunicorn; TELEBOT_STATE_CACHE_TTL - сколько секунд состояние живет в кэше процесса
+# (только при одном процессе, при WEB_CONCURRENCY > 1 кэш выключен).
+state_storage = DjangoStateStorage(cache_ttl=state_cache_ttl())
+
+class CoalescingTeleBot(telebot.TeleBot):
+    """TeleBot, склеивающий подряд идущие сообщения одного update в один чат (см. bot/outbound.py)"""
+
+    def send_message(self, chat_id, text, *args, parse_mode=None, reply_markup=None, **kwargs):
+        batch = current_batch()
+        if batch is None or args or kwargs:
+            self.flush_outbound()
+            return super().send_message(chat_id, text, *args, parse_mode=parse_mode, reply_markup=reply_markup, **kwargs)
+
+        payload = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        if reply_markup:
+            payload['reply_markup'] = reply_markup
+        batch.add(payload)
+
+    def edit_message_text(self, *args, **kwargs):
+        # Сообщения, ожидающие в очереди, должны появиться в чате раньше правки
+        self.flush_outbound()
+        return super().edit_message_text(*args, **kwargs)
+
+    def flush_outbound(self):
+        batch = current_batch()
+        if batch is not None:
+            for payload in batch.drain():
+                super().send_message(**payload)
+
+class OutboundBatchMiddleware(BaseMiddleware):
+    """Открывает очередь исходящих сообщений на время обработки update"""
+
+    def __init__(self, bot):
+        super().__init__()
+        self.update_types = ['message', 'callback_query']
+        self.bot = bot
+        # pre_process и post_process одного update выполняются в одном потоке
+        self._tokens = threading.local()
+
+    def pre_process(self, message, data):
+        self._tokens.value = start_batch()
+
+    def post_process(self, message, data, exception):
+        batch = finish_batch(self._tokens.value)
+        for payload in batch.drain():
+            self.bot.send_message(**payload)
+
+# Создание бота с хранилищем состояний.
+# В режиме pool обработчики выполняются прямо в потоке пула (threaded=False),
+# иначе TeleBot передал бы их в свой внутренний пул и порядок внутри чата потерялся бы.
+bot = CoalescingTeleBot(
+    TOKEN, state_storage=state_storage, threaded=update_pool is None, use_class_middlewares=True
+)
+bot.setup_middleware(OutboundBatchMiddleware(bot))
 
 # Создание Flask приложения
 app = Flask(__name__)
@@ -51,10 +144,12 @@ def get_child(telegram_id):
     return Child.objects.get(telegram_id=telegram_id)
 
 def get_recent_deeds(child, limit=5):
-    return list(child.deeds.order_by('-created_at')[:limit])
+    with read_replica(child.pk):
+        return list(child.deeds.order_by('-created_at')[:limit])
 
 def get_rewards():
-    return list(Reward.objects.all().order_by('points_required'))
+    with read_replica():
+        return list(Reward.objects.all().order_by('points_required'))
 
 def create_deed(child, description, points, parent=None):
     return KindDeed.objects.create(
@@ -65,9 +160,7 @@ def create_deed(child, description, points, parent=None):
     )
 
 def update_child_points(child, points):
-    child.total_points += points
-    child.save()
-    return child.total_points
+    return add_points(child, points)
 
 def get_or_create_parent(telegram_id, name):
     return Parent.objects.get_or_create(
@@ -82,29 +175,20 @@ def get_parent(telegram_id):
     except Parent.DoesNotExist:
         return None, False
 
-def get_child_by_name(name):
-    try:
-        return Child.objects.get(name=name)
-    except Child.DoesNotExist:
-        return None
-    except Child.MultipleObjectsReturned:
-        return Child.objects.filter(name=name).first()
+def get_child_by_name(name, parent=None):
+    # Без учета регистра и ё/е; при совпадении имен дети родителя идут первыми
+    return find_child_by_name(name, parent)
 
 def set_parent_password(parent, password):
-    import hashlib
-    # Простое хеширование пароля
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    parent.password = hashed_password
+    parent.password = hash_password(password)
     parent.save()
+    mark_verified(parent)
     return parent
 
-def verify_parent_password(parent, password):
-    import hashlib
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    return parent.password == hashed_password
-
 def get_parent_children(parent):
-    return list(parent.children.all())
+    children = list(parent.children.all())
+    remember_parent_children(parent.pk, children)
+    return children
 
 def add_child_to_parent(parent, child):
     parent.children.add(child)
@@ -128,12 +212,7 @@ def start_command(message):
         )
         
         # Создаем клавиатуру с кнопками
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton("📝 Добавить доброе дело", callback_data="add_deed"))
-        keyboard.add(types.InlineKeyboardButton("🌟 Мои баллы", callback_data="check_points"))
-        keyboard.add(types.InlineKeyboardButton("🎁 Посмотреть награды", callback_data="view_rewards"))
-        keyboard.add(types.InlineKeyboardButton("❓ Помощь", callback_data="help"))
-        keyboard.add(types.InlineKeyboardButton("👨‍👩‍👧‍👦 Я родитель", callback_data="register_parent"))
+        keyboard = markup_json(MAIN_MENU_KEYBOARD)
         
         # Устанавливаем состояние IDLE
         bot.set_state(user_id, BotStates.IDLE, message.chat.id)
@@ -174,8 +253,7 @@ def help_command(message):
         "Делай больше добрых дел и получай награды! 🎉"
     )
     
-    keyboard = types.InlineKeyboardMarkup()
-    keyboard.add(types.InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu"))
+    keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
     
     bot.send_message(
         message.chat.id, 
@@ -204,14 +282,14 @@ def points_command(message):
         recent_deeds = get_recent_deeds(child)
         
         text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+        text += format_progress(*take_progress(child.pk))
         if recent_deeds:
             text += "📋 *Твои последние добрые дела:*\n"
             for deed in recent_deeds:
                 date_str = deed.created_at.strftime("%d.%m.%Y")
                 text += f"• {deed.description}: *{deed.points} баллов* ({date_str})\n"
         
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu"))
+        keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
         
         bot.send_message(
             chat_id,
@@ -232,10 +310,7 @@ def rewards_command(message):
         
         if not rewards:
             text = "Пока в базе нет доступных наград. Но ты можешь копить на:\n\n"
-            text += f"• *Обычная игрушка*: 1000 баллов\n"
-            text += f"• *Приставка на выходные*: 3000 баллов\n"
-            text += f"• *Крутая игрушка*: 5000 баллов\n"
-            text += f"• *Nintendo Switch*: 35000 баллов\n"
+            text += FALLBACK_REWARDS_TEXT
         else:
             text = "🎁 *Доступные награды:*\n\n"
             for reward in rewards:
@@ -244,8 +319,7 @@ def rewards_command(message):
                     text += f" - {reward.description}"
                 text += "\n"
         
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu"))
+        keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
         
         bot.send_message(
             chat_id,
@@ -345,9 +419,7 @@ def process_deed_points(message):
         total_points = update_child_points(child, points)
         
         # Создаем клавиатуру для следующих действий
-        keyboard = types.InlineKeyboardMarkup()
-        keyboard.add(types.InlineKeyboardButton("📝 Добавить еще доброе дело", callback_data="add_deed"))
-        keyboard.add(types.InlineKeyboardButton("🏠 Вернуться в меню", callback_data="back_to_menu"))
+        keyboard = markup_json(DEED_ADDED_KEYBOARD)
         
         # Отправляем сообщение об успешном добавлении
         bot.send_message(
@@ -382,10 +454,7 @@ def process_parent_password(message):
             set_parent_password(parent, password)
             
             # Создаем клавиатуру для меню родителя
-            keyboard = types.InlineKeyboardMarkup()
-            keyboard.add(types.InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child"))
-            keyboard.add(types.InlineKeyboardButton("📊 Просмотр статистики детей", callback_data="view_children"))
-            keyboard.add(types.InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode"))
+            keyboard = markup_json(PARENT_MENU_KEYBOARD)
             
             bot.send_message(
                 chat_id,
@@ -407,13 +476,7 @@ def process_parent_password(message):
                     children = get_parent_children(parent_obj)
                     
                     # Создаем клавиатуру для меню родителя
-                    keyboard = types.InlineKeyboardMarkup()
-                    if children:
-                        keyboard.add(types.InlineKeyboardButton("➕ Добавить доброе дело ребенку", callback_data="add_deed_to_child"))
-                        keyboard.add(types.InlineKeyboardButton("📊 Просмотр статистики детей", callback_data="view_children"))
-                    
-                    keyboard.add(types.InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child"))
-                    keyboard.add(types.InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode"))
+                    keyboard = markup_json(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
                     
                     bot.send_message(
                         chat_id,
@@ -453,7 +516,7 @@ def process_add_child(message):
         parent_obj, is_parent = get_parent(user_id)
         if is_parent:
             # Проверяем, существует ли ребенок с таким именем
-            child = get_child_by_name(child_name)
+            child = get_child_by_name(child_name, parent_obj)
             
             if child:
                 # Если ребенок найден, привязываем его к родителю
@@ -611,14 +674,14 @@ def callback_handler(call):
                 recent_deeds = get_recent_deeds(child)
                 
                 text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+                text += format_progress(*take_progress(child.pk))
                 if recent_deeds:
                     text += "📋 *Твои последние добрые дела:*\n"
                     for deed in recent_deeds:
                         date_str = deed.created_at.strftime("%d.%m.%Y")
                         text += f"• {deed.description}: *{deed.points} баллов* ({date_str})\n"
                 
-                keyboard = types.InlineKeyboardMarkup()
-                keyboard.add(types.InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu"))
+                keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
                 
                 bot.edit_message_text(
                     text,
@@ -639,10 +702,7 @@ def callback_handler(call):
                 
                 if not rewards:
                    text = "Пока в базе нет доступных наград. Но ты можешь копить на:\n\n"
-                   text += f"• *Обычная игрушка*: 1000 баллов\n"
-                   text += f"• *Приставка на выходные*: 3000 баллов\n"
-                   text += f"• *Крутая игрушка*: 5000 баллов\n"
-                   text += f"• *Nintendo Switch*: 35000 баллов\n"
+                   text += FALLBACK_REWARDS_TEXT
                 else:
                     text = "🎁 *Доступные награды:*\n\n"
                     for reward in rewards:
@@ -651,8 +711,7 @@ def callback_handler(call):
                             text += f" - {reward.description}"
                         text += "\n"
                
-                keyboard = types.InlineKeyboardMarkup()
-                keyboard.add(types.InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu"))
+                keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
                
                 bot.edit_message_text(
                     text,
@@ -685,8 +744,7 @@ def callback_handler(call):
                 "/help - Показать эту справку\n"
             )
            
-            keyboard = types.InlineKeyboardMarkup()
-            keyboard.add(types.InlineKeyboardButton("◀️ Назад в меню", callback_data="back_to_menu"))
+            keyboard = markup_json(BACK_TO_MENU_KEYBOARD)
            
             try:
                 bot.edit_message_text(
@@ -760,9 +818,7 @@ def callback_handler(call):
                     children = get_parent_children(parent_obj)
                    
                     if not children:
-                        keyboard = types.InlineKeyboardMarkup()
-                        keyboard.add(types.InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child"))
-                        keyboard.add(types.InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode"))
+                        keyboard = markup_json(PARENT_MENU_NO_CHILDREN_KEYBOARD)
                        
                         bot.send_message(
                             chat_id,
@@ -782,9 +838,7 @@ def callback_handler(call):
                                     text += f"• {deed.description}: {deed.points} баллов ({date_str})\n"
                             text += "\n"
                        
-                        keyboard = types.InlineKeyboardMarkup()
-                        keyboard.add(types.InlineKeyboardButton("➕ Добавить доброе дело", callback_data="add_deed_to_child"))
-                        keyboard.add(types.InlineKeyboardButton("◀️ Назад", callback_data="back_to_parent_menu"))
+                        keyboard = markup_json(CHILD_ACTIONS_KEYBOARD)
                        
                         bot.send_message(
                             chat_id,
@@ -813,9 +867,7 @@ def callback_handler(call):
                     children = get_parent_children(parent_obj)
                    
                     if not children:
-                        keyboard = types.InlineKeyboardMarkup()
-                        keyboard.add(types.InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child"))
-                        keyboard.add(types.InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode"))
+                        keyboard = markup_json(PARENT_MENU_NO_CHILDREN_KEYBOARD)
                        
                         bot.send_message(
                             chat_id,
@@ -881,13 +933,7 @@ def callback_handler(call):
                     children = get_parent_children(parent_obj)
                    
                     # Создаем клавиатуру для меню родителя
-                    keyboard = types.InlineKeyboardMarkup()
-                    if children:
-                        keyboard.add(types.InlineKeyboardButton("➕ Добавить доброе дело ребенку", callback_data="add_deed_to_child"))
-                        keyboard.add(types.InlineKeyboardButton("📊 Просмотр статистики детей", callback_data="view_children"))
-                   
-                    keyboard.add(types.InlineKeyboardButton("➕ Добавить ребенка", callback_data="add_child"))
-                    keyboard.add(types.InlineKeyboardButton("🏠 В главное меню", callback_data="exit_parent_mode"))
+                    keyboard = markup_json(PARENT_MENU_WITH_CHILDREN_KEYBOARD if children else PARENT_MENU_NO_CHILDREN_KEYBOARD)
                    
                     bot.send_message(
                         chat_id,
@@ -933,12 +979,7 @@ def callback_handler(call):
                 )
                
                 # Создаем клавиатуру с кнопками
-                keyboard = types.InlineKeyboardMarkup()
-                keyboard.add(types.InlineKeyboardButton("📝 Добавить доброе дело", callback_data="add_deed"))
-                keyboard.add(types.InlineKeyboardButton("🌟 Мои баллы", callback_data="check_points"))
-                keyboard.add(types.InlineKeyboardButton("🎁 Посмотреть награды", callback_data="view_rewards"))
-                keyboard.add(types.InlineKeyboardButton("❓ Помощь", callback_data="help"))
-                keyboard.add(types.InlineKeyboardButton("👨‍👩‍👧‍👦 Я родитель", callback_data="register_parent"))
+                keyboard = markup_json(MAIN_MENU_KEYBOARD)
                
                 bot.edit_message_text(
                     text,
@@ -979,19 +1020,45 @@ def handle_all_messages(message):
             "Чтобы начать работу с ботом, используйте команду /start."
         )
 
+def awaiting_password(update):
+    """Ждет ли бот от автора сообщения пароль родителя: такой текст не пишется в журнал update"""
+    message = update.get('message') or update.get('edited_message')
+    if not message or 'from' not in message:
+        return False
+    return bot.get_state(message['from']['id'], message['chat']['id']) == BotStates.PARENT_PASSWORD.name
+
 # Маршруты Flask для webhook
 @app.route(f'/{TOKEN}', methods=['POST'])
 def webhook():
     if request.headers.get('content-type') == 'application/json':
         update = request.get_json()
         logger.info(f"Получен update: {update}")
+        record_update(update, secret=awaiting_password(update))
        
-        # Обработка входящего обновления от Telegram
-        bot.process_new_updates([telebot.types.Update.de_json(update)])
+        if update_pool is None:
+            # Обработка входящего обновления от Telegram
+            bot.process_new_updates([telebot.types.Update.de_json(update)])
+            return jsonify({'status': 'ok'})
+
+        if not update_pool.submit(update_chat_key(update), process_update, update):
+            # Пул переполнен: код, отличный от 2xx, заставит Telegram повторить доставку позже
+            logger.warning(f"Пул обработчиков переполнен, update {update.get('update_id')} отклонен")
+            return jsonify({'status': 'busy'}), 503
         return jsonify({'status': 'ok'})
     else:
         return jsonify({'status': 'error'})
 
+def process_update(update):
+    bot.process_new_updates([telebot.types.Update.de_json(update)])
+
+@app.route('/pool_status', methods=['GET'])
+def pool_status():
+    if not diagnostics_enabled():
+        abort(404)
+    if update_pool is None:
+        return jsonify({'status': 'success', 'mode': EXECUTION_MODE})
+    return jsonify({'status': 'success', 'mode': EXECUTION_MODE, **update_pool.stats()})
+
 @app.route('/set_webhook', methods=['GET'])
 def set_webhook():
     webhook_url = f"https://{request.host}/{TOKEN}"
@@ -1028,6 +1095,7 @@ def home():
 # Добавим отладочную информацию при запуске
 logger.info(f"Бот инициализирован с токеном: {TOKEN[:5]}...")
 logger.info(f"Django установлен: {django.get_version()}")
+logger.info(f"Режим обработки webhook: {EXECUTION_MODE}")
 
 if __name__ == '__main__':
     app.run(debug=True)
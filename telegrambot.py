@@ -1,34 +1,11 @@
+from telebot import types
 from telebot.async_telebot import AsyncTeleBot
-from telebot.asyncio_storage import StateMemoryStorage
 from telebot.asyncio_handler_backends import State, StatesGroup
-import asyncio
+from asgiref.sync import sync_to_async
+import os
 import logging
 
-# Настройка логгирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
-)
-logger = logging.getLogger(__name__)
-
-# Определение состояний бота
-class BotStates(StatesGroup):
-    IDLE = State()                # Ожидание команды
-    WAITING_DEED = State()        # Ожидание описания доброго дела
-    WAITING_POINTS = State()      # Ожидание ввода баллов
-    PARENT_PASSWORD = State()     # Ожидание ввода пароля родителя
-    PARENT_MENU = State()         # Меню родителя
-    PARENT_ADD_CHILD = State()    # Добавление ребенка
-    PARENT_ADD_DEED = State()     # Добавление дела ребенку (ожидание описания)
-    PARENT_ADD_POINTS = State()   # Добавление дела ребенку (ожидание баллов)
-
-# Создаем экземпляр бота
-TOKEN = '7369216646:AAGa1YcPHSTWiG6J1CHHRjJ_1OGlmp4Crh8'  # Замените на ваш токен
-bot = AsyncTeleBot(TOKEN, state_storage=StateMemoryStorage())
+from bot.bootstrap import setup_django
 
 # Настройка логгирования
 logging.basicConfig(
@@ -41,15 +18,17 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Загрузка переменных окружения
-load_dotenv()
-
-# Настройка Django
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "kindness_bot.settings")
-django.setup()
+# Переменные окружения из .env и настройка Django
+setup_django()
 
 # Импорт необходимых модулей из вашего проекта
 from bot.models import Child, KindDeed, Reward, Parent
+from bot.children import find_child_by_name, remember_parent_children
+from bot.db_router import read_replica
+from bot.passwords import ahash_password, averify_parent_password, mark_verified
+from bot.ledger import add_points
+from bot.progress import atake_progress, format_progress
+from bot.telebot_storage import AsyncDjangoStateStorage, state_cache_ttl
 
 # Определение состояний бота
 class BotStates(StatesGroup):
@@ -62,9 +41,12 @@ class BotStates(StatesGroup):
     PARENT_ADD_DEED = State()     # Добавление дела ребенку (ожидание описания)
     PARENT_ADD_POINTS = State()   # Добавление дела ребенку (ожидание баллов)
 
-# Создаем экземпляр бота с использованием хранилища состояний
+# Создаем экземпляр бота с хранилищем состояний в БД (переживает перезапуск)
 TOKEN = os.environ.get('TELEGRAM_TOKEN')
-bot = AsyncTeleBot(TOKEN, state_storage=StateMemoryStorage())
+bot = AsyncTeleBot(
+    TOKEN,
+    state_storage=AsyncDjangoStateStorage(cache_ttl=state_cache_ttl()),
+)
 
 # Функции для работы с Django в асинхронном режиме
 @sync_to_async
@@ -80,11 +62,13 @@ def get_child(telegram_id):
 
 @sync_to_async
 def get_recent_deeds(child, limit=5):
-    return list(child.deeds.order_by('-created_at')[:limit])
+    with read_replica(child.pk):
+        return list(child.deeds.order_by('-created_at')[:limit])
 
 @sync_to_async
 def get_rewards():
-    return list(Reward.objects.all().order_by('points_required'))
+    with read_replica():
+        return list(Reward.objects.all().order_by('points_required'))
 
 @sync_to_async
 def create_deed(child, description, points, parent=None):
@@ -97,9 +81,7 @@ def create_deed(child, description, points, parent=None):
 
 @sync_to_async
 def update_child_points(child, points):
-    child.total_points += points
-    child.save()
-    return child.total_points
+    return add_points(child, points)
 
 @sync_to_async
 def get_or_create_parent(telegram_id, name):
@@ -123,39 +105,31 @@ def verify_parent(telegram_id):
         return None, False
 
 @sync_to_async
-def get_child_by_name(name):
-    try:
-        return Child.objects.get(name=name)
-    except Child.DoesNotExist:
-        return None
-    except Child.MultipleObjectsReturned:
-        return Child.objects.filter(name=name).first()
+def get_child_by_name(name, parent=None):
+    # Без учета регистра и ё/е; при совпадении имен дети родителя идут первыми
+    return find_child_by_name(name, parent)
 
 @sync_to_async
 def is_parent_of_child(parent, child):
     return parent.children.filter(telegram_id=child.telegram_id).exists()
 
-@sync_to_async
-def set_parent_password(parent, password):
+async def set_parent_password(parent, password):
     """Установка пароля родителя"""
-    import hashlib
-    # Простое хеширование пароля
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    parent.password = hashed_password
-    parent.save()
+    parent.password = await ahash_password(password)
+    await sync_to_async(parent.save)()
+    mark_verified(parent)
     return parent
 
-@sync_to_async
-def verify_parent_password(parent, password):
+async def verify_parent_password(parent, password):
     """Проверка пароля родителя"""
-    import hashlib
-    hashed_password = hashlib.sha256(password.encode()).hexdigest()
-    return parent.password == hashed_password
+    return await averify_parent_password(parent, password)
 
 @sync_to_async
 def get_parent_children(parent):
     """Получение списка детей родителя"""
-    return list(parent.children.all())
+    children = list(parent.children.all())
+    remember_parent_children(parent.pk, children)
+    return children
 
 @sync_to_async
 def add_child_to_parent(parent, child):
@@ -321,6 +295,7 @@ async def points_command(message):
         recent_deeds = await get_recent_deeds(child)
         
         text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+        text += format_progress(*await atake_progress(child.pk))
         if recent_deeds:
             text += "📋 *Твои последние добрые дела:*\n"
             for deed in recent_deeds:
@@ -513,6 +488,7 @@ async def process_callback(call):
                 recent_deeds = await get_recent_deeds(child)
                 
                 text = f"🌟 У тебя сейчас *{child.total_points} баллов*! 🌟\n\n"
+                text += format_progress(*await atake_progress(child.pk))
                 if recent_deeds:
                     text += "📋 *Твои последние добрые дела:*\n"
                     for deed in recent_deeds:
@@ -869,7 +845,7 @@ async def process_add_child(message):
         parent = await get_parent(user_id)
         if parent:
             # Проверяем, существует ли ребенок с таким именем
-            child = await get_child_by_name(child_name)
+            child = await get_child_by_name(child_name, parent)
             
             if child:
                 # Если ребенок найден, привязываем его к родителю
@@ -1021,6 +997,5 @@ async def cancel_command(message):
 # Функция для обработки вебхука
 async def process_telegram_update(json_data):
     """Обрабатывает JSON-данные от Telegram webhook"""
-    from telebot.types import Update
-    update = Update.de_json(json_data)
+    update = types.Update.de_json(json_data)
     await bot.process_new_updates([update])
\ No newline at end of file